@@ -0,0 +1,80 @@
+# Helpers shared by the benchmarks: percentiles, peak RSS, and the JSON result files in benchmarks/results/
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+
+
+Results_Dir: Path = Path(__file__).parent / 'results'
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Nearest-rank percentile
+    :param values:
+    :param q: 0 - 100
+    :return:
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def get_peak_rss() -> int | None:
+    """
+    :return: peak resident set size of this process in bytes (None if it cannot be measured, e.g. on Windows)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def get_git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def write_report(benchmark: str, report: dict, output: Path | None = None) -> Path:
+    """
+    Write the report (with the environment of the run) as JSON
+    :param benchmark: e.g. 'download'
+    :param report:
+    :param output: default: benchmarks/results/(benchmark)-(timestamp).json
+    :return: the result file
+    """
+    now = datetime.now()
+    report = {
+        'benchmark': benchmark,
+        'timestamp': now.isoformat(timespec='seconds'),
+        'git_commit': get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        **report,
+    }
+    output = output or Results_Dir / f'{benchmark}-{now:%Y%m%d-%H%M%S}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with output.open('w') as f:
+        json.dump(report, f, indent=2)
+    return output
+
+
+def load_report(file: Path | None) -> dict | None:
+    if not file:
+        return None
+    with file.open() as f:
+        return json.load(f)
+
+
+def format_change(value: float, base_value: float | None) -> str:
+    return f'{value / base_value - 1:>+8.1%}' if base_value else f'{"-":>8}'
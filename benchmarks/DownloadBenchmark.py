@@ -0,0 +1,157 @@
+# Benchmark of the download path (ImageDownloader + the shared httpx client) against the SyntheticCdn.
+#     python -m benchmarks.DownloadBenchmark --images 200 --concurrency 1 4 16 64 --latency 0.05 --error-rate 0.02
+# Every concurrency level runs in a fresh process, so the peak RSS of one level is not inherited by the next.
+# The results are written as JSON into benchmarks/results/ (or --output); give an earlier result with --baseline
+# to print the change of images/s of every concurrency level.
+import argparse
+import logging
+import multiprocessing
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+
+from benchmarks.BenchmarkReport import percentile, get_peak_rss, write_report, load_report, format_change
+from benchmarks.SyntheticCdn import SyntheticCdn, CdnProfile
+
+
+Default_Profile = CdnProfile()
+
+
+def run_level(urls: list[str], settings: dict, dedup: bool, retry_base_delay: float) -> dict:
+    """
+    Download all urls with `settings['download_threads']` threads, like the QThreadPool of the MainWindow does.
+    (Run in a child process)
+    :return: the measurements of this level
+    """
+    from bringmeimage.BringMeImageData import ImageData, ConnectionSettings
+    from bringmeimage.FolderIndex import FolderIndex
+    from bringmeimage.HttpClient import create_httpx_client
+    from bringmeimage.ImageDownloader import ImageDownloader
+    from bringmeimage.RetryPolicy import RetryPolicy, classify_exception
+
+    # one log line per request would be measured as well
+    logging.disable(logging.INFO)
+    connection_settings = ConnectionSettings(**settings)
+    retry_policy = RetryPolicy(base_delay=retry_base_delay, max_delay=retry_base_delay * 8)
+    latencies: list[float] = []
+    counts = {'bytes': 0, 'failed': 0, 'retries': 0}
+    counts_lock = threading.Lock()
+
+    with tempfile.TemporaryDirectory() as save_dir, create_httpx_client(connection_settings) as httpx_client:
+        folder_index = FolderIndex(Path(save_dir))
+
+        def download(url: str) -> None:
+            image_data = ImageData(url=url, src=url, is_parsed=True)
+            downloader = ImageDownloader(httpx_client=httpx_client, image_data=image_data, save_dir=Path(save_dir),
+                                         folder_index=folder_index, dedup=dedup)
+            start = time.perf_counter()
+            attempt = 0
+            while True:
+                try:
+                    save_path = downloader.download()
+                    break
+                except Exception as e:
+                    delay = retry_policy.get_delay(attempt, *classify_exception(e))
+                    with counts_lock:
+                        counts['failed' if delay is None else 'retries'] += 1
+                    if delay is None:
+                        return
+                    attempt += 1
+                    time.sleep(delay)
+            with counts_lock:
+                latencies.append(time.perf_counter() - start)
+                counts['bytes'] += save_path.stat().st_size
+
+        start_all = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=connection_settings.download_threads) as executor:
+            list(executor.map(download, urls))
+        elapsed = time.perf_counter() - start_all
+        folder_index.close()
+
+    peak_rss = get_peak_rss()
+    return {
+        'concurrency': connection_settings.download_threads,
+        'images': len(latencies),
+        'failed': counts['failed'],
+        'retries': counts['retries'],
+        'elapsed_s': round(elapsed, 3),
+        'images_per_s': round(len(latencies) / elapsed, 2),
+        'mb_per_s': round(counts['bytes'] / elapsed / 1024 / 1024, 2),
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 1),
+        'peak_rss_mb': round(peak_rss / 1024 / 1024, 1) if peak_rss is not None else None,
+    }
+
+
+def print_table(results: list[dict], baseline: dict | None = None) -> None:
+    baseline_rates = {result['concurrency']: result['images_per_s'] for result in (baseline or {}).get('results', [])}
+    print(f'{"conc":>5} {"images/s":>9} {"MB/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"failed":>6} {"retries":>7} '
+          f'{"RSS MB":>7}' + (f' {"vs base":>8}' if baseline else ''))
+    for result in results:
+        line = (f'{result["concurrency"]:>5} {result["images_per_s"]:>9} {result["mb_per_s"]:>8} '
+                f'{result["latency_p50_ms"]:>8} {result["latency_p99_ms"]:>8} {result["failed"]:>6} '
+                f'{result["retries"]:>7} {result["peak_rss_mb"] if result["peak_rss_mb"] is not None else "-":>7}')
+        if baseline:
+            line += f' {format_change(result["images_per_s"], baseline_rates.get(result["concurrency"]))}'
+        print(line)
+
+
+def main(argv: list[str] | None = None) -> int:
+    arg_parser = argparse.ArgumentParser(description='Benchmark the download path against a local synthetic CDN')
+    arg_parser.add_argument('--images', type=int, default=200, help='images downloaded at every concurrency level')
+    arg_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    arg_parser.add_argument('--min-size', type=int, default=Default_Profile.min_size, help='bytes')
+    arg_parser.add_argument('--max-size', type=int, default=Default_Profile.max_size, help='bytes')
+    arg_parser.add_argument('--latency', type=float, default=Default_Profile.latency, help='seconds to first byte')
+    arg_parser.add_argument('--latency-jitter', type=float, default=Default_Profile.latency_jitter, help='seconds')
+    arg_parser.add_argument('--bandwidth', type=int, default=Default_Profile.bandwidth,
+                            help='bytes per second of each connection (0: unlimited)')
+    arg_parser.add_argument('--error-rate', type=float, default=Default_Profile.error_rate,
+                            help='fraction of the requests answered with 503')
+    arg_parser.add_argument('--seed', type=int, default=Default_Profile.seed)
+    arg_parser.add_argument('--max-connections', type=int, help='default: the setting in config.py')
+    arg_parser.add_argument('--max-keepalive-connections', type=int, help='default: the setting in config.py')
+    arg_parser.add_argument('--dedup', action='store_true', help='hash the downloads for deduplication')
+    arg_parser.add_argument('--retry-base-delay', type=float, default=0.05, help='seconds')
+    arg_parser.add_argument('--output', type=Path, help='result file (default: benchmarks/results/download-*.json)')
+    arg_parser.add_argument('--baseline', type=Path, help='an earlier result file to compare with')
+    args = arg_parser.parse_args(argv)
+
+    profile = CdnProfile(min_size=args.min_size, max_size=args.max_size, latency=args.latency,
+                         latency_jitter=args.latency_jitter, bandwidth=args.bandwidth, error_rate=args.error_rate,
+                         seed=args.seed)
+    connection_settings = {}
+    if args.max_connections is not None:
+        connection_settings['max_connections'] = args.max_connections
+    if args.max_keepalive_connections is not None:
+        connection_settings['max_keepalive_connections'] = args.max_keepalive_connections
+
+    results = []
+    # spawn: a clean child for every level, whatever the platform default is
+    context = multiprocessing.get_context('spawn')
+    with SyntheticCdn(profile) as cdn:
+        urls = cdn.image_urls(args.images)
+        for concurrency in args.concurrency:
+            with context.Pool(processes=1) as pool:
+                results.append(pool.apply(run_level, (urls, {**connection_settings, 'download_threads': concurrency},
+                                                      args.dedup, args.retry_base_delay)))
+            print(f'concurrency {concurrency}: {results[-1]["images_per_s"]} images/s', file=sys.stderr, flush=True)
+
+    output = write_report('download', {
+        'images': args.images,
+        'profile': asdict(profile),
+        'settings': {**connection_settings, 'dedup': args.dedup, 'retry_base_delay': args.retry_base_delay},
+        'results': results,
+    }, args.output)
+    baseline = load_report(args.baseline)
+    print_table(results, baseline)
+    print(f'Results: {output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
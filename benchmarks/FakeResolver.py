@@ -0,0 +1,71 @@
+import asyncio
+import math
+import random
+import time
+from dataclasses import dataclass, field
+
+from bringmeimage.BringMeImageData import ImageData
+from bringmeimage.Resolver import ImageResolver
+from bringmeimage.RetryPolicy import ClassifiedError, FailureReason
+
+
+@dataclass(slots=True)
+class FakeResolverProfile:
+    # latency of resolve() follows a log-normal distribution: median * exp(sigma * N(0, 1))
+    median_latency: float = 0.1
+    latency_sigma: float = 0.5
+    # time taken by start(), e.g. launching the browser
+    start_latency: float = 0.0
+    # calls served at the same time (the pages of a browser), 0 for unlimited
+    concurrency: int = 0
+    # probability of each failure reason on every call
+    failure_rates: dict[FailureReason, float] = field(default_factory=dict)
+    # probability that the src is not found (resolve() returns None)
+    miss_rate: float = 0.0
+    seed: int = 0
+
+
+class FakeResolver(ImageResolver):
+    """
+    Deterministic in-process resolver for the benchmarks and for trying the pipeline offline.
+    The outcome of every call only depends on the seed, the imageId (or url) and the number of the attempt,
+    so a batch gives the same results whatever order the images are resolved in.
+    """
+    def __init__(self, profile: FakeResolverProfile | None = None, name: str = 'fake') -> None:
+        self.profile = profile or FakeResolverProfile()
+        self.name = name
+        self.attempts: dict[str, int] = {}
+        # perf_counter() when each image was first served (it got one of the `concurrency` slots)
+        self.first_served: dict[str, float] = {}
+        self.semaphore: asyncio.Semaphore | None = None
+        self.calls = 0
+
+    async def start(self) -> None:
+        if self.profile.concurrency > 0:
+            self.semaphore = asyncio.Semaphore(self.profile.concurrency)
+        await asyncio.sleep(self.profile.start_latency)
+
+    async def resolve(self, image_data: ImageData) -> str | None:
+        key = image_data.imageId or image_data.url
+        attempt = self.attempts.get(key, 0)
+        self.attempts[key] = attempt + 1
+        self.calls += 1
+        rng = random.Random(f'{self.profile.seed}:{self.name}:{key}:{attempt}')
+
+        latency = self.profile.median_latency * math.exp(self.profile.latency_sigma * rng.gauss(0, 1))
+        if self.semaphore:
+            async with self.semaphore:
+                self.first_served.setdefault(key, time.perf_counter())
+                await asyncio.sleep(latency)
+        else:
+            self.first_served.setdefault(key, time.perf_counter())
+            await asyncio.sleep(latency)
+
+        draw = rng.random()
+        for reason, rate in self.profile.failure_rates.items():
+            if draw < rate:
+                raise ClassifiedError(reason, message=f'Fake failure: {reason}')
+            draw -= rate
+        if rng.random() < self.profile.miss_rate:
+            return None
+        return f'https://image.civitai.com/fake/{key}.jpeg'
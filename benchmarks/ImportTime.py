@@ -0,0 +1,82 @@
+# Import time of the entry modules, measured with `python -X importtime` in fresh processes.
+#     python -m benchmarks.ImportTime --modules bringmeimage.BringMeImageMainWindow bringmeimage.Headless --runs 5
+# For every module it reports the total import time (the minimum of the runs, the least disturbed one), the slowest
+# packages it pulls in, and whether the modules that should be deferred (Playwright, httpx) were imported anyway.
+# The results are written as JSON into benchmarks/results/ (or --output); give an earlier result with --baseline
+# to print the change of the import time of every module.
+import argparse
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmarks.BenchmarkReport import write_report, load_report, format_change
+
+
+Default_Modules = ('bringmeimage.BringMeImageMainWindow', 'bringmeimage.Headless')
+# only imported when the browser or the first download needs them
+Deferred_Modules = ('playwright', 'httpx')
+Import_Time_Line = re.compile(r'import time:\s+(?P<self>\d+) \|\s+(?P<cumulative>\d+) \| (?P<indent>\s*)(?P<name>\S+)')
+
+
+def measure_once(module: str) -> dict[str, tuple[int, int]]:
+    """
+    :return: {imported module: (self us, cumulative us)} of one fresh process
+    """
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               cwd=Path(__file__).parent.parent, capture_output=True, text=True, check=True)
+    imports = {}
+    for line in completed.stderr.splitlines():
+        if match := Import_Time_Line.match(line):
+            imports[match.group('name')] = (int(match.group('self')), int(match.group('cumulative')))
+    return imports
+
+
+def measure(module: str, runs: int, top: int) -> dict:
+    best_imports = min((measure_once(module) for _ in range(runs)), key=lambda imports: imports[module][1])
+    # the import time of every top-level package (e.g. PySide6, httpx) is the sum of the self time of its modules
+    packages: dict[str, int] = {}
+    for name, (self_us, _) in best_imports.items():
+        package = name.split('.', maxsplit=1)[0]
+        packages[package] = packages.get(package, 0) + self_us
+    return {
+        'module': module,
+        'import_ms': round(best_imports[module][1] / 1000, 1),
+        'modules_imported': len(best_imports),
+        'deferred_imported': [name for name in Deferred_Modules if name in best_imports],
+        'top_packages_ms': {package: round(self_us / 1000, 1)
+                            for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]},
+    }
+
+
+def print_table(results: list[dict], baseline: dict | None = None) -> None:
+    baseline_times = {result['module']: result['import_ms'] for result in (baseline or {}).get('results', [])}
+    for result in results:
+        line = f'{result["module"]}: {result["import_ms"]} ms, {result["modules_imported"]} modules'
+        if baseline:
+            line += f' ({format_change(result["import_ms"], baseline_times.get(result["module"])).strip()})'
+        print(line)
+        if result['deferred_imported']:
+            print(f'    imported at load: {", ".join(result["deferred_imported"])}')
+        for package, milliseconds in result['top_packages_ms'].items():
+            print(f'    {package:<24} {milliseconds:>8} ms')
+
+
+def main(argv: list[str] | None = None) -> int:
+    arg_parser = argparse.ArgumentParser(description='Measure the import time of the entry modules')
+    arg_parser.add_argument('--modules', nargs='+', default=list(Default_Modules))
+    arg_parser.add_argument('--runs', type=int, default=5, help='fresh processes per module (the fastest is kept)')
+    arg_parser.add_argument('--top', type=int, default=10, help='packages listed per module')
+    arg_parser.add_argument('--output', type=Path, help='result file (default: benchmarks/results/import-time-*.json)')
+    arg_parser.add_argument('--baseline', type=Path, help='an earlier result file to compare with')
+    args = arg_parser.parse_args(argv)
+
+    results = [measure(module, max(1, args.runs), args.top) for module in args.modules]
+    output = write_report('import-time', {'runs': args.runs, 'results': results}, args.output)
+    print_table(results, load_report(args.baseline))
+    print(f'Results: {output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# Benchmark of the batch resolve (BatchResolver) for every resolver strategy, offline with FakeResolver backends.
+#     python -m benchmarks.ResolveBenchmark --images 200 --strategies api browser api+browser
+# The fake "api" is fast but misses some images, the fake "browser" is slow to start, serves a few pages at a time
+# and times out now and then. Their profiles can be tuned from the command line to match what is seen live.
+# The results are written as JSON into benchmarks/results/ (or --output); give an earlier result with --baseline
+# to print the change of images/s of every strategy.
+import argparse
+import asyncio
+import logging
+import sys
+import time
+from dataclasses import asdict
+from pathlib import Path
+
+from benchmarks.BenchmarkReport import percentile, write_report, load_report, format_change
+from bringmeimage.BringMeImageData import ImageData
+from benchmarks.FakeResolver import FakeResolver, FakeResolverProfile
+from bringmeimage.Resolver import BatchResolver
+from bringmeimage.RetryPolicy import RetryPolicy, FailureReason
+
+
+Strategies = ('api', 'browser', 'api+browser')
+
+
+async def run_strategy(strategy: str, profiles: dict[str, FakeResolverProfile], images: int,
+                       retry_base_delay: float) -> dict:
+    """
+    Resolve a batch of `images` images with the resolvers of the strategy (e.g. 'api+browser': api first).
+    The latency of an image runs from when a resolver first serves it to its result (retries and fallbacks
+    included), not from the start of the batch: all the resolve tasks start together and wait for a free slot.
+    :return: the measurements of this strategy
+    """
+    resolvers = {name: FakeResolver(profiles[name], name=name) for name in strategy.split('+')}
+    image_datas = [ImageData(url=f'https://civitai.com/images/{image_id}', imageId=str(image_id))
+                   for image_id in range(1, images + 1)]
+    latencies: list[float] = []
+    counts = {'resolved': 0, 'failed': 0}
+    start = time.perf_counter()
+
+    def handle_result(key: str):
+        def handle(image_data: ImageData) -> None:
+            counts[key] += 1
+            served = [resolver.first_served[image_data.imageId] for resolver in resolvers.values()
+                      if image_data.imageId in resolver.first_served]
+            if served:
+                latencies.append(time.perf_counter() - min(served))
+        return handle
+
+    batch_resolver = BatchResolver(cookies=[],
+                                   on_completed=handle_result('resolved'),
+                                   on_failed=handle_result('failed'),
+                                   resolver_factories=[lambda resolver=resolver: resolver
+                                                       for resolver in resolvers.values()],
+                                   retry_policy=RetryPolicy(base_delay=retry_base_delay,
+                                                            max_delay=retry_base_delay * 8))
+    await batch_resolver.resolve_all(image_datas)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'strategy': strategy,
+        'resolved': counts['resolved'],
+        'failed': counts['failed'],
+        'calls': {name: resolver.calls for name, resolver in resolvers.items()},
+        'elapsed_s': round(elapsed, 3),
+        'images_per_s': round(counts['resolved'] / elapsed, 2),
+        'latency_p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'latency_p99_ms': round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def print_table(results: list[dict], baseline: dict | None = None) -> None:
+    baseline_rates = {result['strategy']: result['images_per_s'] for result in (baseline or {}).get('results', [])}
+    print(f'{"strategy":<12} {"images/s":>9} {"resolved":>8} {"failed":>6} {"p50 ms":>9} {"p99 ms":>9} calls'
+          + (f' {"vs base":>8}' if baseline else ''))
+    for result in results:
+        calls = ', '.join(f'{name}={count}' for name, count in result['calls'].items())
+        line = (f'{result["strategy"]:<12} {result["images_per_s"]:>9} {result["resolved"]:>8} {result["failed"]:>6} '
+                f'{result["latency_p50_ms"]:>9} {result["latency_p99_ms"]:>9} {calls}')
+        if baseline:
+            line += f' {format_change(result["images_per_s"], baseline_rates.get(result["strategy"]))}'
+        print(line)
+
+
+def main(argv: list[str] | None = None) -> int:
+    arg_parser = argparse.ArgumentParser(description='Benchmark the batch resolve with fake resolver backends')
+    arg_parser.add_argument('--images', type=int, default=200, help='images resolved by every strategy')
+    arg_parser.add_argument('--strategies', nargs='+', choices=Strategies, default=list(Strategies))
+    arg_parser.add_argument('--api-latency', type=float, default=0.08, help='median seconds of a call')
+    arg_parser.add_argument('--api-miss-rate', type=float, default=0.1)
+    arg_parser.add_argument('--api-error-rate', type=float, default=0.02, help='rate of 5xx')
+    arg_parser.add_argument('--browser-latency', type=float, default=0.4, help='median seconds of a call')
+    arg_parser.add_argument('--browser-start', type=float, default=1.0, help='seconds to launch the browser')
+    arg_parser.add_argument('--browser-concurrency', type=int, default=4, help='pages of the browser')
+    arg_parser.add_argument('--browser-timeout-rate', type=float, default=0.02)
+    arg_parser.add_argument('--browser-miss-rate', type=float, default=0.01)
+    arg_parser.add_argument('--retry-base-delay', type=float, default=0.05, help='seconds')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--output', type=Path, help='result file (default: benchmarks/results/resolve-*.json)')
+    arg_parser.add_argument('--baseline', type=Path, help='an earlier result file to compare with')
+    args = arg_parser.parse_args(argv)
+
+    profiles = {
+        'api': FakeResolverProfile(median_latency=args.api_latency,
+                                   failure_rates={FailureReason.SERVER_ERROR: args.api_error_rate},
+                                   miss_rate=args.api_miss_rate,
+                                   seed=args.seed),
+        'browser': FakeResolverProfile(median_latency=args.browser_latency,
+                                       start_latency=args.browser_start,
+                                       concurrency=args.browser_concurrency,
+                                       failure_rates={FailureReason.TIMEOUT: args.browser_timeout_rate},
+                                       miss_rate=args.browser_miss_rate,
+                                       seed=args.seed),
+    }
+
+    # one log line per failed call would be measured as well
+    logging.disable(logging.INFO)
+    results = []
+    for strategy in args.strategies:
+        results.append(asyncio.run(run_strategy(strategy, profiles, args.images, args.retry_base_delay)))
+        print(f'{strategy}: {results[-1]["images_per_s"]} images/s', file=sys.stderr, flush=True)
+
+    output = write_report('resolve', {
+        'images': args.images,
+        'profiles': {name: asdict(profile) for name, profile in profiles.items()},
+        'settings': {'retry_base_delay': args.retry_base_delay},
+        'results': results,
+    }, args.output)
+    print_table(results, load_report(args.baseline))
+    print(f'Results: {output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+# A local stand-in for the civitai.com REST API (/api/v1/images) that serves canned responses, for the checks of
+# the resolvers and the gallery expansion without the network.
+#     GET /api/v1/images?imageId=(id)                         the image, an empty result, or 404
+#     GET /api/v1/images?postId=(id)&limit=(n)[&cursor=(id)]  a page of the listing of a gallery (also modelVersionId)
+# The listing of a gallery is served page by page (page_delay seconds each), the cursor is the imageId that the next
+# page starts with.
+#     python -m benchmarks.StandInApi
+# checks the ApiResolver and the BatchResolver against it: the results of the canned images, that every gallery
+# is expanded page by page into all of its images exactly once, and that an image already in the list is not
+# expanded again.
+import asyncio
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from bringmeimage.BringMeImageData import ImageData
+from bringmeimage.RetryPolicy import FailureReason, RetryPolicy, classify_exception
+from bringmeimage.Resolver import ApiResolver, BatchResolver, GalleryExpander
+
+
+Canned_Responses = {
+    '2805528': (200, {'items': [{'id': 2805528, 'url': 'https://image.civitai.com/xG1nk/a.jpeg'}]}),
+    '2805533': (200, {'items': []}),
+    '2805540': (404, {'error': 'Not Found'}),
+}
+# query of the listing: imageIds of the gallery
+Canned_Galleries = {
+    ('postId', '1001'): list(range(3000001, 3000013)),
+    ('modelVersionId', '2002'): list(range(4000001, 4000031)),
+}
+
+
+class StandInApi:
+    """
+    Threading HTTP server on 127.0.0.1 (a random port), run it with `with StandInApi() as api: ...`
+    """
+    def __init__(self, page_delay: float = 0.05) -> None:
+        self.page_delay = page_delay
+        self.page_requests = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.create_handler())
+        self.server.daemon_threads = True
+        self.thread: threading.Thread | None = None
+
+    @property
+    def api_url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_port}/api/v1/images'
+
+    @property
+    def cookies(self) -> list[dict]:
+        return [{'name': 'token', 'value': 'stand-in', 'domain': '127.0.0.1', 'path': '/'}]
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> 'StandInApi':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def get_gallery_page(self, query: dict[str, str]) -> tuple[int, dict]:
+        for (name, value), image_ids in Canned_Galleries.items():
+            if query.get(name) == value:
+                break
+        else:
+            return 404, {'error': 'Not Found'}
+        self.page_requests += 1
+        time.sleep(self.page_delay)
+        start = image_ids.index(int(query['cursor'])) if 'cursor' in query else 0
+        page = image_ids[start:start + int(query.get('limit', 100))]
+        metadata = {}
+        if start + len(page) < len(image_ids):
+            metadata['nextCursor'] = str(image_ids[start + len(page)])
+        return 200, {'items': [{'id': image_id, 'url': f'https://image.civitai.com/xG1nk/{image_id}.jpeg'}
+                               for image_id in page],
+                     'metadata': metadata}
+
+    def create_handler(self) -> type[BaseHTTPRequestHandler]:
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+                if 'imageId' in query:
+                    status, payload = Canned_Responses.get(query['imageId'], (404, {'error': 'Not Found'}))
+                else:
+                    status, payload = api.get_gallery_page(query)
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+async def check_api_resolver(api: StandInApi) -> None:
+    resolver = ApiResolver(cookies=api.cookies, api_url=api.api_url)
+    await resolver.start()
+    try:
+        image_data = ImageData(url='https://civitai.com/images/2805528', imageId='2805528')
+        assert await resolver.resolve(image_data) == 'https://image.civitai.com/xG1nk/a.jpeg'
+        image_data = ImageData(url='https://civitai.com/images/2805533', imageId='2805533')
+        assert await resolver.resolve(image_data) is None
+        image_data = ImageData(url='https://civitai.com/images/2805540', imageId='2805540')
+        try:
+            await resolver.resolve(image_data)
+        except Exception as e:
+            assert classify_exception(e)[0] == FailureReason.CLIENT_ERROR, e
+        else:
+            raise AssertionError('404 is not raised')
+    finally:
+        await resolver.close()
+
+
+async def check_gallery_expansion(api: StandInApi, page_size: int) -> None:
+    completed: list[ImageData] = []
+    failed: list[ImageData] = []
+    expanded: dict[str, list[int]] = {}
+    batch_resolver = BatchResolver(
+        cookies=api.cookies,
+        on_completed=completed.append,
+        on_failed=failed.append,
+        on_expanded=lambda gallery, image_datas: expanded.setdefault(gallery.url, []).append(len(image_datas)),
+        resolver_factories=[lambda: ApiResolver(cookies=api.cookies, api_url=api.api_url)],
+        gallery_expander_factory=lambda: GalleryExpander(cookies=api.cookies, api_url=api.api_url,
+                                                         page_size=page_size),
+        retry_policy=RetryPolicy(max_retries=0))
+    post = ImageData(url='https://civitai.com/posts/1001', gallery='postId=1001')
+    model_version = ImageData(url='https://civitai.com/models/3003?modelVersionId=2002', gallery='modelVersionId=2002')
+    missing = ImageData(url='https://civitai.com/posts/9999', gallery='postId=9999')
+    image = ImageData(url='https://civitai.com/images/2805528', imageId='2805528')
+    await batch_resolver.resolve_all([post, model_version, missing, image])
+
+    for gallery, image_ids in ((post, Canned_Galleries[('postId', '1001')]),
+                               (model_version, Canned_Galleries[('modelVersionId', '2002')])):
+        pages = [len(image_ids[start:start + page_size]) for start in range(0, len(image_ids), page_size)]
+        assert expanded.get(gallery.url) == pages, (gallery.url, expanded.get(gallery.url), pages)
+    completed_urls = [image_data.url for image_data in completed]
+    assert len(completed_urls) == len(set(completed_urls)), 'an image is reported twice'
+    expected_urls = {f'https://civitai.com/images/{image_id}'
+                     for image_ids in Canned_Galleries.values() for image_id in image_ids}
+    assert expected_urls | {post.url, model_version.url, image.url} == set(completed_urls)
+    assert all(image_data.src for image_data in completed if not image_data.gallery)
+    assert [image_data.url for image_data in failed] == [missing.url], failed
+
+
+async def check_listed_image_in_gallery(api: StandInApi) -> None:
+    """
+    An image of the gallery that is already in the list (e.g. parsed from the cache) is not reported as new
+    """
+    completed: list[ImageData] = []
+    expanded: list[ImageData] = []
+    batch_resolver = BatchResolver(
+        cookies=api.cookies,
+        on_completed=completed.append,
+        on_failed=lambda image_data: None,
+        on_expanded=lambda gallery, image_datas: expanded.extend(image_datas),
+        resolver_factories=[lambda: ApiResolver(cookies=api.cookies, api_url=api.api_url)],
+        gallery_expander_factory=lambda: GalleryExpander(cookies=api.cookies, api_url=api.api_url),
+        retry_policy=RetryPolicy(max_retries=0))
+    image_ids = Canned_Galleries[('postId', '1001')]
+    listed = ImageData(url=f'https://civitai.com/images/{image_ids[0]}', imageId=str(image_ids[0]),
+                       src=f'https://image.civitai.com/xG1nk/{image_ids[0]}.jpeg', is_parsed=True)
+    post = ImageData(url='https://civitai.com/posts/1001', gallery='postId=1001')
+    # only the unparsed entries are resolved, the rest of the list is passed as listed_urls
+    await batch_resolver.resolve_all([post], [listed.url, post.url])
+
+    expanded_urls = [image_data.url for image_data in expanded]
+    assert listed.url not in expanded_urls, 'the listed image is reported as new'
+    assert len(expanded_urls) == len(image_ids) - 1, expanded_urls
+    assert listed.url not in [image_data.url for image_data in completed]
+
+
+def main() -> int:
+    with StandInApi() as api:
+        asyncio.run(check_api_resolver(api))
+        start = time.perf_counter()
+        asyncio.run(check_gallery_expansion(api, page_size=10))
+        print(f'OK: {api.page_requests} gallery pages in {time.perf_counter() - start:.2f}s')
+        asyncio.run(check_listed_image_in_gallery(api))
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,113 @@
+# Startup benchmark: time from launching the program to the first shown main window, in fresh processes.
+#     python -m benchmarks.StartupBenchmark --runs 10
+#     python -m benchmarks.StartupBenchmark --runs 10 --platform offscreen    (without a display, e.g. on CI)
+# Every run starts `python -m benchmarks.StartupBenchmark --child`, which goes through the same steps as main.py and
+# reports as soon as the event loop has shown the window. The time-to-first-window is measured by this process from
+# the launch (so the start of the interpreter is included); the child adds the split into import / construct / show,
+# and whether Playwright or httpx had been imported by then.
+# The results are written as JSON into benchmarks/results/ (or --output); give an earlier result with --baseline
+# to print the change.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from benchmarks.BenchmarkReport import percentile, write_report, load_report, format_change
+
+
+Deferred_Modules = ('playwright', 'httpx')
+
+
+def run_child() -> int:
+    """
+    Start the GUI like main.py and print the timings (JSON) once the first window has been shown
+    """
+    start = time.perf_counter()
+    from PySide6.QtCore import QTimer
+    from PySide6.QtWidgets import QApplication
+    from bringmeimage.BringMeImageMainWindow import MainWindow
+    imported = time.perf_counter()
+
+    app = QApplication([])
+    window = MainWindow()
+    constructed = time.perf_counter()
+    window.show()
+
+    def report() -> None:
+        shown = time.perf_counter()
+        print(json.dumps({
+            'import_s': imported - start,
+            'construct_s': constructed - imported,
+            'show_s': shown - constructed,
+            'deferred_imported': [name for name in Deferred_Modules if name in sys.modules],
+        }), flush=True)
+        app.quit()
+
+    # runs after the show and the first paint have been processed by the event loop
+    QTimer.singleShot(0, report)
+    app.exec()
+    return 0
+
+
+def run_once(platform: str | None) -> dict:
+    env = dict(os.environ)
+    if platform:
+        env['QT_QPA_PLATFORM'] = platform
+    launched = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.StartupBenchmark', '--child'],
+                               cwd=Path(__file__).parent.parent, env=env, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True)
+    line = process.stdout.readline()
+    first_window = time.perf_counter() - launched
+    process.wait()
+    if not line:
+        raise RuntimeError(f'The child exited with {process.returncode} before showing the window')
+    return {'first_window_s': first_window, **json.loads(line)}
+
+
+def main(argv: list[str] | None = None) -> int:
+    arg_parser = argparse.ArgumentParser(description='Measure the time to the first shown main window')
+    arg_parser.add_argument('--runs', type=int, default=10)
+    arg_parser.add_argument('--platform', help='QT_QPA_PLATFORM of the child, e.g. offscreen')
+    arg_parser.add_argument('--output', type=Path, help='result file (default: benchmarks/results/startup-*.json)')
+    arg_parser.add_argument('--baseline', type=Path, help='an earlier result file to compare with')
+    arg_parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = arg_parser.parse_args(argv)
+    if args.child:
+        return run_child()
+
+    runs = []
+    for run in range(max(1, args.runs)):
+        runs.append(run_once(args.platform))
+        print(f'run {run + 1}: {runs[-1]["first_window_s"] * 1000:.0f} ms', file=sys.stderr, flush=True)
+
+    first_windows = [run['first_window_s'] for run in runs]
+    result = {
+        'first_window_p50_ms': round(percentile(first_windows, 50) * 1000, 1),
+        'first_window_min_ms': round(min(first_windows) * 1000, 1),
+        'first_window_max_ms': round(max(first_windows) * 1000, 1),
+        **{f'{step}_mean_ms': round(statistics.mean(run[f'{step}_s'] for run in runs) * 1000, 1)
+           for step in ('import', 'construct', 'show')},
+        'deferred_imported': sorted({name for run in runs for name in run['deferred_imported']}),
+    }
+    output = write_report('startup', {'runs': len(runs), 'platform': args.platform, 'result': result}, args.output)
+
+    baseline = load_report(args.baseline)
+    print(f'time to first window: p50 {result["first_window_p50_ms"]} ms '
+          f'(min {result["first_window_min_ms"]}, max {result["first_window_max_ms"]})'
+          + (f' {format_change(result["first_window_p50_ms"], baseline["result"]["first_window_p50_ms"])}'
+             if baseline else ''))
+    print(f'    import {result["import_mean_ms"]} ms, construct {result["construct_mean_ms"]} ms, '
+          f'show {result["show_mean_ms"]} ms (mean)')
+    if result['deferred_imported']:
+        print(f'    imported before the first window: {", ".join(result["deferred_imported"])}')
+    print(f'Results: {output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
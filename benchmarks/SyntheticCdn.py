@@ -0,0 +1,166 @@
+# A local stand-in for the image CDN (image.civitai.com) that serves synthetic images, for the benchmarks.
+#     GET /images/(name).png    the content is derived from the name, so it is the same on every request
+# The size, the latency (time to first byte), the bandwidth of each connection and the error rate are configurable.
+# Range requests (bytes=N-) are answered with 206, with a strong ETag, like the CDN.
+import hashlib
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+@dataclass(slots=True)
+class CdnProfile:
+    min_size: int = 200 * 1024
+    max_size: int = 2 * 1024 * 1024
+    # time to first byte (seconds), a value between latency and latency + latency_jitter
+    latency: float = 0.02
+    latency_jitter: float = 0.03
+    # bytes per second of each connection, 0 for unlimited
+    bandwidth: int = 0
+    # fraction of the requests that are answered with 503 (with Retry-After: 0)
+    error_rate: float = 0.0
+    seed: int = 0
+
+
+class SyntheticCdn:
+    """
+    Threading HTTP server on 127.0.0.1 (a random port), run it with `with SyntheticCdn(profile) as cdn: ...`
+    """
+    Write_Chunk_Size = 16 * 1024
+
+    def __init__(self, profile: CdnProfile = CdnProfile()) -> None:
+        self.profile = profile
+        self.random = random.Random(profile.seed)
+        self.random_lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.create_handler())
+        self.server.daemon_threads = True
+        self.thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def image_urls(self, count: int) -> list[str]:
+        return [f'{self.base_url}/images/{index:08d}.png' for index in range(count)]
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> 'SyntheticCdn':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def get_size(self, name: str) -> int:
+        # the size only depends on the name and the seed
+        rng = random.Random(f'{self.profile.seed}:{name}')
+        return rng.randint(self.profile.min_size, max(self.profile.min_size, self.profile.max_size))
+
+    def get_content(self, name: str, size: int) -> bytes:
+        block = hashlib.sha256(f'{self.profile.seed}:{name}'.encode()).digest() * 128
+        return (block * (size // len(block) + 1))[:size]
+
+    def draw(self) -> tuple[float, bool]:
+        """
+        :return: (latency, whether the request fails)
+        """
+        with self.random_lock:
+            self.requests += 1
+            latency = self.profile.latency + self.random.random() * self.profile.latency_jitter
+            failed = self.random.random() < self.profile.error_rate
+            if failed:
+                self.errors += 1
+        return latency, failed
+
+    def create_handler(self) -> type[BaseHTTPRequestHandler]:
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_GET(self):
+                latency, failed = cdn.draw()
+                time.sleep(latency)
+                name = self.path.split('?', maxsplit=1)[0].rsplit('/', maxsplit=1)[-1]
+                if failed:
+                    self.send_response(503)
+                    self.send_header('Retry-After', '0')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                size = cdn.get_size(name)
+                content = cdn.get_content(name, size)
+                etag = f'"{hashlib.md5(content).hexdigest()}"'
+                start = 0
+                range_header = self.headers.get('Range', '')
+                if range_header.startswith('bytes=') and self.headers.get('If-Range', etag) == etag:
+                    start = int(range_header[len('bytes='):].split('-', maxsplit=1)[0] or 0)
+                    if start >= size:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{size}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(size - start))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.write_throttled(content[start:])
+
+            def write_throttled(self, body: bytes) -> None:
+                bandwidth = cdn.profile.bandwidth
+                chunk_size = cdn.Write_Chunk_Size
+                begin = time.perf_counter()
+                try:
+                    for offset in range(0, len(body), chunk_size):
+                        self.wfile.write(body[offset:offset + chunk_size])
+                        if bandwidth:
+                            ahead = (offset + chunk_size) / bandwidth - (time.perf_counter() - begin)
+                            if ahead > 0:
+                                time.sleep(ahead)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    # Serve until interrupted, e.g. for trying the GUI or headless.py against it
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description='Serve synthetic images on 127.0.0.1')
+    arg_parser.add_argument('--count', type=int, default=10, help='number of URLs to print')
+    arg_parser.add_argument('--error-rate', type=float, default=0.0)
+    arg_parser.add_argument('--bandwidth', type=int, default=0, help='bytes per second of each connection')
+    args = arg_parser.parse_args()
+
+    with SyntheticCdn(CdnProfile(error_rate=args.error_rate, bandwidth=args.bandwidth)) as synthetic_cdn:
+        print('\n'.join(synthetic_cdn.image_urls(args.count)), flush=True)
+        try:
+            synthetic_cdn.thread.join()
+        except KeyboardInterrupt:
+            pass
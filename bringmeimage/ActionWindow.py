@@ -1,50 +1,267 @@
-from PySide6.QtWidgets import QDialog, QVBoxLayout, QPushButton, QWidget, QTextBrowser
+from collections import Counter
+from pathlib import Path
 
-from bringmeimage.BringMeImageData import ImageData
+from PySide6.QtCore import Signal, Qt, QAbstractTableModel, QModelIndex, QPersistentModelIndex, QUrl
+from PySide6.QtGui import QDesktopServices
+from PySide6.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QWidget, QFormLayout, QSpinBox,
+                               QDoubleSpinBox, QCheckBox, QDialogButtonBox, QComboBox, QLabel, QTableView,
+                               QAbstractItemView, QHeaderView, QFileDialog)
+
+from bringmeimage.BringMeImageData import ImageData, ConnectionSettings
+from bringmeimage.HttpClient import HTTP2_Available
+
+
+class FailedUrlsModel(QAbstractTableModel):
+    """
+    Table model of the failed images (reason, url, image src). The view only asks for the visible rows,
+    and the rows can be narrowed down to one failure reason.
+    """
+    Headers = ('Reason', 'URL', 'Image src')
+
+    def __init__(self, image_datas: list[ImageData], parent=None):
+        super().__init__(parent)
+        self.image_datas = image_datas
+        self.reason_filter: str | None = None
+        self.rows: list[ImageData] = image_datas
+
+    @staticmethod
+    def get_reason(image_data: ImageData) -> str:
+        return image_data.fail_reason or 'Unknown'
+
+    def rowCount(self, parent: QModelIndex | QPersistentModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent: QModelIndex | QPersistentModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.Headers)
+
+    def data(self, index: QModelIndex | QPersistentModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        image_data = self.rows[index.row()]
+        return (self.get_reason(image_data), image_data.url, image_data.src)[index.column()]
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.Headers[section]
+        return None
+
+    def count_reasons(self) -> Counter:
+        return Counter(self.get_reason(image_data) for image_data in self.image_datas)
+
+    def set_reason_filter(self, reason: str | None) -> None:
+        """
+        :param reason: None for all reasons
+        :return:
+        """
+        self.beginResetModel()
+        self.reason_filter = reason
+        if reason is None:
+            self.rows = self.image_datas
+        else:
+            self.rows = [image_data for image_data in self.image_datas if self.get_reason(image_data) == reason]
+        self.endResetModel()
+
+    def remove_image_datas(self, image_datas: list[ImageData]) -> None:
+        removed_urls = {image_data.url for image_data in image_datas}
+        self.image_datas = [image_data for image_data in self.image_datas if image_data.url not in removed_urls]
+        self.set_reason_filter(self.reason_filter)
 
 
 class FailedUrlsWindow(QDialog):
     """
-    QDialog window for displaying the failed download image links
+    QDialog window for displaying the failed download image links.
+    The selected links can be sent back to the "Clip list" (re-queue) or exported to a text file (one URL per line).
     """
+    Requeue_Failed_Urls_Signal = Signal(list)
+
     def __init__(self, process_failed_url_dict: dict, parent=None):
         super().__init__(parent)
         self.setWindowTitle('Failed url')
-        self.setGeometry(100, 100, 600, 400)
+        self.setGeometry(100, 100, 800, 500)
+
+        # hint: process_failed_url_dict = {image_url1: ImageData1(dataclass), image_url2: ImageData2(dataclass),}
+        self.process_failed_url_dict = process_failed_url_dict
+        self.failed_urls_model = FailedUrlsModel(list(process_failed_url_dict.values()), parent=self)
 
         v_layout = QVBoxLayout(self)
-        self.display_text_browser = QTextBrowser(self)
-        self.display_text_browser.setOpenExternalLinks(True)
-        v_layout.addWidget(self.display_text_browser)
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel('Reason'))
+        self.reason_combo_box = QComboBox()
+        self.reason_combo_box.currentIndexChanged.connect(self.change_reason_filter)
+        filter_layout.addWidget(self.reason_combo_box, stretch=1)
+        v_layout.addLayout(filter_layout)
+
+        self.table_view = QTableView(self)
+        self.table_view.setModel(self.failed_urls_model)
+        self.table_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.table_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table_view.setWordWrap(False)
+        # Fixed row heights, so the view never measures the rows that are not visible
+        self.table_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table_view.verticalHeader().hide()
+        self.table_view.horizontalHeader().setStretchLastSection(True)
+        self.table_view.horizontalHeader().setHighlightSections(False)
+        self.table_view.setColumnWidth(0, 160)
+        self.table_view.setColumnWidth(1, 300)
+        self.table_view.doubleClicked.connect(self.open_url)
+        v_layout.addWidget(self.table_view)
+
+        button_layout = QHBoxLayout()
+        self.count_label = QLabel()
+        button_layout.addWidget(self.count_label, stretch=1)
+        select_all_button = QPushButton('Select all')
+        select_all_button.clicked.connect(self.table_view.selectAll)
+        button_layout.addWidget(select_all_button)
+        self.requeue_button = QPushButton('Re-queue selected')
+        self.requeue_button.clicked.connect(self.requeue_selected)
+        button_layout.addWidget(self.requeue_button)
+        self.export_button = QPushButton('Export selected')
+        self.export_button.clicked.connect(self.export_selected)
+        button_layout.addWidget(self.export_button)
+        v_layout.addLayout(button_layout)
+
+        self.table_view.selectionModel().selectionChanged.connect(self.update_buttons)
+        self.update_reason_combo_box()
 
         # Move the QDialog window to the center of the main window
         if self.parentWidget():
             center_point = self.parentWidget().geometry().center()
             self.move(center_point.x() - self.width() / 2, center_point.y() - self.height() / 2)
 
-        self.process_failed_url_dict = process_failed_url_dict
+    def update_reason_combo_box(self) -> None:
+        """
+        List "All" and every failure reason (with the number of links), and keep the current choice if it still exists
+        :return:
+        """
+        current_reason = self.failed_urls_model.reason_filter
+        self.reason_combo_box.blockSignals(True)
+        self.reason_combo_box.clear()
+        self.reason_combo_box.addItem(f'All ({len(self.failed_urls_model.image_datas)})', None)
+        for reason, count in self.failed_urls_model.count_reasons().most_common():
+            self.reason_combo_box.addItem(f'{reason} ({count})', reason)
+        index = self.reason_combo_box.findData(current_reason)
+        self.reason_combo_box.setCurrentIndex(max(index, 0))
+        self.reason_combo_box.blockSignals(False)
+        self.change_reason_filter()
 
-        if self.process_failed_url_dict:
-            self.show_failed_urls_to_text_browser()
+    def change_reason_filter(self) -> None:
+        self.failed_urls_model.set_reason_filter(self.reason_combo_box.currentData())
+        self.update_buttons()
 
-    def show_failed_urls_to_text_browser(self):
-        # hint: process_failed_url_dict = {image_url1: ImageData1(dataclass), image_url2: ImageData2(dataclass),}
-        # hint: version_id_info = {self.version_id: dataclass(version_name, model_id, model_name, creator)}
-        for img_url, image_data in self.process_failed_url_dict.items():
-            self.display_text_browser.append(img_url)
-            self.display_text_browser.append('')
-            self.display_text_browser.insertHtml(f'<a href="{image_data.src}">{image_data.src}</a><br>')
-        #     model_version_name = self.get_model_version_name(image_data.modelVersionId)
-        #     if model_version_name in self.classified_process_failed_url_dict:
-        #         self.classified_process_failed_url_dict[model_version_name].append(image_url)
-        #     else:
-        #         self.classified_process_failed_url_dict[model_version_name] = [image_url]
-        #
-        # for name, url_list in self.classified_process_failed_url_dict.items():
-        #     self.display_text_browser.append(name)
-        #     self.display_text_browser.append('')
-        #     for url in url_list:
-        #         self.display_text_browser.insertHtml(f'<a href="{url}">{url}</a><br>')
+    def get_selected_rows(self) -> list[int]:
+        # read the ranges of the selection, a list of QModelIndex for thousands of rows is slow
+        rows = set()
+        for selection_range in self.table_view.selectionModel().selection():
+            rows.update(range(selection_range.top(), selection_range.bottom() + 1))
+        return sorted(rows)
+
+    def update_buttons(self) -> None:
+        selected_count = len(self.get_selected_rows())
+        self.count_label.setText(f'{selected_count} / {self.failed_urls_model.rowCount()} selected')
+        self.requeue_button.setEnabled(selected_count > 0)
+        self.export_button.setEnabled(selected_count > 0)
+
+    def get_selected_image_datas(self) -> list[ImageData]:
+        return [self.failed_urls_model.rows[row] for row in self.get_selected_rows()]
+
+    def open_url(self, index: QModelIndex) -> None:
+        image_data = self.failed_urls_model.rows[index.row()]
+        QDesktopServices.openUrl(QUrl(image_data.src if index.column() == 2 and image_data.src else image_data.url))
+
+    def requeue_selected(self) -> None:
+        """
+        Remove the selected links from the failed record and send them back to the "Clip list" of the main window
+        :return:
+        """
+        image_datas = self.get_selected_image_datas()
+        for image_data in image_datas:
+            self.process_failed_url_dict.pop(image_data.url, None)
+        self.failed_urls_model.remove_image_datas(image_datas)
+        self.update_reason_combo_box()
+        self.Requeue_Failed_Urls_Signal.emit(image_datas)
+
+    def export_selected(self) -> None:
+        """
+        Write the selected links to a text file, one URL per line
+        :return:
+        """
+        filename, _ = QFileDialog.getSaveFileName(self, 'Export the failed URLs', str(Path.home() / 'failed_urls.txt'),
+                                                  'Text (*.txt)')
+        if not filename:
+            return
+        with open(filename, 'w', encoding='utf-8') as f:
+            for image_data in self.get_selected_image_datas():
+                f.write(f'{image_data.url}\n')
+
+    # Overrides the reject() to allow users to cancel the dialog using the ESC key
+    def reject(self):
+        self.done(0)
+
+
+class ConnectionSettingsWindow(QDialog):
+    """
+    QDialog window for adjusting the thread pool and the connection pool of the HTTP client used for downloading
+    """
+    Connection_Settings_Changed_Signal = Signal(ConnectionSettings)
+
+    def __init__(self, settings: ConnectionSettings, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('Connection settings')
+        self.setGeometry(100, 100, 360, 240)
+
+        form_layout = QFormLayout(self)
+        self.download_threads_spin_box = self.create_spin_box(1, 256, settings.download_threads)
+        form_layout.addRow('Download threads', self.download_threads_spin_box)
+        self.max_connections_spin_box = self.create_spin_box(1, 1000, settings.max_connections)
+        form_layout.addRow('Max connections', self.max_connections_spin_box)
+        self.max_keepalive_spin_box = self.create_spin_box(0, 1000, settings.max_keepalive_connections)
+        form_layout.addRow('Max keep-alive connections', self.max_keepalive_spin_box)
+
+        self.keepalive_expiry_spin_box = QDoubleSpinBox()
+        self.keepalive_expiry_spin_box.setRange(0, 3600)
+        self.keepalive_expiry_spin_box.setSuffix(' s')
+        self.keepalive_expiry_spin_box.setValue(settings.keepalive_expiry)
+        form_layout.addRow('Keep-alive expiry', self.keepalive_expiry_spin_box)
+
+        self.http2_check_box = QCheckBox('HTTP/2' if HTTP2_Available else 'HTTP/2 (needs the "h2" package)')
+        self.http2_check_box.setChecked(settings.http2 and HTTP2_Available)
+        self.http2_check_box.setEnabled(HTTP2_Available)
+        form_layout.addRow('Multiplexing', self.http2_check_box)
+
+        self.prewarm_spin_box = self.create_spin_box(0, 64, settings.prewarm_connections)
+        form_layout.addRow('Pre-warmed connections', self.prewarm_spin_box)
+
+        button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        button_box.accepted.connect(self.accept)
+        button_box.rejected.connect(self.reject)
+        form_layout.addRow(button_box)
+
+        # Move the QDialog window to the center of the main window
+        if self.parentWidget():
+            center_point = self.parentWidget().geometry().center()
+            self.move(center_point.x() - self.width() / 2, center_point.y() - self.height() / 2)
+
+    @staticmethod
+    def create_spin_box(minimum: int, maximum: int, value: int) -> QSpinBox:
+        spin_box = QSpinBox()
+        spin_box.setRange(minimum, maximum)
+        spin_box.setValue(value)
+        return spin_box
+
+    def accept(self) -> None:
+        """
+        Notify the main window of the new settings
+        :return:
+        """
+        settings = ConnectionSettings(download_threads=self.download_threads_spin_box.value(),
+                                      max_connections=self.max_connections_spin_box.value(),
+                                      max_keepalive_connections=self.max_keepalive_spin_box.value(),
+                                      keepalive_expiry=self.keepalive_expiry_spin_box.value(),
+                                      http2=self.http2_check_box.isChecked(),
+                                      prewarm_connections=self.prewarm_spin_box.value())
+        self.Connection_Settings_Changed_Signal.emit(settings)
+        self.done(0)
 
     # Overrides the reject() to allow users to cancel the dialog using the ESC key
     def reject(self):
@@ -1,6 +1,13 @@
-from dataclasses import dataclass
+import threading
+from dataclasses import dataclass, fields
+from typing import TYPE_CHECKING
 
-from PySide6.QtWidgets import QHBoxLayout, QProgressBar
+from bringmeimage.config import (Download_Threads, Http_Max_Connections, Http_Max_Keepalive_Connections,
+                                 Http_Keepalive_Expiry, Http_Http2, Http_Prewarm_Connections)
+
+# Only the GUI needs Qt, the data classes are shared with the headless mode
+if TYPE_CHECKING:
+    from PySide6.QtWidgets import QHBoxLayout, QProgressBar
 
 
 @dataclass(slots=True)
@@ -9,12 +16,70 @@ class ImageData:
     src: str = ''
     imageId: str = ''
     is_parsed: bool = False
+    fail_reason: str = ''
+    # a model, model-version or post page: the query of its image listing (e.g. 'modelVersionId=123'),
+    # the entry is expanded into the entries of its images
+    gallery: str = ''
+
+    def __setstate__(self, state: tuple) -> None:
+        # The records (*.bringmeimage) saved by older versions lack the fields that were added later
+        _, slots_state = state
+        for field in fields(self):
+            setattr(self, field.name, slots_state.get(field.name, field.default))
+
+
+class ProgressCounter:
+    """
+    Counters of a task (e.g. Downloading), updated from any thread and read by the GUI at a fixed rate,
+    so a large batch does not queue one GUI event per image
+    """
+    def __init__(self, quantity: int) -> None:
+        self.lock = threading.Lock()
+        self.quantity = quantity
+        self.completed = 0
+        self.executed = 0
+        self.failed_image_datas: list[ImageData] = []
+
+    def add_result(self, is_completed: bool, failed_image_data: ImageData | None = None) -> None:
+        with self.lock:
+            self.executed += 1
+            if is_completed:
+                self.completed += 1
+            elif failed_image_data:
+                self.failed_image_datas.append(failed_image_data)
+
+    def add_quantity(self, count: int) -> None:
+        with self.lock:
+            self.quantity += count
+
+    def snapshot(self) -> tuple[int, int, int]:
+        """
+        :return: (completed, executed, quantity)
+        """
+        with self.lock:
+            return self.completed, self.executed, self.quantity
+
+    def take_failed(self) -> list[ImageData]:
+        """
+        :return: the failed ImageData reported since the last call
+        """
+        with self.lock:
+            failed_image_datas, self.failed_image_datas = self.failed_image_datas, []
+        return failed_image_datas
 
 
 @dataclass(slots=True)
 class ProgressBarData:
-    progress_layout: QHBoxLayout
-    progress_bar_widget: QProgressBar
-    completed: int
-    executed: int
-    quantity: int
+    progress_layout: 'QHBoxLayout'
+    progress_bar_widget: 'QProgressBar'
+    counter: ProgressCounter
+
+
+@dataclass(slots=True)
+class ConnectionSettings:
+    download_threads: int = Download_Threads
+    max_connections: int = Http_Max_Connections
+    max_keepalive_connections: int = Http_Max_Keepalive_Connections
+    keepalive_expiry: float = Http_Keepalive_Expiry
+    http2: bool = Http_Http2
+    prewarm_connections: int = Http_Prewarm_Connections
@@ -1,27 +1,46 @@
-import contextlib
 import json
-import pickle
 from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING, Iterator
+from urllib.parse import urlparse
 
-import httpx
-from playwright.sync_api import sync_playwright
-from playwright.sync_api._generated import BrowserContext, Page
-from PySide6.QtCore import Qt, QThreadPool, QEvent, Signal, Slot
-from PySide6.QtGui import QTextCharFormat, QMouseEvent
+from PySide6.QtCore import Qt, QThreadPool, QEvent, QTimer, Signal, Slot
+from PySide6.QtGui import QMouseEvent
 from PySide6.QtWidgets import QMainWindow, QFileDialog, QMessageBox, QHBoxLayout, QLabel, QProgressBar, QApplication
 
 from bringmeimage.BringMeImage_UI import Ui_MainWindow
 from bringmeimage.StartClipWindow import StartClipWindow
 from bringmeimage.LoginWindow import LoginWindow
-from bringmeimage.ActionWindow import FailedUrlsWindow
-from bringmeimage.Downloader import DownloadRunner
-from bringmeimage.BringMeImageData import ImageData, ProgressBarData
-from bringmeimage.config import Login_Check_Url, Login_Check_Title, Chrome_Path
-
-
-Main_Path: Path = Path(__file__).parent
-Cookie_File: Path = Main_Path / 'cookie' / 'cookies.json'
+from bringmeimage.BrowserLogin import BrowserSession, LoginRunner
+from bringmeimage.ActionWindow import FailedUrlsWindow, ConnectionSettingsWindow
+from bringmeimage.Downloader import DownloadRunner, PrewarmRunner
+from bringmeimage.OperationLog import OperationLogModel
+from bringmeimage.HttpClient import create_httpx_client, HTTP2_Available
+from bringmeimage.Importer import ImportRunner
+from bringmeimage.ResolveCache import ResolveCache
+from bringmeimage.FolderIndex import FolderIndex
+from bringmeimage.Metrics import metrics, write_batch_metrics
+from bringmeimage.LoggerConf import new_batch_id
+from bringmeimage.ClipRecord import RecordHeader, RecordError, create_record, save_record, load_record
+from bringmeimage.BringMeImageData import ImageData, ProgressBarData, ProgressCounter, ConnectionSettings
+from bringmeimage.config import (Login_At_Startup, Chrome_Path, Parse_Concurrency,
+                                 Http_Prewarm_Origins, Download_Skip_Existing, Main_Path, Cookie_File,
+                                 Resolve_Cache_File, Download_Dir, Progress_Refresh_Rate, Metrics_Dir,
+                                 Metrics_Keep_Batches, Metrics_Prometheus_File)
+
+
+# Playwright and httpx are only imported when the browser or the first download needs them (and the resolvers when
+# civitai.com images are resolved), not at startup
+if TYPE_CHECKING:
+    import httpx
+    from playwright.sync_api import Playwright, Browser, BrowserContext
+
+# Threads of the pool of the login, the resolve (ParseRunner), the prewarm and the import, which is kept apart from
+# the download pool so that they never wait for the downloads (nor the downloads for them)
+Worker_Pool_Threads = 4
+
+# The "Clip list" is written here while clipping, and removed once it is downloaded, saved or cleared
+Record_Journal_File: Path = Main_Path.parent / 'autosave.bringmeimage'
 
 
 class MainWindow(QMainWindow):
@@ -31,32 +50,56 @@ class MainWindow(QMainWindow):
         super(MainWindow, self).__init__()
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
+        self.operation_log = OperationLogModel(parent=self)
+        self.operation_log.attach_view(self.ui.operation_log_view)
 
+        self.connection_settings = ConnectionSettings()
         self.pool = QThreadPool.globalInstance()
-        self.httpx_client = httpx.Client()
-        self.playwright = None
-        self.browser = None
-        self.context: BrowserContext | None = None
-        self.driver_page: Page | None = None
-        self.browser_temp = None
-        self.context_temp = None
+        self.pool.setMaxThreadCount(self.connection_settings.download_threads)
+        self.worker_pool = QThreadPool(self)
+        self.worker_pool.setMaxThreadCount(Worker_Pool_Threads)
+        self.httpx_client: 'httpx.Client | None' = None
+        # the browser of the manual login (the login with the saved cookies is checked by a LoginRunner)
+        self.playwright: 'Playwright | None' = None
+        self.browser_temp: 'Browser | None' = None
+        self.context_temp: 'BrowserContext | None' = None
         self.is_login_civitai: bool = False
-
-        self.save_dir: Path = Main_Path.parent / 'DownloadTemp'
+        self.civitai_cookies: list[dict] = []
+        # the browser that is logged in, reused by the resolvers of every batch
+        self.browser_session: BrowserSession | None = None
+        # the login being checked in the background, and whether the manual login follows if it fails
+        self.login_runner: LoginRunner | None = None
+        self.manual_login_if_failed: bool = False
+        self.resolve_cache = ResolveCache(Resolve_Cache_File)
+        self.folder_index: FolderIndex | None = None
+
+        self.save_dir: Path = Download_Dir
         if not self.save_dir.exists():
             self.save_dir.mkdir(parents=True)
         self.ui.folder_line_edit.setText(str(self.save_dir))
         self.urls: dict[str: ImageData] = {}
         self.urls_parsed: dict[str: ImageData] = {}
         self.urls_failed: dict[str: ImageData] = {}
+        self.is_parsing: bool = False
+        self.imported_count: int = 0
+        # number of images expanded from each gallery URL in this batch
+        self.expanded_counts: dict[str, int] = {}
+        # the batch started by the last "GO", tagged in the log records and the metrics
+        self.batch_id: str = ''
         self.process_failed_urls: dict = {}
 
         self.progress_bar_task_name: list = []
         self.progress_bar_data: dict = {}
+        # The progress bars are refreshed from their counters at a fixed rate, not once per image
+        self.progress_timer = QTimer(self)
+        self.progress_timer.setInterval(1000 // Progress_Refresh_Rate)
+        self.progress_timer.timeout.connect(self.refresh_progress)
 
         self.ui.actionLoadClipboardFile.triggered.connect(self.load_clipboard_file)
+        self.ui.actionImportUrlFile.triggered.connect(self.import_url_file)
         self.ui.actionShowFailUrl.triggered.connect(self.show_failed_url)
         self.ui.actionSaveTheRecord.triggered.connect(self.save_the_record)
+        self.ui.actionConnectionSettings.triggered.connect(self.show_connection_settings)
         self.ui.folder_line_edit.mousePressEvent = self.select_storage_folder
         self.ui.login_label.setStyleSheet('color: red;')
         self.ui.login_label.mousePressEvent = self.click_login_label
@@ -64,9 +107,21 @@ class MainWindow(QMainWindow):
         self.ui.clip_push_button.clicked.connect(self.start_clip_process)
         self.ui.go_push_button.clicked.connect(self.click_go_push_button)
 
+        if Record_Journal_File.exists():
+            self.operation_browser_insert_html(
+                color='pink',
+                string=f'The "Clip list" of the last session was not saved. Load "{Record_Journal_File.name}" '
+                       f'at Option > Load Clipboard File to restore it.',
+                prefix=True
+            )
+
+        if Login_At_Startup and Cookie_File.exists():
+            self.start_login()
+
     def load_clipboard_file(self) -> None:
         """
-        Read the *.bringmeimage file (pickle) and load the corresponding configuration
+        Read the *.bringmeimage file and load the corresponding configuration.
+        (The pickle file of older versions is converted in memory, and written in the current format when it is saved)
         :return:
         """
         if self.urls or self.process_failed_urls:
@@ -89,27 +144,32 @@ class MainWindow(QMainWindow):
         file_path, _ = QFileDialog.getOpenFileName(self, 'Select File', '', filter_str, options=QFileDialog.ReadOnly)
         if file_path:
             try:
-                with open(file_path, 'rb') as f:
-                    record = pickle.load(f)
-            except pickle.UnpicklingError:
+                header, image_datas = load_record(Path(file_path))
+                filename = file_path.rsplit('/', maxsplit=1)[-1]
+                self.process_the_record(filename, header, image_datas)
+            except (RecordError, OSError) as e:
                 self.operation_browser_insert_html(
                     color='pink',
-                    string='The file appears to have been modified and is no longer readable',
+                    string=f'The file is not readable. {e}',
                     prefix=True
                 )
-            else:
-                filename = file_path.rsplit('/', maxsplit=1)[-1]
-                self.process_the_record(filename, record)
 
-    def process_the_record(self, filename: str, record: tuple[Path, bool, dict]) -> None:
+    def process_the_record(self, filename: str, header: RecordHeader, image_datas: Iterator[ImageData]) -> None:
+        """
+        Apply the header of the record and add its entries to the "Clip list" as they are read
+        :param filename:
+        :param header:
+        :param image_datas: the entries, read lazily from the file (none is read if the record is refused)
+        :return:
+        """
         self.operation_browser_insert_html(
             color='cyan',
             string=f'Loading clipboard from "{filename}"',
             prefix=True
         )
 
-        save_dir, civitai_is_checked, urls = record
-        if civitai_is_checked and not self.is_login_civitai:
+        save_dir, civitai_is_checked = header.save_dir, header.for_civitai
+        if civitai_is_checked and not self.is_login_civitai and not self.login_runner:
             self.operation_browser_insert_html(
                 color='pink',
                 string='There are images from civitai, you need to login first',
@@ -121,14 +181,67 @@ class MainWindow(QMainWindow):
         self.ui.folder_line_edit.setText(str(save_dir))
         self.ui.civitai_check_box.setChecked(civitai_is_checked)
         self.ui.civitai_check_box.setEnabled(False)
-        self.urls = urls
+        self.urls = {}
+        for image_data in image_datas:
+            self.urls[image_data.url] = image_data
 
-        self.ui.operation_text_browser.append(
+        self.operation_log.append(
             f'{datetime.now().strftime("%H:%M:%S")} '
             f'[ {len(self.urls)} URLs ] | Click "GO" to start downloading'
             f' or "Clip" to continue adding.'
         )
 
+    def import_url_file(self) -> None:
+        """
+        Add every URL (that matches the parsing rules) of a text, HTML or bookmarks-export file to the "Clip list".
+        The file is scanned in the thread pool.
+        :return:
+        """
+        filter_str = 'Text, HTML or bookmarks (*.txt *.html *.htm *.json);;All files (*)'
+        file_path, _ = QFileDialog.getOpenFileName(self, 'Select File', '', filter_str, options=QFileDialog.ReadOnly)
+        if not file_path:
+            return
+
+        self.operation_browser_insert_html(
+            color='cyan',
+            string=f'Importing URLs from "{Path(file_path).name}"',
+            prefix=True
+        )
+        self.imported_count = 0
+        self.freeze_main_window()
+        importer = ImportRunner(file=Path(file_path), for_civitai=self.ui.civitai_check_box.isChecked())
+        importer.signals.import_batch_signal.connect(self.handle_import_batch_signal)
+        importer.signals.import_finished_signal.connect(self.handle_import_finished_signal)
+        self.worker_pool.start(importer)
+
+    @Slot(list)
+    def handle_import_batch_signal(self, image_datas: list) -> None:
+        for image_data in image_datas:
+            if image_data.url not in self.urls:
+                self.urls[image_data.url] = image_data
+                self.imported_count += 1
+
+    @Slot(str)
+    def handle_import_finished_signal(self, error: str) -> None:
+        self.freeze_main_window(unfreeze=True)
+        if error:
+            self.operation_browser_insert_html(
+                color='pink',
+                string=f'The file is not readable. {error}',
+                prefix=True
+            )
+        if self.urls:
+            self.ui.civitai_check_box.setEnabled(False)
+        if self.imported_count:
+            create_record(Record_Journal_File,
+                          RecordHeader(save_dir=self.save_dir, for_civitai=self.ui.civitai_check_box.isChecked()),
+                          self.urls.values(), compress=False)
+        self.operation_log.append(
+            f'{datetime.now().strftime("%H:%M:%S")} '
+            f'[ {len(self.urls)} URLs ] | Import {self.imported_count} new URLs, click "GO" to start downloading'
+            f' or "Clip" to continue adding.'
+        )
+
     def show_failed_url(self) -> None:
         """
         Pop up a QDialog window displaying the failed download image links
@@ -136,9 +249,30 @@ class MainWindow(QMainWindow):
         """
         failed_url_window = FailedUrlsWindow(process_failed_url_dict=self.process_failed_urls,
                                              parent=self)
+        failed_url_window.Requeue_Failed_Urls_Signal.connect(self.handle_requeue_failed_urls_signal)
         failed_url_window.setWindowModality(Qt.ApplicationModal)
         failed_url_window.show()
 
+    @Slot(list)
+    def handle_requeue_failed_urls_signal(self, image_datas: list) -> None:
+        """
+        Put the failed images back into the "Clip list", so "GO" tries them again
+        (an image whose src is already known is only downloaded again)
+        :param image_datas:
+        :return:
+        """
+        for image_data in image_datas:
+            image_data.fail_reason = ''
+            self.urls[image_data.url] = image_data
+        self.ui.civitai_check_box.setEnabled(False)
+        create_record(Record_Journal_File,
+                      RecordHeader(save_dir=self.save_dir, for_civitai=self.ui.civitai_check_box.isChecked()),
+                      self.urls.values(), compress=False)
+        self.operation_log.append(
+            f'{datetime.now().strftime("%H:%M:%S")} '
+            f'[ {len(self.urls)} URLs ] | Re-queue {len(image_datas)} failed URLs, click "GO" to start downloading.'
+        )
+
     def save_the_record(self) -> None:
         """
         Save the record without exiting the program
@@ -154,14 +288,9 @@ class MainWindow(QMainWindow):
         if reply == QMessageBox.No:
             return
 
-        record = (self.save_dir,
-                  self.ui.civitai_check_box.isChecked(),
-                  self.urls,
-                  )
-        with open(f'{datetime.now().strftime("%m-%d-%H:%M:%S")}.bringmeimage', 'wb') as f:
-            pickle.dump(record, f)
-
+        self.save_record_file()
         self.urls.clear()
+        Record_Journal_File.unlink(missing_ok=True)
         self.freeze_main_window(unfreeze=True)
         self.clear_progress_bar()
 
@@ -171,6 +300,46 @@ class MainWindow(QMainWindow):
             prefix=True
         )
 
+    def show_connection_settings(self) -> None:
+        """
+        Pop up a QDialog window for adjusting the connection settings of downloading
+        :return:
+        """
+        settings_window = ConnectionSettingsWindow(settings=self.connection_settings, parent=self)
+        settings_window.Connection_Settings_Changed_Signal.connect(self.handle_connection_settings_changed_signal)
+        settings_window.setWindowModality(Qt.ApplicationModal)
+        settings_window.show()
+
+    @Slot(ConnectionSettings)
+    def handle_connection_settings_changed_signal(self, settings: ConnectionSettings) -> None:
+        """
+        Rebuild the HTTP client with the new connection pool (the option is disabled while downloading)
+        :param settings:
+        :return:
+        """
+        self.connection_settings = settings
+        self.pool.setMaxThreadCount(settings.download_threads)
+        if self.httpx_client:
+            # the next download creates the client with the new settings
+            self.httpx_client.close()
+            self.httpx_client = None
+        self.operation_browser_insert_html(
+            color='cyan',
+            string=f'Connection settings: {settings.download_threads} threads, '
+                   f'{settings.max_connections} connections ({settings.max_keepalive_connections} keep-alive), '
+                   f'HTTP/2 {"on" if settings.http2 and HTTP2_Available else "off"}',
+            prefix=True
+        )
+
+    def save_record_file(self) -> None:
+        """
+        Save self.urls as a *.bringmeimage file
+        :return:
+        """
+        save_record(Path(f'{datetime.now().strftime("%m-%d-%H:%M:%S")}.bringmeimage'),
+                    RecordHeader(save_dir=self.save_dir, for_civitai=self.ui.civitai_check_box.isChecked()),
+                    self.urls.values())
+
     def select_storage_folder(self, event: QMouseEvent) -> None:
         """
         Set the path of a folder for saving images
@@ -183,69 +352,75 @@ class MainWindow(QMainWindow):
 
     def click_login_label(self, event) -> None:
         if event.button() == Qt.LeftButton and event.type() == QEvent.MouseButtonDblClick:
-            if not self.driver_page:
+            if self.is_login_civitai:
                 self.operation_browser_insert_html(
                     color='green',
-                    string='Wait for set up the browser. (The program may experience a brief freezing)',
+                    string='Already logged in.',
                     prefix=True,
                 )
-                self.freeze_main_window()
-                self.driver_page = self.get_browser_page_for_civitai()
-            else:
+            elif self.login_runner:
+                self.manual_login_if_failed = True
                 self.operation_browser_insert_html(
                     color='green',
-                    string='Already logged in.',
+                    string='Logging in with the saved cookies, the manual login follows if it fails.',
                     prefix=True,
                 )
+            elif Cookie_File.exists():
+                self.start_login(manual_login_if_failed=True)
+            else:
+                self.manual_login()
 
-    def get_browser_page_for_civitai(self) -> Page | None:
+    def start_login(self, manual_login_if_failed: bool = False) -> None:
         """
-        Retrieve the browser page with successful automatic login, otherwise prompt the user to log in manually
+        Check the login with the saved cookies in the background, the window stays usable (e.g. for clipping)
+        and the result comes back by handle_login_finished_signal
+        :param manual_login_if_failed: pop up the window for manual login if it fails
         :return:
         """
-        QApplication.processEvents()
-        if not self.playwright:
-            self.playwright = sync_playwright().start()
-        self.browser = self.playwright.chromium.launch(executable_path=Chrome_Path,
-                                                       headless=True,
-                                                       args=['--disable-blink-features=AutomationControlled'])
-        self.context = self.browser.new_context()
-        driver_page = self.set_browser_for_civitai()
-
-        if not driver_page:
-            self.context.close()
-            self.browser.close()
-            self.manual_login()
-            return
-
-        self.freeze_main_window(unfreeze=True)
-        return driver_page
-
-    def set_browser_for_civitai(self) -> Page | None:
+        self.manual_login_if_failed = manual_login_if_failed
+        self.ui.login_label.setStyleSheet('color: orange;')
+        self.operation_browser_insert_html(
+            color='green',
+            string='Logging in to civitai.com with the saved cookies in the background.',
+            prefix=True,
+        )
+        if not self.browser_session:
+            self.browser_session = BrowserSession()
+        self.login_runner = LoginRunner(browser_session=self.browser_session)
+        self.login_runner.signals.login_finished_signal.connect(self.handle_login_finished_signal)
+        self.worker_pool.start(self.login_runner)
+
+    @Slot(bool, list, str)
+    def handle_login_finished_signal(self, is_logged_in: bool, cookies: list, error: str) -> None:
         """
-        Load cookies, update cookies if login authentication is successful
+        Keep the cookies of the logged-in context for the resolvers, otherwise prompt the user to log in manually
+        (if requested)
+        :param is_logged_in:
+        :param cookies:
+        :param error: the error message ('' if the login check ran to the end)
         :return:
         """
-        with contextlib.suppress(Exception):
-            with Cookie_File.open() as f:
-                cookies = json.load(f)
-                self.context.add_cookies(cookies)
+        self.login_runner = None
+        if is_logged_in:
+            self.is_login_civitai = True
+            self.civitai_cookies = cookies
+            self.ui.login_label.setStyleSheet('color: green;')
+            self.operation_browser_insert_html(
+                color='green',
+                string='Logged in to civitai.com.',
+                prefix=True,
+            )
+            return
 
-            driver_page = self.context.new_page()
-            driver_page.goto('https://civitai.com/', wait_until='domcontentloaded')
-            driver_page.goto(Login_Check_Url, wait_until='domcontentloaded')
-            if driver_page.title() == Login_Check_Title:
-                cookies = self.context.cookies()
-                with Cookie_File.open('w') as f:
-                    json.dump(cookies, f)
-                self.ui.login_label.setStyleSheet('color: green;')
-                self.operation_browser_insert_html(
-                    color='green',
-                    string='Browser for civitai is already loaded.',
-                    prefix=True,
-                )
-                self.is_login_civitai = True
-                return driver_page
+        self.ui.login_label.setStyleSheet('color: red;')
+        self.operation_browser_insert_html(
+            color='pink',
+            string=f'Failed to log in with the saved cookies{f" ({error})" if error else ""}.'
+                   + ('' if self.manual_login_if_failed else ' Double-click "Login" to log in manually.'),
+            prefix=True,
+        )
+        if self.manual_login_if_failed:
+            self.manual_login()
 
     def manual_login(self) -> None:
         """
@@ -267,6 +442,9 @@ class MainWindow(QMainWindow):
         Open the browser for the user to log in manually
         :return:
         """
+        if not self.playwright:
+            from playwright.sync_api import sync_playwright
+            self.playwright = sync_playwright().start()
         self.browser_temp = self.playwright.chromium.launch(executable_path=Chrome_Path,
                                                             headless=False,
                                                             args=['--disable-blink-features=AutomationControlled'])
@@ -295,12 +473,7 @@ class MainWindow(QMainWindow):
         Re-login for authentication using the newly obtained cookies
         :return:
         """
-        self.driver_page = self.get_browser_page_for_civitai()
-        if not self.driver_page:
-            self.operation_browser_insert_html(
-                color='red',
-                string='Attempted to re-login but failed authentication.'
-            )
+        self.start_login(manual_login_if_failed=True)
 
     @Slot()
     def handle_login_window_reject_signal(self) -> None:
@@ -327,6 +500,7 @@ class MainWindow(QMainWindow):
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
             self.urls.clear()
+            Record_Journal_File.unlink(missing_ok=True)
             self.freeze_main_window(unfreeze=True)
             self.clear_progress_bar()
             self.operation_browser_insert_html(
@@ -358,7 +532,8 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, 'Warning', 'Set the storage folder first')
             return
 
-        if self.ui.civitai_check_box.isChecked() and not self.is_login_civitai:
+        # the clipping can start while the login is checked in the background
+        if self.ui.civitai_check_box.isChecked() and not self.is_login_civitai and not self.login_runner:
             self.operation_browser_insert_html(
                 color='pink',
                 string='Because CivitAI is checked, you need to login first.',
@@ -366,8 +541,13 @@ class MainWindow(QMainWindow):
             )
             return
 
+        # The journal starts with the current list, and the clip window appends every new URL to it
+        create_record(Record_Journal_File,
+                      RecordHeader(save_dir=self.save_dir, for_civitai=self.ui.civitai_check_box.isChecked()),
+                      self.urls.values(), compress=False)
         start_clip_window = StartClipWindow(for_civitai=self.ui.civitai_check_box.isChecked(),
                                             urls=self.urls,
+                                            record_file=Record_Journal_File,
                                             parent=self)
         start_clip_window.Start_Clip_Close_Window_Signal.connect(self.handle_clip_close_window_signal)
         # Only after this QDialog is closed, the main window can be used again
@@ -389,7 +569,7 @@ class MainWindow(QMainWindow):
             self.urls = urls
             self.freeze_main_window(unfreeze=True)
             self.ui.civitai_check_box.setEnabled(False)
-            self.ui.operation_text_browser.append(
+            self.operation_log.append(
                 f'{datetime.now().strftime("%H:%M:%S")} '
                 f'[ {len(self.urls)} URLs ] | Click "GO" to start downloading'
                 f' or "Clip" to continue adding.'
@@ -411,80 +591,199 @@ class MainWindow(QMainWindow):
             )
             return
 
-        if self.ui.civitai_check_box.isChecked() and not self.driver_page:
+        if self.ui.civitai_check_box.isChecked() and not self.is_login_civitai:
             self.operation_browser_insert_html(
                 color='pink',
-                string='Login first',
+                string='Logging in to civitai.com, click "GO" again once it is logged in' if self.login_runner
+                else 'Login first',
                 prefix=True
             )
             return
 
         self.clear_progress_bar()
         self.freeze_main_window()
+        metrics.reset()
+        self.batch_id = new_batch_id()
+        if Download_Skip_Existing:
+            self.skip_downloaded_urls()
+            if not self.urls:
+                self.freeze_main_window(unfreeze=True)
+                return
+        self.prewarm_connections()
 
         if self.ui.civitai_check_box.isChecked():
             self.get_image_info()
         else:
             self.start_download_image()
 
+    def skip_downloaded_urls(self) -> None:
+        """
+        Remove the images that have already been downloaded into the storage folder (by the manifest of the folder)
+        :return:
+        """
+        folder_index = self.get_folder_index()
+        downloaded_urls = [img_url for img_url, img_data in self.urls.items() if folder_index.is_downloaded(img_data)]
+        for img_url in downloaded_urls:
+            del self.urls[img_url]
+
+        if downloaded_urls:
+            self.operation_browser_insert_html(
+                color='cyan',
+                string=f'Skip {len(downloaded_urls)} URLs that have already been downloaded into the folder',
+                prefix=True
+            )
+
+    def prewarm_connections(self) -> None:
+        """
+        Open connections to the image hosts in the background while the batch is being prepared
+        :return:
+        """
+        origins = {f'{parsed.scheme}://{parsed.netloc}'
+                   for img_data in self.urls.values() if img_data.src and (parsed := urlparse(img_data.src)).netloc}
+        if self.ui.civitai_check_box.isChecked():
+            origins.update(Http_Prewarm_Origins)
+
+        connections = self.connection_settings.prewarm_connections
+        if self.connection_settings.http2 and HTTP2_Available:
+            connections = min(connections, 1)
+        self.worker_pool.start(PrewarmRunner(httpx_client=self.get_httpx_client(), origins=sorted(origins),
+                                             connections=connections))
+
     def get_image_info(self) -> None:
         """
-        Retrieves the detailed information (src) of the images
+        Retrieves the detailed information (src) of the images.
+        The image pages are browsed concurrently in a ParseRunner, and each image is handed to the downloader
+        as soon as its src is known, so browsing and downloading run at the same time.
         :return:
         """
-        self.ui.operation_text_browser.append(
+        self.operation_log.append(
             f'{datetime.now().strftime("%H:%M:%S")} '
             f'[ {len(self.urls)} URLs ] | '
-            f'(Browsing) Waiting to retrieve relevant information for each image.'
+            f'(Browsing) Waiting to retrieve relevant information for each image, '
+            f'the images are downloaded as soon as it is retrieved.'
         )
+        # A gallery is one result of "Browsing", its images are added to both progress bars as they are expanded
+        gallery_count = sum(1 for img_data in self.urls.values() if img_data.gallery)
         self.add_progress_bar(task_name='Browsing', count=len(self.urls))
-
+        self.add_progress_bar(task_name='Downloading', count=len(self.urls) - gallery_count)
+        self.urls_parsed.clear()
+        self.urls_failed.clear()
+        self.expanded_counts.clear()
+        self.resolve_cache.reset_stats()
+        self.is_parsing = True
+
+        unparsed_image_datas = []
+        cached_srcs = self.resolve_cache.get_many(img_data.imageId for img_data in self.urls.values()
+                                                  if not img_data.is_parsed)
         for img_url, img_data in self.urls.items():
-            if img_data.is_parsed:
-                self.urls_parsed[img_url] = img_data
-                self.update_process_bar(task_name='Browsing', is_completed=True)
-                QApplication.processEvents()
-                continue
-
-            img_src = self.parse_image_scr(img_url)
-            if img_src:
+            if not img_data.is_parsed and (img_src := cached_srcs.get(img_data.imageId)):
                 img_data.src = img_src
                 img_data.is_parsed = True
+
+            if img_data.is_parsed:
                 self.urls_parsed[img_url] = img_data
+                self.update_process_bar(task_name='Browsing', is_completed=True)
+                self.start_download_runner(img_data)
             else:
-                self.urls_failed[img_url] = img_data
+                unparsed_image_datas.append(img_data)
+
+        if self.resolve_cache.lookups:
+            self.operation_browser_insert_html(
+                color='green',
+                string=f'Resolve cache: {self.resolve_cache.hits} / {self.resolve_cache.lookups} hits '
+                       f'({self.resolve_cache.hit_rate:.0%})',
+                prefix=True
+            )
+
+        if not unparsed_image_datas:
+            self.image_parse_completed()
+            return
 
+        # asyncio and the resolvers are only needed for civitai.com
+        from bringmeimage.Parser import ParseRunner
+        parser = ParseRunner(cookies=self.civitai_cookies,
+                             image_datas=unparsed_image_datas,
+                             concurrency=Parse_Concurrency,
+                             skip_image=self.get_folder_index().is_downloaded if Download_Skip_Existing else None,
+                             batch_id=self.batch_id,
+                             browser_session=self.browser_session,
+                             listed_urls=list(self.urls))
+        parser.signals.parse_results_signal.connect(self.handle_parse_results_signal)
+        parser.signals.parse_expanded_signal.connect(self.handle_parse_expanded_signal)
+        parser.signals.parse_finished_signal.connect(self.image_parse_completed)
+        self.worker_pool.start(parser)
+
+    @Slot(ImageData, list)
+    def handle_parse_expanded_signal(self, gallery: ImageData, image_datas: list) -> None:
+        """
+        Add the images of a page of the gallery to the list and to the progress bars,
+        their results are reported right after this
+        :param gallery:
+        :param image_datas: the new images (not in the list yet)
+        :return:
+        """
+        for image_data in image_datas:
+            self.urls[image_data.url] = image_data
+        self.expanded_counts[gallery.url] = self.expanded_counts.get(gallery.url, 0) + len(image_datas)
+        self.progress_bar_data['Browsing'].counter.add_quantity(len(image_datas))
+        self.progress_bar_data['Downloading'].counter.add_quantity(len(image_datas))
+
+    @Slot(list, list)
+    def handle_parse_results_signal(self, completed: list, failed: list) -> None:
+        """
+        Handle a chunk of the results of the ParseRunner, the resolved src are written to the cache once per chunk
+        :param completed: ImageData
+        :param failed: ImageData
+        :return:
+        """
+        for image_data in completed:
+            self.parse_completed(image_data)
+        for image_data in failed:
+            self.parse_failed(image_data)
+        self.resolve_cache.flush()
+
+    def parse_completed(self, image_data: ImageData) -> None:
+        if image_data.gallery:
+            # every image of the gallery is in the list now
+            del self.urls[image_data.url]
             self.update_process_bar(task_name='Browsing', is_completed=True)
-            QApplication.processEvents()
-
-        self.image_parse_completed()
-
-    def parse_image_scr(self, img_url: str) -> str:
-        # wait DOM
-        self.driver_page.goto(img_url, wait_until='domcontentloaded')
-        # wait <img>
-        self.driver_page.wait_for_selector(selector=".relative.flex.size-full.items-center.justify-center img",
-                                           timeout=60000)
-        img_src = None
-        for i in range(2):
-            img_src = self.driver_page.eval_on_selector(
-                selector=".relative.flex.size-full.items-center.justify-center img",
-                expression="img => img.src")
-            if img_src or i:
-                break
-            self.driver_page.wait_for_timeout(500)  # wait 0.5 second
-
-        return img_src
+            self.operation_browser_insert_html(
+                color='green',
+                string=f'Expand {image_data.url} into {self.expanded_counts.get(image_data.url, 0)} new images',
+                prefix=True
+            )
+            return
+
+        self.urls_parsed[image_data.url] = image_data
+        self.resolve_cache.put(image_data.imageId, image_data.src)
+        self.update_process_bar(task_name='Browsing', is_completed=True)
+        self.start_download_runner(image_data)
+
+    def parse_failed(self, image_data: ImageData) -> None:
+        self.urls_failed[image_data.url] = image_data
+        self.update_process_bar(task_name='Browsing', is_completed=False)
+        if image_data.gallery:
+            # The images expanded so far are downloaded, the gallery is not counted in "Downloading"
+            return
+        # There is nothing to download for this image
+        self.progress_bar_data['Downloading'].counter.add_quantity(-1)
 
     def image_parse_completed(self):
-        if not self.urls:
+        self.is_parsing = False
+        self.resolve_cache.evict()
+        # (nothing is parsed nor failed if the galleries only have images that are already downloaded)
+        if not self.urls_parsed and self.urls_failed:
+            self.progress_timer.stop()
+            self.refresh_progress_bars()
             self.operation_browser_insert_html(
                 color='pink',
-                string='Unable to resolve any image download links from the provided image URLs.<br>'
+                string='Unable to resolve any image download links from the provided image URLs. '
                        'Click "Go" to retry or close the main program and save the list. '
                        'You can execute it again once the server responds properly.',
                 prefix=True
             )
+            self.save_batch_metrics()
+            self.freeze_main_window(unfreeze=True)
             return
 
         if self.urls_failed:
@@ -494,35 +793,94 @@ class MainWindow(QMainWindow):
                        f'you can check them later in "Failed URLs"',
                 prefix=True
             )
-            self.process_failed_urls = self.urls_failed
+            self.process_failed_urls.update(self.urls_failed)
 
-        QApplication.processEvents()
-        self.start_download_image()
+        # The downloads may have all finished before the browsing did
+        self.refresh_progress()
 
     def start_download_image(self) -> None:
-        self.ui.operation_text_browser.append(
+        # The images whose src could not be retrieved are already in the failed record
+        image_datas = [img_data for img_data in self.urls.values() if img_data.is_parsed]
+        self.operation_log.append(
             f'{datetime.now().strftime("%H:%M:%S")} '
             f'[ {len(self.urls)} URLs ] | '
-            f'(Downloading) Start downloading images'
+            f'(Downloading) Start downloading {len(image_datas)} images'
         )
-        self.add_progress_bar(task_name='Downloading', count=len(self.urls))
+        self.add_progress_bar(task_name='Downloading', count=len(image_datas))
 
-        for img_data in self.urls.values():
-            downloader = DownloadRunner(httpx_client=self.httpx_client, image_data=img_data, save_dir=self.save_dir)
-            downloader.signals.download_failed_signal.connect(self.handle_download_failed_signal)
-            downloader.signals.download_completed_signal.connect(self.handle_download_completed_signal)
-            self.pool.start(downloader)
+        for img_data in image_datas:
+            self.start_download_runner(img_data)
 
-    def handle_download_failed_signal(self, image_data: ImageData) -> None:
-        self.process_failed_urls.update({image_data.url: image_data})
-        self.handle_download_task(is_completed=False)
+    def get_httpx_client(self) -> 'httpx.Client':
+        """
+        Create the HTTP client shared by the downloads the first time it is needed (kept until the settings change)
+        :return:
+        """
+        if not self.httpx_client:
+            self.httpx_client = create_httpx_client(self.connection_settings)
+        return self.httpx_client
 
-    def handle_download_completed_signal(self) -> None:
-        self.handle_download_task(is_completed=True)
+    def get_folder_index(self) -> FolderIndex:
+        """
+        Open the index of the current storage folder (kept open until the folder changes)
+        :return:
+        """
+        if not self.folder_index or self.folder_index.folder != self.save_dir:
+            if self.folder_index:
+                self.folder_index.close()
+            self.folder_index = FolderIndex(self.save_dir)
+        return self.folder_index
+
+    def start_download_runner(self, image_data: ImageData, attempt: int = 0) -> None:
+        # The result is counted in the progress counter (read by refresh_progress), only a retry needs a signal
+        downloader = DownloadRunner(httpx_client=self.get_httpx_client(), image_data=image_data, save_dir=self.save_dir,
+                                    attempt=attempt, folder_index=self.get_folder_index(),
+                                    progress_counter=self.progress_bar_data['Downloading'].counter,
+                                    batch_id=self.batch_id)
+        downloader.signals.download_retry_signal.connect(self.handle_download_retry_signal)
+        self.pool.start(downloader)
+
+    @Slot(ImageData, int, float)
+    def handle_download_retry_signal(self, image_data: ImageData, attempt: int, delay: float) -> None:
+        """
+        Re-queue the download after the backoff delay, the progress bar is only updated by its final result
+        :param image_data:
+        :param attempt: number of the retry
+        :param delay: seconds
+        :return:
+        """
+        QTimer.singleShot(int(delay * 1000), lambda: self.start_download_runner(image_data, attempt))
 
-    def handle_download_task(self, is_completed: bool) -> None:
-        progress_bar_info = self.update_process_bar(task_name='Downloading', is_completed=is_completed)
-        if progress_bar_info.executed == progress_bar_info.quantity:
+    def refresh_progress(self) -> None:
+        """
+        Called at Progress_Refresh_Rate while a batch runs: refresh the progress bars, collect the failed downloads
+        and check whether the batch is finished
+        :return:
+        """
+        self.refresh_progress_bars()
+        if 'Downloading' in self.progress_bar_data:
+            for image_data in self.progress_bar_data['Downloading'].counter.take_failed():
+                self.process_failed_urls[image_data.url] = image_data
+            self.check_download_finished()
+
+    def refresh_progress_bars(self) -> None:
+        for progress_bar_info in self.progress_bar_data.values():
+            completed, _, quantity = progress_bar_info.counter.snapshot()
+            progress_bar_widget = progress_bar_info.progress_bar_widget
+            if progress_bar_widget.maximum() != quantity:
+                progress_bar_widget.setMaximum(quantity)
+            if progress_bar_widget.value() != completed:
+                progress_bar_widget.setValue(completed)
+
+    def check_download_finished(self) -> None:
+        """
+        Once the browsing is over and every download has a result, show the summary and clear the record list
+        :return:
+        """
+        progress_bar_info: ProgressBarData = self.progress_bar_data['Downloading']
+        completed, executed, quantity = progress_bar_info.counter.snapshot()
+        if not self.is_parsing and executed == quantity:
+            self.progress_timer.stop()
             progress_bar_info.progress_bar_widget.setStyleSheet("""
                 QProgressBar {
                     text-align: center;
@@ -537,7 +895,7 @@ class MainWindow(QMainWindow):
                 prefix=True
             )
 
-            if progress_bar_info.completed != progress_bar_info.quantity:
+            if completed != quantity:
                 progress_bar_info.progress_bar_widget.setStyleSheet("""
                     QProgressBar {
                         text-align: center;
@@ -547,7 +905,7 @@ class MainWindow(QMainWindow):
                        background-color: pink; 
                     }
                 """)
-                if progress_bar_info.completed == 0:
+                if completed == 0:
                     # If the progress is 0, there won't be a visible progress bar.
                     # Therefore, the progress bar object's background needs to be set directly.
                     progress_bar_info.progress_bar_widget.setStyleSheet("""
@@ -559,18 +917,36 @@ class MainWindow(QMainWindow):
                     """)
                 self.operation_browser_insert_html(
                     color='red',
-                    string=f'But, {progress_bar_info.executed - progress_bar_info.completed} '
+                    string=f'But, {executed - completed} '
                            'failed downloads for URLs. Check them at Option > Show Failed URLs',
                     prefix=True
                 )
 
+            self.save_batch_metrics(images=quantity, completed=completed)
             self.urls.clear()
-            self.ui.operation_text_browser.append(
+            Record_Journal_File.unlink(missing_ok=True)
+            self.operation_log.append(
                 f'{datetime.now().strftime("%H:%M:%S")} '
                 f'[ {len(self.urls)} URLs ] | Clear the record list'
             )
             self.freeze_main_window(unfreeze=True)
 
+    def save_batch_metrics(self, **extra) -> None:
+        """
+        Show the per-stage metrics of the finished batch (median and p90), and write them to the metrics files
+        :param extra: added to the JSON summary
+        :return:
+        """
+        if summary := metrics.format_summary():
+            self.operation_browser_insert_html(color='cyan', string=f'Metrics: {summary}', prefix=True)
+        try:
+            if metrics_file := write_batch_metrics(Metrics_Dir, Metrics_Prometheus_File, Metrics_Keep_Batches,
+                                                   mode='gui', batch=self.batch_id, **extra):
+                self.operation_browser_insert_html(color='cyan', string=f'Metrics are saved to {metrics_file}',
+                                                   prefix=True)
+        except OSError as e:
+            self.operation_browser_insert_html(color='pink', string=f'The metrics cannot be saved. {e}', prefix=True)
+
     def add_progress_bar(self, task_name: str, count: int) -> None:
         """
         Create a QLabel and QProgressBar (both within a QHBoxLayout)
@@ -603,26 +979,20 @@ class MainWindow(QMainWindow):
 
         self.progress_bar_data[task_name] = ProgressBarData(progress_layout=progress_layout,
                                                             progress_bar_widget=progress_bar,
-                                                            completed=0,
-                                                            executed=0,
-                                                            quantity=count)
+                                                            counter=ProgressCounter(quantity=count))
         self.ui.verticalLayout.addLayout(progress_layout)
+        self.progress_timer.start()
         QApplication.processEvents()
 
     def update_process_bar(self, task_name: str, is_completed: bool) -> ProgressBarData:
         """
-        Updating progress bar information.
+        Count a result in the progress bar, the widget itself is updated by refresh_progress.
         :param task_name: progress bar task name
-        :param is_completed: set to True, it will synchronously update the 'completed' attribute of the ProgressBarData.
+        :param is_completed: set to True, it will also count the result as completed.
         :return: ProgressBarData
         """
         progress_bar_data: ProgressBarData = self.progress_bar_data[task_name]
-        progress_bar_data.executed += 1
-        if is_completed:
-            completed_count = progress_bar_data.completed + 1
-            progress_bar_data.completed = completed_count
-            progress_bar_data.progress_bar_widget.setValue(completed_count)
-
+        progress_bar_data.counter.add_result(is_completed=is_completed)
         return progress_bar_data
 
     def freeze_main_window(self, unfreeze=False) -> None:
@@ -642,32 +1012,32 @@ class MainWindow(QMainWindow):
 
     def able_option_action(self, enable=True) -> None:
         """
-        Enable/Disable LoadClipboardFile, ShowFailUrl and  SaveTheRecord actions
+        Enable/Disable LoadClipboardFile, ImportUrlFile, ShowFailUrl, SaveTheRecord and ConnectionSettings actions
         :param enable: set False to disable them
         :return:
         """
         self.ui.actionLoadClipboardFile.setEnabled(enable)
+        self.ui.actionImportUrlFile.setEnabled(enable)
         self.ui.actionShowFailUrl.setEnabled(enable)
         self.ui.actionSaveTheRecord.setEnabled(enable)
+        self.ui.actionConnectionSettings.setEnabled(enable)
 
     def operation_browser_insert_html(self, color: str, string: str, prefix: bool = False) -> None:
         """
-        Using HTML syntax in self.ui.operation_text_browser
+        Add a colored line to the operation log
         :param string:
         :param color:
         :param prefix:
         :return:
         """
         prefix_string = f'{datetime.now().strftime("%H:%M:%S")} [ {len(self.urls)} URLs ] | ' if prefix else ''
-        full_string = f'<span style="color: {color};">{prefix_string}{string}</span>'
-        self.ui.operation_text_browser.append('')
-        self.ui.operation_text_browser.insertHtml(full_string)
-        self.ui.operation_text_browser.setCurrentCharFormat(QTextCharFormat())
+        self.operation_log.append(f'{prefix_string}{string}', color)
 
     def clear_progress_bar(self) -> None:
         """
         Clear all progress bar layout
         """
+        self.progress_timer.stop()
         for progress_name in self.progress_bar_task_name:
             each_progres_bar_info: ProgressBarData = self.progress_bar_data[progress_name]
             layout = each_progres_bar_info.progress_layout
@@ -698,24 +1068,22 @@ class MainWindow(QMainWindow):
                                          'Do you want to save the URL of the clipboard before exiting？',
                                          QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
             if reply == QMessageBox.Yes:
-                record = (self.save_dir,
-                          self.ui.civitai_check_box.isChecked(),
-                          self.urls,
-                          )
-                with open(f'{datetime.now().strftime("%m-%d-%H:%M:%S")}.bringmeimage', 'wb') as f:
-                    pickle.dump(record, f)
-
-        try:
-            if self.driver_page:
-                self.driver_page.close()
-            if self.context:
-                self.context.close()
-            if self.browser:
-                self.browser.close()
-        except Exception as e:
-            print(e)
-        finally:
-            if self.playwright:
-                self.playwright.stop()
+                self.save_record_file()
+        Record_Journal_File.unlink(missing_ok=True)
+
+        if self.login_runner:
+            self.login_runner.cancel()
+        # also ends a login check in progress, so the pool does not wait for its navigation
+        if self.browser_session:
+            self.browser_session.close()
+        # the browser of the manual login (if any) is closed with it
+        if self.playwright:
+            self.playwright.stop()
+        if self.httpx_client:
+            self.httpx_client.close()
+        self.resolve_cache.close()
+        self.operation_log.close()
+        if self.folder_index:
+            self.folder_index.close()
 
         event.accept()
@@ -16,10 +16,10 @@ from PySide6.QtGui import (QAction, QBrush, QColor, QConicalGradient,
     QIcon, QImage, QKeySequence, QLinearGradient,
     QPainter, QPalette, QPixmap, QRadialGradient,
     QTransform)
-from PySide6.QtWidgets import (QApplication, QCheckBox, QHBoxLayout, QLabel,
-    QLineEdit, QMainWindow, QMenu, QMenuBar,
-    QPushButton, QSizePolicy, QStatusBar, QTextBrowser,
-    QVBoxLayout, QWidget)
+from PySide6.QtWidgets import (QAbstractItemView, QApplication, QCheckBox, QHBoxLayout,
+    QLabel, QLineEdit, QListView, QMainWindow,
+    QMenu, QMenuBar, QPushButton, QSizePolicy,
+    QStatusBar, QVBoxLayout, QWidget)
 
 class Ui_MainWindow(object):
     def setupUi(self, MainWindow):
@@ -28,12 +28,16 @@ class Ui_MainWindow(object):
         MainWindow.resize(800, 400)
         self.actionLoadClipboardFile = QAction(MainWindow)
         self.actionLoadClipboardFile.setObjectName(u"actionLoadClipboardFile")
+        self.actionImportUrlFile = QAction(MainWindow)
+        self.actionImportUrlFile.setObjectName(u"actionImportUrlFile")
         self.actionShowFailUrl = QAction(MainWindow)
         self.actionShowFailUrl.setObjectName(u"actionShowFailUrl")
         self.actionDownloadMode = QAction(MainWindow)
         self.actionDownloadMode.setObjectName(u"actionDownloadMode")
         self.actionSaveTheRecord = QAction(MainWindow)
         self.actionSaveTheRecord.setObjectName(u"actionSaveTheRecord")
+        self.actionConnectionSettings = QAction(MainWindow)
+        self.actionConnectionSettings.setObjectName(u"actionConnectionSettings")
         self.centralwidget = QWidget(MainWindow)
         self.centralwidget.setObjectName(u"centralwidget")
         self.verticalLayout = QVBoxLayout(self.centralwidget)
@@ -102,13 +106,16 @@ class Ui_MainWindow(object):
 
         self.verticalLayout.addLayout(self.horizontalLayout_2)
 
-        self.operation_text_browser = QTextBrowser(self.centralwidget)
-        self.operation_text_browser.setObjectName(u"operation_text_browser")
+        self.operation_log_view = QListView(self.centralwidget)
+        self.operation_log_view.setObjectName(u"operation_log_view")
         font = QFont()
         font.setPointSize(16)
-        self.operation_text_browser.setFont(font)
+        self.operation_log_view.setFont(font)
+        self.operation_log_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.operation_log_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.operation_log_view.setUniformItemSizes(True)
 
-        self.verticalLayout.addWidget(self.operation_text_browser)
+        self.verticalLayout.addWidget(self.operation_log_view)
 
         self.verticalLayout.setStretch(0, 1)
         self.verticalLayout.setStretch(1, 1)
@@ -126,9 +133,12 @@ class Ui_MainWindow(object):
 
         self.menubar.addAction(self.menuOption.menuAction())
         self.menuOption.addAction(self.actionLoadClipboardFile)
+        self.menuOption.addAction(self.actionImportUrlFile)
         self.menuOption.addAction(self.actionShowFailUrl)
         self.menuOption.addSeparator()
         self.menuOption.addAction(self.actionSaveTheRecord)
+        self.menuOption.addSeparator()
+        self.menuOption.addAction(self.actionConnectionSettings)
 
         self.retranslateUi(MainWindow)
 
@@ -138,9 +148,11 @@ class Ui_MainWindow(object):
     def retranslateUi(self, MainWindow):
         MainWindow.setWindowTitle(QCoreApplication.translate("MainWindow", u"Bring Me Image", None))
         self.actionLoadClipboardFile.setText(QCoreApplication.translate("MainWindow", u"Load Clipboard File", None))
+        self.actionImportUrlFile.setText(QCoreApplication.translate("MainWindow", u"Import URLs from File", None))
         self.actionShowFailUrl.setText(QCoreApplication.translate("MainWindow", u"Show Failed URLs", None))
         self.actionDownloadMode.setText(QCoreApplication.translate("MainWindow", u"Download Mode", None))
         self.actionSaveTheRecord.setText(QCoreApplication.translate("MainWindow", u"Save the record", None))
+        self.actionConnectionSettings.setText(QCoreApplication.translate("MainWindow", u"Connection Settings", None))
         self.folder_label.setText(QCoreApplication.translate("MainWindow", u"Folder", None))
 #if QT_CONFIG(tooltip)
         self.folder_line_edit.setToolTip("")
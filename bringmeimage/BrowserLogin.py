@@ -0,0 +1,175 @@
+import asyncio
+import concurrent.futures
+import importlib
+import json
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Coroutine
+
+from PySide6.QtCore import QObject, Signal, QRunnable, Slot
+
+from bringmeimage.config import Login_Check_Url, Login_Check_Title, Chrome_Path, Cookie_File
+from bringmeimage.LoggerConf import get_logger
+logger = get_logger(__name__)
+
+if TYPE_CHECKING:
+    from playwright.async_api import Browser, BrowserContext, Playwright
+
+
+# Imported in the background once the login is checked, so that the first "GO" of civitai.com does not pay for them
+Warm_Up_Modules = ('bringmeimage.Parser', 'httpx')
+# seconds to wait for the browser to close when the session is closed
+Close_Timeout = 5
+
+
+class BrowserSession:
+    """
+    A browser (Playwright async API) on an event loop that lives in its own thread for the whole session.
+    The login is checked in it, and the logged-in context is kept: the batches are resolved on the same loop
+    (run()) and their browser resolver opens its pages in that context, so no batch launches the browser.
+    """
+    def __init__(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='BrowserSession', daemon=True)
+        self.thread.start()
+        self.playwright: 'Playwright | None' = None
+        self.browser: 'Browser | None' = None
+        # the logged-in context, None until the login succeeds
+        self.context: 'BrowserContext | None' = None
+        # the logins and batches submitted and not finished yet
+        self.futures: set[concurrent.futures.Future] = set()
+
+    def submit(self, coroutine: Coroutine) -> concurrent.futures.Future:
+        """
+        Run the coroutine on the loop of the session (the caller's log_context() is carried over)
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        self.futures.add(future)
+        future.add_done_callback(self.futures.discard)
+        return future
+
+    def run(self, coroutine: Coroutine):
+        """
+        Run the coroutine on the loop of the session and wait for its result
+        """
+        return self.submit(coroutine).result()
+
+    async def login(self, cookie_file: Path) -> tuple[bool, list[dict]]:
+        """
+        Load the cookies into a headless browser and open the login check page. If the login authentication is
+        successful, the cookies are updated and the context is kept, otherwise the browser is closed.
+        :param cookie_file:
+        :return: (is_logged_in, the cookies of the context)
+        """
+        from playwright.async_api import async_playwright
+
+        # a re-login starts over with the new cookies
+        await self.close_browser()
+        if not self.playwright:
+            self.playwright = await async_playwright().start()
+        try:
+            self.browser = await self.playwright.chromium.launch(
+                executable_path=Chrome_Path, headless=True, args=['--disable-blink-features=AutomationControlled'])
+            context = await self.browser.new_context()
+            with cookie_file.open() as f:
+                await context.add_cookies(json.load(f))
+
+            page = await context.new_page()
+            await page.goto('https://civitai.com/', wait_until='domcontentloaded')
+            await page.goto(Login_Check_Url, wait_until='domcontentloaded')
+            is_logged_in = await page.title() == Login_Check_Title
+            await page.close()
+        except Exception:
+            await self.close_browser()
+            raise
+
+        if not is_logged_in:
+            await self.close_browser()
+            return False, []
+
+        cookies = await context.cookies()
+        with cookie_file.open('w') as f:
+            json.dump(cookies, f)
+        self.context = context
+        return True, cookies
+
+    async def close_browser(self) -> None:
+        """
+        Close the browser (a navigation in progress fails right away)
+        :return:
+        """
+        browser, self.browser, self.context = self.browser, None, None
+        if browser:
+            try:
+                await browser.close()
+            except Exception as e:
+                logger.info(f'Close browser exception{e}')
+
+    async def stop(self) -> None:
+        await self.close_browser()
+        if self.playwright:
+            await self.playwright.stop()
+            self.playwright = None
+
+    def close(self) -> None:
+        """
+        Close the browser and stop the loop, from any other thread (e.g. when the window is closed)
+        :return:
+        """
+        # the batch or the login still running fails (its caller gets CancelledError) instead of waiting forever
+        for future in list(self.futures):
+            future.cancel()
+        try:
+            asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result(timeout=Close_Timeout)
+        except Exception as e:
+            logger.info(f'Close browser session exception{e}')
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=Close_Timeout)
+
+
+class LoginRunnerSignals(QObject):
+    # (is_logged_in, the cookies of the logged-in context, the error message ('' if the check ran to the end))
+    login_finished_signal = Signal(bool, list, str)
+
+
+class LoginRunner(QRunnable):
+    """
+    Check the login of civitai.com with the saved cookies in the BrowserSession, so the GUI is not frozen by the
+    launch of the browser and the two page loads. The logged-in context stays open in the session for the resolvers.
+    The modules of the resolvers are imported afterward, so they are warm by the time the clipping is finished.
+    """
+    def __init__(self, browser_session: BrowserSession, cookie_file: Path = Cookie_File, warm_up: bool = True):
+        super().__init__()
+        self.signals = LoginRunnerSignals()
+        self.browser_session = browser_session
+        self.cookie_file = cookie_file
+        self.warm_up = warm_up
+        self.cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        """
+        Drop the result (e.g. the window is being closed). Closing the BrowserSession ends a navigation in progress.
+        :return:
+        """
+        self.cancelled.set()
+
+    @Slot()
+    def run(self) -> None:
+        is_logged_in, cookies, error = False, [], ''
+        try:
+            is_logged_in, cookies = self.browser_session.run(self.browser_session.login(self.cookie_file))
+        except Exception as e:
+            logger.info(f'Login exception{e}')
+            error = str(e).splitlines()[0] if str(e) else type(e).__name__
+        finally:
+            # nobody waits for the result of a cancelled check (the window may already be gone)
+            if not self.cancelled.is_set():
+                self.signals.login_finished_signal.emit(is_logged_in, cookies, error)
+
+        if self.warm_up and not self.cancelled.is_set():
+            for module in Warm_Up_Modules:
+                try:
+                    importlib.import_module(module)
+                except ImportError as e:
+                    logger.info(f'Warm up exception{e}: Module: {module}')
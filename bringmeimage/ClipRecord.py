@@ -0,0 +1,197 @@
+# Record of the "Clip list" (*.bringmeimage)
+# Format (version 2): JSON lines, the first line is the header and every other line is an ImageData
+#     {"format": "bringmeimage", "version": 2, "save_dir": "/path/to/DownloadTemp", "for_civitai": true}
+#     {"url": "https://civitai.com/images/2805528", "src": "", "imageId": "2805528", "is_parsed": false, ...}
+# A saved record is gzip-compressed. The journal written while clipping is left uncompressed, so every entry is
+# appended as a plain line (only the last entries are lost if the program dies), and it is compressed when it is saved.
+# Records saved by older versions (pickle) are converted in memory when they are loaded, and written as version 2 only
+# when they are saved, or converted explicitly: python -m bringmeimage.ClipRecord --convert *.bringmeimage
+import gzip
+import json
+import pickle
+import zlib
+from dataclasses import dataclass, asdict, fields
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from bringmeimage.BringMeImageData import ImageData
+from bringmeimage.LoggerConf import get_logger
+logger = get_logger(__name__)
+
+
+Record_Format = 'bringmeimage'
+Record_Version = 2
+Gzip_Magic = b'\x1f\x8b'
+
+
+class RecordError(Exception):
+    def __init__(self, message: str) -> None:
+        super().__init__(message)
+
+
+@dataclass(slots=True)
+class RecordHeader:
+    save_dir: Path
+    for_civitai: bool
+
+
+def create_record(file: Path, header: RecordHeader, image_datas: Iterable[ImageData] = (),
+                  compress: bool = True) -> None:
+    """
+    Create (or overwrite) a record with the header and the given entries
+    :param file:
+    :param header:
+    :param image_datas:
+    :param compress: set False for a journal that entries are appended to
+    :return:
+    """
+    with (gzip.open(file, 'wt', encoding='utf-8') if compress else file.open('w', encoding='utf-8')) as f:
+        f.write(json.dumps({'format': Record_Format,
+                            'version': Record_Version,
+                            'save_dir': str(header.save_dir),
+                            'for_civitai': header.for_civitai}) + '\n')
+        for image_data in image_datas:
+            f.write(json.dumps(asdict(image_data)) + '\n')
+
+
+def save_record(file: Path, header: RecordHeader, image_datas: Iterable[ImageData]) -> None:
+    """
+    Write a complete record to a temporary file first, then give it the final name
+    :param file:
+    :param header:
+    :param image_datas:
+    :return:
+    """
+    temp_file = file.with_name(f'{file.name}.tmp')
+    create_record(temp_file, header, image_datas)
+    temp_file.replace(file)
+
+
+def append_record(file: Path, image_datas: Iterable[ImageData]) -> None:
+    """
+    Append the entries to an existing record: as plain lines to a journal (uncompressed),
+    or as a new gzip member to a compressed record
+    :param file:
+    :param image_datas:
+    :return:
+    """
+    with (gzip.open(file, 'at', encoding='utf-8') if is_compressed(file)
+          else file.open('a', encoding='utf-8')) as f:
+        for image_data in image_datas:
+            f.write(json.dumps(asdict(image_data)) + '\n')
+
+
+def is_compressed(file: Path) -> bool:
+    with file.open('rb') as f:
+        return f.read(2) == Gzip_Magic
+
+
+def is_pickle_record(file: Path) -> bool:
+    """
+    A record of version 2 starts with the gzip magic (saved) or with the JSON header (journal)
+    """
+    with file.open('rb') as f:
+        head = f.read(2)
+    return head != Gzip_Magic and not head.startswith(b'{')
+
+
+def open_record(file: Path) -> tuple[RecordHeader, Iterator[ImageData]]:
+    """
+    Read the header of a record, the entries are read lazily by the returned iterator
+    :param file:
+    :return: (header, iterator of ImageData)
+    """
+    if is_pickle_record(file):
+        raise RecordError('Not a record of version 2 (it may be an older pickle record)')
+
+    f = gzip.open(file, 'rt', encoding='utf-8') if is_compressed(file) else file.open('r', encoding='utf-8')
+    try:
+        header = json.loads(f.readline())
+        if header.get('format') != Record_Format or header.get('version') != Record_Version:
+            raise RecordError(f'Unsupported record: {header.get("format")} version {header.get("version")}')
+        record_header = RecordHeader(save_dir=Path(header['save_dir']), for_civitai=header['for_civitai'])
+    except (OSError, EOFError, zlib.error, ValueError, AttributeError, KeyError) as e:
+        f.close()
+        raise RecordError(f'The record header is not readable ({e})')
+    except RecordError:
+        f.close()
+        raise
+
+    return record_header, iter_entries(f)
+
+
+def iter_entries(f) -> Iterator[ImageData]:
+    field_names = {field.name for field in fields(ImageData)}
+    with f:
+        try:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    yield ImageData(**{name: value for name, value in entry.items() if name in field_names})
+        except (EOFError, zlib.error, gzip.BadGzipFile, ValueError) as e:
+            # the last entries were being written when the program died
+            logger.info(f'The record ends with an incomplete entry: {e}')
+
+
+def load_record(file: Path) -> tuple[RecordHeader, Iterator[ImageData]]:
+    """
+    Load a record without changing the file, the entries are read lazily by the returned iterator.
+    A pickle record of an older version is converted in memory (it is written as version 2 when it is saved).
+    :param file:
+    :return: (header, iterator of ImageData)
+    """
+    if is_pickle_record(file):
+        logger.info(f'Load the pickle record (version 1), save it to convert it into version {Record_Version}: {file}')
+        return read_pickle_record(file)
+    return open_record(file)
+
+
+def read_pickle_record(file: Path) -> tuple[RecordHeader, Iterator[ImageData]]:
+    """
+    Read a pickle record (save_dir, for_civitai, urls) of an older version
+    :param file:
+    :return: (header, iterator of ImageData)
+    """
+    try:
+        with file.open('rb') as f:
+            save_dir, for_civitai, urls = pickle.load(f)
+    except Exception as e:
+        raise RecordError(f'The file appears to have been modified and is no longer readable ({e})')
+    return RecordHeader(save_dir=Path(save_dir), for_civitai=for_civitai), iter(urls.values())
+
+
+def convert_pickle_record(file: Path) -> None:
+    """
+    Convert a pickle record of an older version into version 2.
+    The original file is kept as *.bringmeimage.bak
+    :param file:
+    :return:
+    """
+    header, image_datas = read_pickle_record(file)
+    save_record(file.with_name(f'{file.name}.v2'), header, image_datas)
+    file.replace(file.with_name(f'{file.name}.bak'))
+    file.with_name(f'{file.name}.v2').replace(file)
+    logger.info(f'Convert the pickle record into version {Record_Version}: {file}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description='Show the version of the records, or convert the pickle records')
+    arg_parser.add_argument('records', nargs='+', type=Path)
+    arg_parser.add_argument('--convert', action='store_true',
+                            help=f'convert the pickle records into version {Record_Version} (the originals are kept '
+                                 f'as *.bak)')
+    args = arg_parser.parse_args()
+
+    for record_file in args.records:
+        try:
+            if not is_pickle_record(record_file):
+                print(f'{record_file}: version {Record_Version}')
+            elif args.convert:
+                convert_pickle_record(record_file)
+                print(f'{record_file}: converted into version {Record_Version}')
+            else:
+                print(f'{record_file}: pickle record (version 1), convert it with --convert')
+        except (RecordError, OSError) as error:
+            print(f'{record_file}: {error}')
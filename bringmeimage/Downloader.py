@@ -1,51 +1,90 @@
+import time
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import httpx
 from PySide6.QtCore import QObject, Signal, QRunnable, Slot
 
-from bringmeimage.BringMeImageData import ImageData
-from bringmeimage.LoggerConf import get_logger
+from bringmeimage.BringMeImageData import ImageData, ProgressCounter
+from bringmeimage.FolderIndex import FolderIndex
+from bringmeimage.HttpClient import prewarm_connections
+from bringmeimage.ImageDownloader import ImageDownloader
+from bringmeimage.Metrics import metrics
+from bringmeimage.RetryPolicy import RetryPolicy, classify_exception
+from bringmeimage.config import Download_Dedup
+from bringmeimage.LoggerConf import get_logger, log_context
 logger = get_logger(__name__)
 
+if TYPE_CHECKING:
+    import httpx
+
 
 class DownloadRunnerSignals(QObject):
     download_failed_signal = Signal(ImageData)
     download_completed_signal = Signal()
+    # (image_data, attempt, delay): ask for the download to be retried after `delay` seconds
+    download_retry_signal = Signal(ImageData, int, float)
 
 
 class DownloadRunner(QRunnable):
-    def __init__(self, httpx_client: httpx.Client, image_data: ImageData, save_dir: Path):
+    """
+    Run an ImageDownloader in the thread pool and report the result by signals.
+    The final result (not a retry) is also counted in the progress_counter, if given.
+    The time spent waiting for a thread of the pool is observed as the queue wait.
+    """
+    def __init__(self, httpx_client: 'httpx.Client', image_data: ImageData, save_dir: Path, attempt: int = 0,
+                 folder_index: FolderIndex | None = None, dedup: bool = Download_Dedup,
+                 progress_counter: ProgressCounter | None = None, batch_id: str = ''):
         super().__init__()
-        self.httpx_client = httpx_client
         self.signals = DownloadRunnerSignals()
         self.image_data = image_data
-        self.save_dir = save_dir
+        self.attempt = attempt
+        self.progress_counter = progress_counter
+        self.retry_policy = RetryPolicy()
+        self.queued_at = time.perf_counter()
+        self.batch_id = batch_id
+        self.downloader = ImageDownloader(httpx_client=httpx_client, image_data=image_data, save_dir=save_dir,
+                                          folder_index=folder_index, dedup=dedup)
 
     @Slot()
     def run(self) -> None:
-        self.download()
+        metrics.observe('download_queue_wait_seconds', time.perf_counter() - self.queued_at)
+        with log_context(batch=self.batch_id, url=self.image_data.url):
+            self.download()
 
     def download(self) -> None:
-        self.save_dir.mkdir(parents=True, exist_ok=True)
         src = self.image_data.src
-        full_img_name = src.rsplit('/', maxsplit=1)[-1]
-        img_name, extension = full_img_name.rsplit('.', maxsplit=1)
-        img_name = img_name[:20] if len(img_name) > 20 else img_name
-        save_path = self.save_dir / f'{img_name}.{extension}'
-        if save_path.exists():
-            new_name = f'{save_path.stem}(repeat){save_path.suffix}'
-            save_path = save_path.with_name(new_name)
-
         try:
-            r = self.httpx_client.get(src)
-            r.raise_for_status()
-
-            with open(save_path, 'wb') as f:
-                for date in r.iter_bytes():
-                    if date:
-                        f.write(date)
-
+            self.downloader.download()
+            self.image_data.fail_reason = ''
+            metrics.increment('downloads_total', result='completed')
+            if self.progress_counter:
+                self.progress_counter.add_result(is_completed=True)
             self.signals.download_completed_signal.emit()
         except Exception as e:
-            self.signals.download_failed_signal.emit(self.image_data)
-            logger.info(f'Download exception{e}: Image src: {src}')
+            reason, retry_after = classify_exception(e)
+            self.image_data.fail_reason = reason.value
+            delay = self.retry_policy.get_delay(self.attempt, reason, retry_after)
+            if delay is None:
+                metrics.increment('downloads_total', result='failed')
+                if self.progress_counter:
+                    self.progress_counter.add_result(is_completed=False, failed_image_data=self.image_data)
+                self.signals.download_failed_signal.emit(self.image_data)
+                logger.info(f'Download exception{e}: Image src: {src}')
+            else:
+                self.signals.download_retry_signal.emit(self.image_data, self.attempt + 1, delay)
+                logger.info(f'Download exception{e}, retry {self.attempt + 1} in {delay:.1f}s: Image src: {src}')
+
+
+class PrewarmRunner(QRunnable):
+    """
+    Open connections to the image hosts before the downloads of a batch start
+    """
+    def __init__(self, httpx_client: 'httpx.Client', origins: list[str], connections: int):
+        super().__init__()
+        self.httpx_client = httpx_client
+        self.origins = origins
+        self.connections = connections
+
+    @Slot()
+    def run(self) -> None:
+        prewarm_connections(self.httpx_client, self.origins, self.connections)
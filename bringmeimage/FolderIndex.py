@@ -0,0 +1,89 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from bringmeimage.BringMeImageData import ImageData
+from bringmeimage.LoggerConf import get_logger
+logger = get_logger(__name__)
+
+
+Folder_Index_Name = '.bringmeimage_index.sqlite3'
+
+
+class FolderIndex:
+    """
+    Index (SQLite) kept in a storage folder, shared by all download threads. It holds
+    the content hash of the images (deduplication) and the manifest of the downloaded images (keyed by imageId and src).
+    Hold `lock` while a check and the corresponding update need to be atomic.
+    """
+    def __init__(self, folder: Path) -> None:
+        folder.mkdir(parents=True, exist_ok=True)
+        self.folder = folder
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(folder / Folder_Index_Name, check_same_thread=False)
+        with self.lock:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS content_hash ('
+                                    'sha256 TEXT PRIMARY KEY, '
+                                    'filename TEXT NOT NULL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS manifest ('
+                                    'key TEXT PRIMARY KEY, '
+                                    'filename TEXT NOT NULL, '
+                                    'downloaded_at REAL NOT NULL)')
+            self.connection.commit()
+
+    def find_file_by_hash(self, sha256: str) -> Path | None:
+        """
+        :param sha256: hex digest of the image content
+        :return: the file in the folder with the same content, or None
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT filename FROM content_hash WHERE sha256 = ?', (sha256,)).fetchone()
+            if not row:
+                return None
+            file = self.folder / row[0]
+            if file.exists():
+                return file
+            # the file has been deleted by the user
+            self.connection.execute('DELETE FROM content_hash WHERE sha256 = ?', (sha256,))
+            self.connection.commit()
+
+    def add_hash(self, sha256: str, filename: str) -> None:
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO content_hash VALUES (?, ?)', (sha256, filename))
+            self.connection.commit()
+
+    @staticmethod
+    def get_manifest_keys(image_data: ImageData) -> list[str]:
+        keys = []
+        if image_data.imageId:
+            keys.append(f'imageId:{image_data.imageId}')
+        if image_data.src:
+            keys.append(f'src:{image_data.src}')
+        return keys
+
+    def add_downloaded(self, image_data: ImageData, filename: str) -> None:
+        now = time.time()
+        with self.lock:
+            self.connection.executemany('INSERT OR REPLACE INTO manifest VALUES (?, ?, ?)',
+                                        [(key, filename, now) for key in self.get_manifest_keys(image_data)])
+            self.connection.commit()
+
+    def is_downloaded(self, image_data: ImageData) -> bool:
+        """
+        :param image_data:
+        :return: True if the image has been downloaded into the folder and the file is still there
+        """
+        with self.lock:
+            for key in self.get_manifest_keys(image_data):
+                row = self.connection.execute('SELECT filename FROM manifest WHERE key = ?', (key,)).fetchone()
+                if row and (self.folder / row[0]).exists():
+                    return True
+        return False
+
+    def close(self) -> None:
+        with self.lock:
+            try:
+                self.connection.close()
+            except sqlite3.Error as e:
+                logger.info(f'Close folder index exception{e}')
@@ -0,0 +1,278 @@
+# Headless batch mode: resolve and download the images of a URL list or a record (*.bringmeimage) without Qt.
+# A URL list can be any text, HTML or bookmarks-export file, every URL in it that matches the parsing rules is taken.
+#     python headless.py urls.txt --save-dir ./images --parse-concurrency 8 --download-concurrency 32
+# Progress is printed to stdout as JSON lines (one event per line), the log goes to stderr:
+#     {"event": "start", "total": 120, "skipped": 3, "save_dir": "./images"}
+#     {"event": "expanded", "url": "https://civitai.com/posts/1001", "images": 100}
+#     {"event": "parsed", "url": "https://civitai.com/images/2805528", "src": "https://image.civitai.com/..."}
+#     {"event": "downloaded", "url": "https://civitai.com/images/2805528", "file": "./images/2805528.jpeg"}
+#     {"event": "failed", "stage": "parse", "url": "https://civitai.com/images/2805540", "reason": "Client error"}
+#     {"event": "summary", "total": 120, "skipped": 3, "expanded": 0, "downloaded": 116, "failed": 1, "elapsed": 42.3,
+#      "metrics": "bringmeimage/metrics/batch-20240101-120000-000000.json"}
+# A model, model-version or post page is expanded into its images ("expanded" is printed for every page of them).
+# The exit status is 0 if every image is downloaded (or skipped), 1 otherwise.
+import argparse
+import asyncio
+import contextvars
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from bringmeimage.BringMeImageData import ImageData, ConnectionSettings
+from bringmeimage.ClipRecord import load_record, RecordError
+from bringmeimage.FolderIndex import FolderIndex
+from bringmeimage.HttpClient import create_httpx_client
+from bringmeimage.ImageDownloader import ImageDownloader
+from bringmeimage.Metrics import metrics, write_batch_metrics
+from bringmeimage.ResolveCache import ResolveCache
+from bringmeimage.Resolver import BatchResolver
+from bringmeimage.RetryPolicy import RetryPolicy, classify_exception
+from bringmeimage.UrlParser import iter_urls_in_file
+from bringmeimage.config import (Parse_Concurrency, Parse_With_Api, Download_Threads, Download_Dedup,
+                                 Download_Skip_Existing, Cookie_File, Resolve_Cache_File, Download_Dir, Metrics_Dir,
+                                 Metrics_Keep_Batches, Metrics_Prometheus_File)
+from bringmeimage.LoggerConf import get_logger, log_context, new_batch_id
+logger = get_logger(__name__)
+
+if TYPE_CHECKING:
+    import httpx
+
+
+def print_event(event: str, **kwargs) -> None:
+    print(json.dumps({'event': event, **kwargs}, ensure_ascii=False), flush=True)
+
+
+def load_url_list(file: Path, for_civitai: bool) -> dict[str, ImageData]:
+    """
+    Scan a text, HTML or bookmarks-export file for the URLs that match the parsing rules
+    :param file:
+    :param for_civitai:
+    :return:
+    """
+    return {url_data.url: url_data for url_data in iter_urls_in_file(file, for_civitai)}
+
+
+def load_cookies(file: Path) -> list[dict]:
+    try:
+        with file.open() as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.info(f'No cookies are loaded ({e}), the images that require login cannot be resolved')
+        return []
+
+
+class HeadlessJob:
+    """
+    The resolve -> download pipeline of the MainWindow on a plain asyncio event loop.
+    Every image is downloaded (in a thread of the executor) as soon as its src is resolved.
+    """
+    def __init__(self, image_datas: list[ImageData], save_dir: Path, cookies: list[dict],
+                 parse_concurrency: int = Parse_Concurrency, download_concurrency: int = Download_Threads,
+                 with_api: bool = Parse_With_Api, skip_existing: bool = Download_Skip_Existing,
+                 dedup: bool = Download_Dedup, metrics_dir: Path | None = Metrics_Dir,
+                 prometheus_file: Path | None = Metrics_Prometheus_File) -> None:
+        self.image_datas = image_datas
+        self.save_dir = save_dir
+        self.cookies = cookies
+        self.parse_concurrency = parse_concurrency
+        self.download_concurrency = max(1, download_concurrency)
+        self.with_api = with_api
+        self.skip_existing = skip_existing
+        self.dedup = dedup
+        self.metrics_dir = metrics_dir
+        self.prometheus_file = prometheus_file
+        self.retry_policy = RetryPolicy()
+        self.downloaded = 0
+        self.failed = 0
+        self.expanded = 0
+        self.download_tasks: set[asyncio.Task] = set()
+        self.httpx_client: 'httpx.Client | None' = None
+        self.executor: ThreadPoolExecutor | None = None
+        self.folder_index: FolderIndex | None = None
+        self.resolve_cache: ResolveCache | None = None
+        self.batch_id = new_batch_id()
+
+    async def run(self) -> int:
+        """
+        :return: the exit status
+        """
+        start = time.perf_counter()
+        metrics.reset()
+        self.folder_index = FolderIndex(self.save_dir)
+        self.resolve_cache = ResolveCache(Resolve_Cache_File)
+        self.httpx_client = create_httpx_client(ConnectionSettings(download_threads=self.download_concurrency))
+        self.executor = ThreadPoolExecutor(max_workers=self.download_concurrency)
+        try:
+            image_datas = self.image_datas
+            if self.skip_existing:
+                image_datas = [image_data for image_data in image_datas
+                               if not self.folder_index.is_downloaded(image_data)]
+            skipped = len(self.image_datas) - len(image_datas)
+            print_event('start', total=len(self.image_datas), skipped=skipped, save_dir=str(self.save_dir))
+
+            cached_srcs = self.resolve_cache.get_many(image_data.imageId for image_data in image_datas
+                                                      if not image_data.is_parsed)
+            for image_data in image_datas:
+                if not image_data.is_parsed and (img_src := cached_srcs.get(image_data.imageId)):
+                    image_data.src = img_src
+                    image_data.is_parsed = True
+            for image_data in image_datas:
+                if image_data.is_parsed:
+                    self.start_download(image_data)
+
+            if unparsed := [image_data for image_data in image_datas if not image_data.is_parsed]:
+                batch_resolver = BatchResolver(cookies=self.cookies,
+                                               on_completed=self.handle_parse_completed,
+                                               on_failed=self.handle_parse_failed,
+                                               concurrency=self.parse_concurrency,
+                                               with_api=self.with_api,
+                                               on_expanded=self.handle_parse_expanded,
+                                               skip_image=self.folder_index.is_downloaded if self.skip_existing
+                                               else None)
+                # the images of a gallery that are also listed on their own are not resolved twice
+                await batch_resolver.resolve_all(unparsed, [image_data.url for image_data in self.image_datas])
+                self.resolve_cache.evict()
+
+            while self.download_tasks:
+                await asyncio.wait(self.download_tasks)
+
+            elapsed = round(time.perf_counter() - start, 3)
+            metrics_file = write_batch_metrics(self.metrics_dir, self.prometheus_file, Metrics_Keep_Batches,
+                                               mode='headless', batch=self.batch_id, images=len(self.image_datas),
+                                               elapsed_s=elapsed)
+            print_event('summary', total=len(self.image_datas), skipped=skipped, expanded=self.expanded,
+                        downloaded=self.downloaded, failed=self.failed, elapsed=elapsed,
+                        metrics=str(metrics_file) if metrics_file else None)
+            return 1 if self.failed else 0
+        finally:
+            self.executor.shutdown()
+            self.httpx_client.close()
+            self.resolve_cache.close()
+            self.folder_index.close()
+
+    def handle_parse_expanded(self, gallery: ImageData, image_datas: list[ImageData]) -> None:
+        self.expanded += len(image_datas)
+        print_event('expanded', url=gallery.url, images=len(image_datas))
+
+    def handle_parse_completed(self, image_data: ImageData) -> None:
+        if image_data.gallery:
+            return
+        self.resolve_cache.put(image_data.imageId, image_data.src)
+        print_event('parsed', url=image_data.url, src=image_data.src)
+        self.start_download(image_data)
+
+    def handle_parse_failed(self, image_data: ImageData) -> None:
+        self.failed += 1
+        print_event('failed', stage='parse', url=image_data.url, reason=image_data.fail_reason)
+
+    def start_download(self, image_data: ImageData) -> None:
+        task = asyncio.ensure_future(self.download(image_data))
+        self.download_tasks.add(task)
+        task.add_done_callback(self.download_tasks.discard)
+
+    async def download(self, image_data: ImageData) -> None:
+        with log_context(url=image_data.url):
+            await self.download_image(image_data)
+
+    async def download_image(self, image_data: ImageData) -> None:
+        loop = asyncio.get_running_loop()
+        downloader = ImageDownloader(httpx_client=self.httpx_client, image_data=image_data, save_dir=self.save_dir,
+                                     folder_index=self.folder_index, dedup=self.dedup)
+        attempt = 0
+        while True:
+            try:
+                # the executor does not carry the log context of the task by itself
+                save_path = await loop.run_in_executor(self.executor, contextvars.copy_context().run,
+                                                       self.run_download, downloader, time.perf_counter())
+                break
+            except Exception as e:
+                reason, retry_after = classify_exception(e)
+                image_data.fail_reason = reason.value
+                delay = self.retry_policy.get_delay(attempt, reason, retry_after)
+                if delay is None:
+                    logger.info(f'Download exception{e}: Image src: {image_data.src}')
+                    metrics.increment('downloads_total', result='failed')
+                    self.failed += 1
+                    print_event('failed', stage='download', url=image_data.url, reason=image_data.fail_reason)
+                    return
+                attempt += 1
+                logger.info(f'Download exception{e}, retry {attempt} in {delay:.1f}s: Image src: {image_data.src}')
+                await asyncio.sleep(delay)
+
+        image_data.fail_reason = ''
+        metrics.increment('downloads_total', result='completed')
+        self.downloaded += 1
+        print_event('downloaded', url=image_data.url, file=str(save_path))
+
+    @staticmethod
+    def run_download(downloader: ImageDownloader, queued_at: float) -> Path:
+        # (in a thread of the executor)
+        metrics.observe('download_queue_wait_seconds', time.perf_counter() - queued_at)
+        return downloader.download()
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    arg_parser = argparse.ArgumentParser(prog='headless.py',
+                                         description='Download the images of a URL list or a record without the GUI')
+    arg_parser.add_argument('input', type=Path,
+                            help='a record (*.bringmeimage), or a text, HTML or bookmarks-export file with the URLs')
+    arg_parser.add_argument('--save-dir', type=Path,
+                            help='storage folder (default: the folder of the record, or DownloadTemp)')
+    arg_parser.add_argument('--parse-concurrency', type=int, default=Parse_Concurrency,
+                            help=f'images resolved at the same time (default: {Parse_Concurrency})')
+    arg_parser.add_argument('--download-concurrency', type=int, default=Download_Threads,
+                            help=f'images downloaded at the same time (default: {Download_Threads})')
+    arg_parser.add_argument('--no-api', dest='with_api', action='store_false', default=Parse_With_Api,
+                            help='resolve by the browser only')
+    arg_parser.add_argument('--no-skip-existing', dest='skip_existing', action='store_false',
+                            default=Download_Skip_Existing, help='download the images already in the storage folder')
+    arg_parser.add_argument('--dedup', action=argparse.BooleanOptionalAction, default=Download_Dedup,
+                            help='do not store an image whose content is already in the storage folder')
+    arg_parser.add_argument('--civitai', action=argparse.BooleanOptionalAction, default=True,
+                            help='accept the image pages of civitai.com in a URL list')
+    arg_parser.add_argument('--cookies', type=Path, default=Cookie_File,
+                            help='cookies (JSON) of a logged-in browser context '
+                                 '(default: the cookies saved by the GUI)')
+    arg_parser.add_argument('--metrics-dir', type=Path, default=Metrics_Dir,
+                            help='folder of the JSON summaries of the metrics (default: the setting in config.py)')
+    arg_parser.add_argument('--no-metrics', dest='metrics_dir', action='store_const', const=None,
+                            help='do not write the JSON summary of the metrics')
+    arg_parser.add_argument('--prometheus-file', type=Path, default=Metrics_Prometheus_File,
+                            help='also write the metrics in the Prometheus text format to this file')
+    return arg_parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    save_dir = args.save_dir
+    try:
+        if args.input.suffix == '.bringmeimage':
+            header, image_datas = load_record(args.input)
+            urls = {image_data.url: image_data for image_data in image_datas}
+            save_dir = save_dir or header.save_dir
+        else:
+            urls = load_url_list(args.input, args.civitai)
+    except (OSError, RecordError) as e:
+        print(f'{args.input}: {e}', file=sys.stderr)
+        return 2
+
+    job = HeadlessJob(image_datas=list(urls.values()),
+                      save_dir=save_dir or Download_Dir,
+                      cookies=load_cookies(args.cookies),
+                      parse_concurrency=args.parse_concurrency,
+                      download_concurrency=args.download_concurrency,
+                      with_api=args.with_api,
+                      skip_existing=args.skip_existing,
+                      dedup=args.dedup,
+                      metrics_dir=args.metrics_dir,
+                      prometheus_file=args.prometheus_file)
+    # the tasks of the event loop inherit the log context
+    with log_context(batch=job.batch_id):
+        return asyncio.run(job.run())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from bringmeimage.BringMeImageData import ConnectionSettings
+from bringmeimage.LoggerConf import get_logger
+logger = get_logger(__name__)
+
+# httpx (~0.2 s to import) is only imported when the first client is created
+if TYPE_CHECKING:
+    import httpx
+
+
+HTTP2_Available: bool = importlib.util.find_spec('h2') is not None
+
+
+def create_httpx_client(settings: ConnectionSettings) -> 'httpx.Client':
+    """
+    Create the HTTP client (shared by all download threads) with the connection pool of the settings
+    :param settings:
+    :return:
+    """
+    import httpx
+
+    limits = httpx.Limits(max_connections=settings.max_connections,
+                          max_keepalive_connections=settings.max_keepalive_connections,
+                          keepalive_expiry=settings.keepalive_expiry)
+    return httpx.Client(limits=limits, http2=settings.http2 and HTTP2_Available)
+
+
+def prewarm_connections(httpx_client: 'httpx.Client', origins: list[str], connections: int) -> None:
+    """
+    Open connections to each origin (e.g. https://image.civitai.com) with concurrent HEAD requests.
+    The connections stay in the keep-alive pool of the client, so the first downloads can reuse them.
+    One connection is opened to every origin first, the others only to the origins it succeeds for.
+    :param httpx_client:
+    :param origins:
+    :param connections: number of connections per origin (one is enough for HTTP/2)
+    :return:
+    """
+    import httpx
+
+    def head(origin: str) -> bool:
+        try:
+            httpx_client.head(origin)
+            return True
+        except httpx.HTTPError as e:
+            logger.info(f'Prewarm exception{e}: Origin: {origin}')
+            return False
+
+    if not origins or connections < 1:
+        return
+
+    with ThreadPoolExecutor(max_workers=min(len(origins) * connections, 64)) as executor:
+        # an origin that cannot be reached is not tried again by every other connection
+        reachable_origins = [origin for origin, is_reachable in zip(origins, executor.map(head, origins))
+                             if is_reachable]
+        for origin in reachable_origins:
+            for _ in range(connections - 1):
+                executor.submit(head, origin)
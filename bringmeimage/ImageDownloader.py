@@ -0,0 +1,253 @@
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from bringmeimage.BringMeImageData import ImageData
+from bringmeimage.FolderIndex import FolderIndex
+from bringmeimage.Metrics import metrics
+from bringmeimage.RetryPolicy import ClassifiedError, FailureReason
+from bringmeimage.config import Download_Chunk_Size, Download_Dedup, Download_Dedup_Hardlink
+from bringmeimage.LoggerConf import get_logger
+logger = get_logger(__name__)
+
+if TYPE_CHECKING:
+    import httpx
+
+# held while a final name is picked and taken, so two downloads of the same name cannot both take it
+Save_Path_Lock = threading.Lock()
+
+
+class ImageDownloader:
+    """
+    Download an image into save_dir, and record it in the manifest of the folder_index (if given).
+    With dedup, the content is hashed while it streams, and an image whose content is already in the folder
+    is not stored again.
+    The TTFB, the transfer and file write time and the size of every download are observed in the metrics.
+    (Without Qt, it is shared by the DownloadRunner of the GUI and the headless mode)
+    """
+    def __init__(self, httpx_client: 'httpx.Client', image_data: ImageData, save_dir: Path,
+                 folder_index: FolderIndex | None = None, dedup: bool = Download_Dedup):
+        self.httpx_client = httpx_client
+        self.image_data = image_data
+        self.save_dir = save_dir
+        self.folder_index = folder_index
+        self.dedup = dedup and folder_index is not None
+        self.content_hash = None
+
+    def download(self) -> Path:
+        """
+        :return: the file that holds the image
+        :raise: any exception of the download, the .part file is kept if it can be resumed later
+        """
+        src = self.image_data.src
+        part_path = None
+        try:
+            self.save_dir.mkdir(parents=True, exist_ok=True)
+            part_path = self.get_part_path(src)
+
+            if not self.download_to_part(src, part_path, resume=True):
+                # the range cannot be used (e.g. the image has changed), start over from byte zero
+                self.download_to_part(src, part_path, resume=False)
+            self.get_validators_path(part_path).unlink(missing_ok=True)
+            with metrics.timer('download_commit_seconds'):
+                if self.dedup:
+                    save_path = self.commit_deduplicated(part_path, src)
+                else:
+                    save_path = self.commit(part_path, src)
+            if self.folder_index:
+                self.folder_index.add_downloaded(self.image_data, save_path.name)
+            return save_path
+        except Exception:
+            # keep the .part file for resuming later, unless the server gives nothing to validate it with
+            if part_path and not self.get_validators_path(part_path).exists():
+                part_path.unlink(missing_ok=True)
+            raise
+
+    def download_to_part(self, src: str, part_path: Path, resume: bool) -> bool:
+        """
+        Stream the image into the .part file. Only a chunk is held in memory at a time.
+        If there is a .part file left by an interrupted download of the same src, only the rest of it is requested.
+        :param src:
+        :param part_path:
+        :param resume: set False to discard the .part file
+        :return: False if the range cannot be used: the server responds 416 (Range Not Satisfiable), or 206 with
+                 another range than the one requested
+        :raise ClassifiedError: the size of the .part file is not the size of the image told by the server
+        """
+        validators_path = self.get_validators_path(part_path)
+        offset = 0
+        headers = {}
+        if resume and (if_range := self.load_if_range(validators_path, src)) and part_path.exists():
+            offset = part_path.stat().st_size
+            headers = {'Range': f'bytes={offset}-', 'If-Range': if_range}
+        else:
+            validators_path.unlink(missing_ok=True)
+
+        request_start = time.perf_counter()
+        with self.httpx_client.stream('GET', src, headers=headers) as r:
+            metrics.observe('download_ttfb_seconds', time.perf_counter() - request_start)
+            if r.status_code == 416:
+                validators_path.unlink(missing_ok=True)
+                return False
+            r.raise_for_status()
+
+            # 200 means the server sends the whole image (no range support, or the image has changed)
+            is_resumed = r.status_code == 206
+            if is_resumed and not (offset and r.headers.get('Content-Range', '').startswith(f'bytes {offset}-')):
+                # a part that was not asked for can neither be appended nor taken for the whole image
+                part_path.unlink(missing_ok=True)
+                validators_path.unlink(missing_ok=True)
+                if offset:
+                    return False
+                raise ClassifiedError(FailureReason.OTHER,
+                                      message=f'Unexpected partial content ({r.headers.get("Content-Range")})')
+            expected_size = self.get_expected_size(r.headers, offset if is_resumed else 0)
+            self.save_validators(validators_path, src, r.headers)
+            if self.dedup:
+                self.content_hash = self.hash_file(part_path) if is_resumed else hashlib.sha256()
+            # the time spent in f.write() is the file write time, the rest of the loop is the transfer time
+            transfer_start = time.perf_counter()
+            write_seconds = 0.0
+            size = 0
+            with open(part_path, 'ab' if is_resumed else 'wb') as f:
+                for chunk in r.iter_bytes(chunk_size=Download_Chunk_Size):
+                    write_start = time.perf_counter()
+                    f.write(chunk)
+                    write_seconds += time.perf_counter() - write_start
+                    size += len(chunk)
+                    if self.content_hash:
+                        self.content_hash.update(chunk)
+            metrics.observe('download_transfer_seconds', time.perf_counter() - transfer_start - write_seconds)
+            metrics.observe('file_write_seconds', write_seconds)
+            metrics.observe('download_size_bytes', size)
+            metrics.increment('download_bytes_total', size)
+
+        if expected_size is not None and (part_size := part_path.stat().st_size) != expected_size:
+            if part_size > expected_size:
+                # it cannot be resumed, the .part file is removed
+                validators_path.unlink(missing_ok=True)
+            raise ClassifiedError(FailureReason.NETWORK,
+                                  message=f'Incomplete image: {part_size} of {expected_size} bytes')
+        return True
+
+    @staticmethod
+    def get_expected_size(headers: 'httpx.Headers', offset: int) -> int | None:
+        """
+        :param headers:
+        :param offset: the size of the .part file the body is appended to
+        :return: the size of the whole image, told by Content-Range (bytes start-end/size) or Content-Length,
+                 or None if it is unknown (e.g. the body is compressed)
+        """
+        if content_range := headers.get('Content-Range', ''):
+            size = content_range.rpartition('/')[2]
+            return int(size) if size.isdigit() else None
+        content_length = headers.get('Content-Length', '')
+        if content_length.isdigit() and headers.get('Content-Encoding', 'identity') in ('', 'identity'):
+            return offset + int(content_length)
+        return None
+
+    def commit(self, part_path: Path, src: str) -> Path:
+        """
+        Give the .part file its final name
+        :param part_path:
+        :param src:
+        :return: the file that holds the image
+        """
+        with Save_Path_Lock:
+            save_path = self.get_save_path(src)
+            part_path.replace(save_path)
+        return save_path
+
+    def commit_deduplicated(self, part_path: Path, src: str) -> Path:
+        """
+        Give the .part file its final name, unless the same content is already in the folder
+        :param part_path:
+        :param src:
+        :return: the file that holds the image
+        """
+        sha256 = self.content_hash.hexdigest()
+        with self.folder_index.lock:
+            if existing_file := self.folder_index.find_file_by_hash(sha256):
+                part_path.unlink()
+                logger.info(f'Same content as {existing_file.name}: Image src: {self.image_data.src}')
+                if not Download_Dedup_Hardlink:
+                    return existing_file
+                with Save_Path_Lock:
+                    save_path = self.get_save_path(src)
+                    save_path.hardlink_to(existing_file)
+                return save_path
+
+            save_path = self.commit(part_path, src)
+            self.folder_index.add_hash(sha256, save_path.name)
+            return save_path
+
+    @staticmethod
+    def hash_file(file: Path):
+        content_hash = hashlib.sha256()
+        with file.open('rb') as f:
+            while chunk := f.read(Download_Chunk_Size):
+                content_hash.update(chunk)
+        return content_hash
+
+    @staticmethod
+    def get_validators_path(part_path: Path) -> Path:
+        return part_path.with_name(f'{part_path.name}.json')
+
+    @staticmethod
+    def load_if_range(validators_path: Path, src: str) -> str | None:
+        """
+        Read the validator (ETag or Last-Modified) saved with the .part file
+        :param validators_path:
+        :param src: the validators of a different src are ignored
+        :return: the value of the If-Range header
+        """
+        try:
+            with validators_path.open() as f:
+                validators = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if validators.get('src') != src:
+            return None
+        return validators.get('etag') or validators.get('last_modified')
+
+    @staticmethod
+    def save_validators(validators_path: Path, src: str, headers: 'httpx.Headers') -> None:
+        # A weak ETag cannot be used in If-Range
+        etag = headers.get('ETag', '')
+        validators = {
+            'src': src,
+            'etag': '' if etag.startswith('W/') else etag,
+            'last_modified': headers.get('Last-Modified', ''),
+        }
+        if validators['etag'] or validators['last_modified']:
+            with validators_path.open('w') as f:
+                json.dump(validators, f)
+        else:
+            validators_path.unlink(missing_ok=True)
+
+    def get_part_path(self, src: str) -> Path:
+        """
+        The .part file is named after the hash of the src: the downloads of different images never share one
+        (even if their file names are the same), and a download of the same src finds it to resume
+        """
+        return self.save_dir / f'{hashlib.sha256(src.encode()).hexdigest()[:32]}.part'
+
+    def get_save_path(self, src: str) -> Path:
+        """
+        The file name of the src, with a "(repeat)", "(repeat 2)", ... suffix until the name is free.
+        Call it with Save_Path_Lock held, and take the name before the lock is released.
+        """
+        full_img_name = src.rsplit('/', maxsplit=1)[-1]
+        img_name, extension = full_img_name.rsplit('.', maxsplit=1)
+        img_name = img_name[:20] if len(img_name) > 20 else img_name
+        save_path = self.save_dir / f'{img_name}.{extension}'
+        repeat = 1
+        while save_path.exists():
+            suffix = '(repeat)' if repeat == 1 else f'(repeat {repeat})'
+            save_path = self.save_dir / f'{img_name}{suffix}.{extension}'
+            repeat += 1
+        return save_path
@@ -0,0 +1,46 @@
+from pathlib import Path
+
+from PySide6.QtCore import QObject, Signal, QRunnable, Slot
+
+from bringmeimage.UrlParser import iter_urls_in_file
+from bringmeimage.LoggerConf import get_logger
+logger = get_logger(__name__)
+
+
+class ImportRunnerSignals(QObject):
+    # a batch of new ImageData
+    import_batch_signal = Signal(list)
+    # the error message ('' if the whole file is scanned)
+    import_finished_signal = Signal(str)
+
+
+class ImportRunner(QRunnable):
+    """
+    Scan a text, HTML or bookmarks-export file in the thread pool, and report the URLs that match the parsing rules
+    in batches, so a large file neither blocks the GUI nor queues one event per URL
+    """
+    Batch_Size = 5000
+
+    def __init__(self, file: Path, for_civitai: bool):
+        super().__init__()
+        self.signals = ImportRunnerSignals()
+        self.file = file
+        self.for_civitai = for_civitai
+
+    @Slot()
+    def run(self) -> None:
+        error = ''
+        batch = []
+        try:
+            for url_data in iter_urls_in_file(self.file, self.for_civitai):
+                batch.append(url_data)
+                if len(batch) >= self.Batch_Size:
+                    self.signals.import_batch_signal.emit(batch)
+                    batch = []
+        except OSError as e:
+            logger.info(f'Import exception{e}: File: {self.file}')
+            error = str(e)
+        finally:
+            if batch:
+                self.signals.import_batch_signal.emit(batch)
+            self.signals.import_finished_signal.emit(error)
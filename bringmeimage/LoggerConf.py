@@ -1,4 +1,57 @@
+import atexit
+import json
 import logging.config
+import queue
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from itertools import count
+from logging.handlers import QueueHandler, QueueListener
+from typing import Iterator
+
+from bringmeimage.config import Log_File, Log_File_Max_Bytes, Log_File_Backups
+
+
+# The fields (e.g. batch, url) added to every record logged within log_context()
+Log_Context: ContextVar[dict[str, str]] = ContextVar('log_context', default={})
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copy the fields of the current log_context() into the record, in the thread that logs it
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.context = Log_Context.get()
+        return True
+
+
+class LocalQueueHandler(QueueHandler):
+    """
+    Put the record into the queue as it is. The queue never leaves the process, so the record does not need to be
+    formatted and copied (by QueueHandler.prepare) in the logging thread; the handlers of the listener format it.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    One JSON object per record, with the fields of its log_context(), e.g.
+        {"time": "...", "level": "INFO", "logger": "...", "thread": "...", "message": "...", "batch": "...",
+         "url": "..."}
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+            **getattr(record, 'context', {}),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
 
 
 LOGGING_CONFIG = {
@@ -8,24 +61,90 @@ LOGGING_CONFIG = {
             "class": "logging.StreamHandler",
             "formatter": "normal",
             "stream": "ext://sys.stderr"
+        },
+        # count the records by level in the metrics of the batch
+        "metrics": {
+            "class": "bringmeimage.Metrics.LogRecordCounter"
         }
     },
     "formatters": {
         "normal": {
             "format": "[%(asctime)s] %(name)s %(levelname)s %(message)s",
             "datefmt": "%Y-%m-%d %H:%M:%S",
+        },
+        "json_lines": {
+            "()": JsonLinesFormatter
         }
     },
     'loggers': {
         '': {
-            'handlers': ['console'],
+            'handlers': ['console', 'metrics'],
             'level': 'INFO',
         }
     }
 }
+if Log_File:
+    Log_File.parent.mkdir(parents=True, exist_ok=True)
+    LOGGING_CONFIG['handlers']['file'] = {
+        "class": "logging.handlers.RotatingFileHandler",
+        "formatter": "json_lines",
+        "filename": str(Log_File),
+        "maxBytes": Log_File_Max_Bytes,
+        "backupCount": Log_File_Backups,
+        "encoding": "utf-8"
+    }
+    LOGGING_CONFIG['loggers']['']['handlers'].append('file')
 
 logging.config.dictConfig(LOGGING_CONFIG)
 
 
+def start_queue_listener() -> QueueListener:
+    """
+    Move the handlers of the root logger behind a queue. A logging thread only puts the record into the queue,
+    and the handlers (stderr, the file, ...) run in the thread of the listener, so the download threads neither
+    wait for the I/O nor contend on the locks of the handlers.
+    :return:
+    """
+    root_logger = logging.getLogger()
+    handlers = list(root_logger.handlers)
+    log_queue = queue.SimpleQueue()
+    queue_handler = LocalQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    for handler in handlers:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(queue_handler)
+
+    queue_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    queue_listener.start()
+    # the records still in the queue are handled before the program exits
+    atexit.register(queue_listener.stop)
+    return queue_listener
+
+
+Queue_Listener = start_queue_listener()
+
+
+@contextmanager
+def log_context(**fields: str) -> Iterator[None]:
+    """
+    Add the fields (e.g. batch=..., url=...) to every record logged in the block by this thread (or asyncio task)
+    """
+    token = Log_Context.set({**Log_Context.get(), **fields})
+    try:
+        yield
+    finally:
+        Log_Context.reset(token)
+
+
+Batch_Numbers = count(1)
+
+
+def new_batch_id() -> str:
+    """
+    :return: e.g. '20240101-120000-1'
+    """
+    return f'{datetime.now().strftime("%Y%m%d-%H%M%S")}-{next(Batch_Numbers)}'
+
+
 def get_logger(name: str):
     return logging.getLogger(name)
@@ -57,7 +57,7 @@ class LoginWindow(QDialog):
         self.note_label_1 = self.create_label('3. The program will attempt to re-login.(check)')
         self.v_layout.addWidget(self.note_label_1)
 
-        self.note_label_2 = self.create_label('   (May be a brief freezing during the process)')
+        self.note_label_2 = self.create_label('   (It runs in the background)')
         self.v_layout.addWidget(self.note_label_2)
 
         self.v_layout.setStretch(0, 1)
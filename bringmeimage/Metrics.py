@@ -0,0 +1,247 @@
+# Per-stage metrics of a batch, shared by the workers (resolvers, downloaders) of the GUI and the headless mode.
+#     with metrics.timer('download_ttfb_seconds'):
+#         ...
+#     metrics.observe('resolve_seconds', elapsed, resolver='browser')
+#     metrics.increment('download_bytes_total', len(chunk))
+# Every stage is kept as a histogram with fixed buckets (count, sum, min, max and estimated percentiles), so recording
+# is O(1) and the memory does not grow with the batch. At the end of a batch the metrics are written as a JSON summary,
+# and optionally as a Prometheus text exposition file (e.g. for the textfile collector of node_exporter).
+import json
+import logging
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+
+Metric_Prefix = 'bringmeimage_'
+# seconds: 1 ms - 2 min
+Seconds_Buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# bytes: 16 KiB - 64 MiB
+Bytes_Buckets = tuple(16 * 1024 * 4 ** n for n in range(7))
+
+
+class Histogram:
+    """
+    Number of values in each bucket (not cumulative, the last bucket is +Inf). Not thread-safe by itself.
+    """
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """
+        Estimate the percentile by linear interpolation within its bucket
+        :param q: 0 - 100
+        :return:
+        """
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                value = lower + (upper - lower) * (rank - seen) / bucket_count
+                return min(max(value, self.min), self.max)
+            seen += bucket_count
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else 0.0,
+            'min': round(self.min, 6) if self.count else 0.0,
+            'max': round(self.max, 6) if self.count else 0.0,
+            'p50': round(self.percentile(50), 6),
+            'p90': round(self.percentile(90), 6),
+            'p99': round(self.percentile(99), 6),
+            'buckets': {str(bucket): count for bucket, count in zip((*self.buckets, '+Inf'), self.counts)},
+        }
+
+
+def format_key(name: str, labels: tuple[tuple[str, str], ...]) -> str:
+    """
+    :return: e.g. 'resolve_seconds{resolver="browser"}'
+    """
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{label}="{value}"' for label, value in labels) + '}'
+
+
+class MetricsRegistry:
+    """
+    Histograms and counters of the current batch, keyed by name and labels. Safe to use from any thread.
+    The unit of a histogram is told by its name: '*_seconds' or '*_bytes'.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.histograms: dict[tuple[str, tuple], Histogram] = {}
+        self.counters: dict[tuple[str, tuple], float] = {}
+        self.started_at = datetime.now()
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if not (histogram := self.histograms.get(key)):
+                histogram = Histogram(Bytes_Buckets if name.endswith('_bytes') else Seconds_Buckets)
+                self.histograms[key] = histogram
+            histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        """
+        Observe the seconds taken by the block (also when it raises)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self) -> None:
+        """
+        Start a new batch
+        """
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.started_at = datetime.now()
+
+    def get_histogram(self, name: str, **labels: str) -> Histogram | None:
+        with self.lock:
+            return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'finished_at': datetime.now().isoformat(timespec='seconds'),
+                'histograms': {format_key(name, labels): histogram.to_dict()
+                               for (name, labels), histogram in sorted(self.histograms.items())},
+                'counters': {format_key(name, labels): value
+                             for (name, labels), value in sorted(self.counters.items())},
+            }
+
+    def format_summary(self) -> str:
+        """
+        One line with the median (p90) of every histogram, e.g. for the operation log
+        """
+        with self.lock:
+            return ' | '.join(
+                f'{format_key(name, labels)} '
+                + (f'{histogram.percentile(50) * 1000:.0f} ({histogram.percentile(90) * 1000:.0f}) ms'
+                   if name.endswith('_seconds')
+                   else f'{histogram.percentile(50) / 1024:.0f} ({histogram.percentile(90) / 1024:.0f}) KiB')
+                for (name, labels), histogram in sorted(self.histograms.items()) if histogram.count
+            )
+
+    def write_json(self, file: Path, **extra) -> Path:
+        """
+        Write the summary of the batch
+        :param file:
+        :param extra: added to the top level, e.g. images=120
+        :return: the file
+        """
+        file.parent.mkdir(parents=True, exist_ok=True)
+        with file.open('w', encoding='utf-8') as f:
+            json.dump({**extra, **self.summary()}, f, indent=2)
+        return file
+
+    def write_prometheus(self, file: Path) -> Path:
+        """
+        Write the metrics in the Prometheus text exposition format. The file is replaced atomically, so a collector
+        never reads a partial file.
+        :param file:
+        :return: the file
+        """
+        lines = []
+        with self.lock:
+            declared = set()
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = Metric_Prefix + name
+                if metric not in declared:
+                    declared.add(metric)
+                    lines.append(f'# TYPE {metric} histogram')
+                cumulative = 0
+                for bucket, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{format_key(metric + "_bucket", (*labels, ("le", str(bucket))))} {cumulative}')
+                lines.append(f'{format_key(metric + "_sum", labels)} {histogram.sum}')
+                lines.append(f'{format_key(metric + "_count", labels)} {histogram.count}')
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = Metric_Prefix + name
+                if metric not in declared:
+                    declared.add(metric)
+                    lines.append(f'# TYPE {metric} counter')
+                lines.append(f'{format_key(metric, labels)} {value}')
+
+        file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = file.with_name(f'{file.name}.tmp')
+        temp_file.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+        temp_file.replace(file)
+        return file
+
+
+class LogRecordCounter(logging.Handler):
+    """
+    Count the log records by level (e.g. the exceptions logged by the workers) in the shared registry
+    """
+    def emit(self, record: logging.LogRecord) -> None:
+        metrics.increment('log_records_total', level=record.levelname)
+
+
+def prune_batch_files(folder: Path, keep: int) -> None:
+    """
+    Keep only the newest `keep` batch summaries (batch-*.json) in the folder
+    """
+    if keep <= 0:
+        return
+    for file in sorted(folder.glob('batch-*.json'))[:-keep]:
+        file.unlink(missing_ok=True)
+
+
+def write_batch_metrics(folder: Path | None, prometheus_file: Path | None = None, keep: int = 0,
+                        **extra) -> Path | None:
+    """
+    Write the metrics of the finished batch: a JSON summary into the folder (batch-(timestamp).json), and the
+    Prometheus text file (if given)
+    :param folder: None to skip the JSON summary
+    :param prometheus_file:
+    :param keep: number of the JSON summaries kept in the folder (0 for all)
+    :param extra: added to the JSON summary
+    :return: the JSON summary
+    """
+    json_file = None
+    if folder:
+        json_file = metrics.write_json(folder / f'batch-{datetime.now().strftime("%Y%m%d-%H%M%S-%f")}.json', **extra)
+        prune_batch_files(folder, keep)
+    if prometheus_file:
+        metrics.write_prometheus(prometheus_file)
+    return json_file
+
+
+# The registry of the process
+metrics = MetricsRegistry()
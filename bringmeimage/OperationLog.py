@@ -0,0 +1,107 @@
+import logging
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from PySide6.QtCore import QAbstractListModel, QModelIndex, QPersistentModelIndex, Qt, QTimer
+from PySide6.QtGui import QColor
+from PySide6.QtWidgets import QListView
+
+from bringmeimage.config import (Operation_Log_Max_Lines, Operation_Log_File, Operation_Log_File_Max_Bytes,
+                                 Operation_Log_File_Backups)
+
+
+class OperationLogModel(QAbstractListModel):
+    """
+    Model of the operation log in the main window. Only the last `max_lines` lines are kept (the oldest are
+    trimmed at a flush), and the lines appended within Flush_Interval are added to the view at once, so memory
+    and the cost of an append stay the same however long the session runs.
+    The lines are a list, not a deque: data() is called for every painted row, and a deque is O(n) to index.
+    With a log_file, every line is also written to a rotating file.
+    """
+    Flush_Interval = 100
+
+    def __init__(self, max_lines: int = Operation_Log_Max_Lines, log_file: Path | None = Operation_Log_File,
+                 parent=None):
+        super().__init__(parent)
+        self.max_lines = max(1, max_lines)
+        self.lines: list[tuple[str, str]] = []
+        self.pending_lines: list[tuple[str, str]] = []
+        self.views: list[QListView] = []
+
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(self.Flush_Interval)
+        self.flush_timer.timeout.connect(self.flush)
+
+        self.file_logger: logging.Logger | None = None
+        if log_file:
+            log_file.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(log_file, maxBytes=Operation_Log_File_Max_Bytes,
+                                          backupCount=Operation_Log_File_Backups, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            # a private logger, the lines must not reach the console handler of the root logger
+            self.file_logger = logging.Logger('operation_log')
+            self.file_logger.addHandler(handler)
+
+    def rowCount(self, parent: QModelIndex | QPersistentModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.lines)
+
+    def data(self, index: QModelIndex | QPersistentModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self.lines):
+            return None
+        text, color = self.lines[index.row()]
+        if role in (Qt.DisplayRole, Qt.ToolTipRole):
+            return text
+        if role == Qt.ForegroundRole and color:
+            return QColor(color)
+        return None
+
+    def attach_view(self, view: QListView) -> None:
+        """
+        Show the log in the view, the view follows the new lines while it is scrolled to the bottom
+        :param view:
+        :return:
+        """
+        view.setModel(self)
+        view.setUniformItemSizes(True)
+        self.views.append(view)
+
+    def append(self, text: str, color: str = '') -> None:
+        """
+        Add a line, it is shown with the next flush
+        :param text:
+        :param color: e.g. 'green', '' for the default color
+        :return:
+        """
+        self.pending_lines.append((text, color))
+        if self.file_logger:
+            self.file_logger.info(text)
+        if not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self) -> None:
+        if not self.pending_lines:
+            return
+        max_lines = self.max_lines
+        pending_lines = self.pending_lines[-max_lines:]
+        self.pending_lines = []
+        following_views = [view for view in self.views
+                           if view.verticalScrollBar().value() == view.verticalScrollBar().maximum()]
+
+        overflow = len(self.lines) + len(pending_lines) - max_lines
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            del self.lines[:overflow]
+            self.endRemoveRows()
+
+        self.beginInsertRows(QModelIndex(), len(self.lines), len(self.lines) + len(pending_lines) - 1)
+        self.lines.extend(pending_lines)
+        self.endInsertRows()
+
+        for view in following_views:
+            view.scrollToBottom()
+
+    def close(self) -> None:
+        if self.file_logger:
+            for handler in self.file_logger.handlers:
+                handler.close()
@@ -0,0 +1,92 @@
+import asyncio
+from typing import TYPE_CHECKING, Callable
+
+from PySide6.QtCore import QObject, Signal, QRunnable, Slot
+
+from bringmeimage.BringMeImageData import ImageData
+from bringmeimage.Resolver import BatchResolver
+from bringmeimage.config import Parse_Concurrency, Parse_With_Api
+from bringmeimage.LoggerConf import get_logger, log_context
+logger = get_logger(__name__)
+
+if TYPE_CHECKING:
+    from bringmeimage.BrowserLogin import BrowserSession
+
+
+class ParseRunnerSignals(QObject):
+    # (the completed ImageData, the failed ImageData) since the last report
+    parse_results_signal = Signal(list, list)
+    # (gallery, the new images of a page)
+    parse_expanded_signal = Signal(ImageData, list)
+    parse_finished_signal = Signal()
+
+
+class ParseRunner(QRunnable):
+    """
+    Run a BatchResolver on an asyncio event loop that lives in the pool thread (or on the loop of the BrowserSession,
+    to reuse its logged-in browser). The results are reported in chunks by parse_results_signal, every
+    Report_Interval seconds or every Report_Size results, so the GUI handles one signal per chunk instead of per image.
+    The galleries (model, model-version and post pages) in image_datas are expanded, and their images are reported
+    by parse_expanded_signal (right away) before their results.
+    """
+    Report_Interval = 0.1
+    Report_Size = 200
+
+    def __init__(self, cookies: list[dict], image_datas: list[ImageData], concurrency: int = Parse_Concurrency,
+                 with_api: bool = Parse_With_Api, skip_image: Callable[[ImageData], bool] | None = None,
+                 batch_id: str = '', browser_session: 'BrowserSession | None' = None,
+                 listed_urls: list[str] | None = None):
+        """
+        :param listed_urls: the other URLs already in the list, not reported again when a gallery contains them
+        """
+        super().__init__()
+        self.signals = ParseRunnerSignals()
+        self.image_datas = image_datas
+        self.listed_urls = listed_urls or []
+        self.batch_id = batch_id
+        self.browser_session = browser_session
+        # the results not reported yet, only touched on the event loop
+        self.completed: list[ImageData] = []
+        self.failed: list[ImageData] = []
+        self.report_handle: asyncio.TimerHandle | None = None
+        self.batch_resolver = BatchResolver(cookies=cookies,
+                                            on_completed=lambda image_data: self.add_result(image_data, True),
+                                            on_failed=lambda image_data: self.add_result(image_data, False),
+                                            concurrency=concurrency,
+                                            with_api=with_api,
+                                            on_expanded=self.signals.parse_expanded_signal.emit,
+                                            skip_image=skip_image,
+                                            browser_context=browser_session.context if browser_session else None)
+
+    @Slot()
+    def run(self) -> None:
+        try:
+            # the tasks of the event loop inherit the context of this thread
+            with log_context(batch=self.batch_id):
+                if self.browser_session:
+                    self.browser_session.run(self.resolve_all())
+                else:
+                    asyncio.run(self.resolve_all())
+        finally:
+            self.signals.parse_finished_signal.emit()
+
+    async def resolve_all(self) -> None:
+        try:
+            await self.batch_resolver.resolve_all(self.image_datas, self.listed_urls)
+        finally:
+            self.report_results()
+
+    def add_result(self, image_data: ImageData, is_completed: bool) -> None:
+        (self.completed if is_completed else self.failed).append(image_data)
+        if len(self.completed) + len(self.failed) >= self.Report_Size:
+            self.report_results()
+        elif not self.report_handle:
+            self.report_handle = asyncio.get_running_loop().call_later(self.Report_Interval, self.report_results)
+
+    def report_results(self) -> None:
+        if self.report_handle:
+            self.report_handle.cancel()
+            self.report_handle = None
+        if self.completed or self.failed:
+            completed, failed, self.completed, self.failed = self.completed, self.failed, [], []
+            self.signals.parse_results_signal.emit(completed, failed)
@@ -0,0 +1,128 @@
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable
+
+from bringmeimage.config import Resolve_Cache_TTL, Resolve_Cache_Max_Entries
+from bringmeimage.LoggerConf import get_logger
+logger = get_logger(__name__)
+
+
+class ResolveCache:
+    """
+    On-disk (SQLite) cache of the resolved image src, keyed by imageId.
+    A batch is looked up at once (get_many), and the new src are buffered and written in one transaction per flush.
+    """
+    # number of the image ids in one SELECT (below the SQLite limit of host parameters)
+    Query_Chunk_Size = 500
+    Flush_Size = 500
+
+    def __init__(self, db_file: Path, ttl: int = Resolve_Cache_TTL, max_entries: int = Resolve_Cache_Max_Entries):
+        db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(db_file)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS resolve_cache ('
+                                'image_id TEXT PRIMARY KEY, '
+                                'src TEXT NOT NULL, '
+                                'resolved_at REAL NOT NULL, '
+                                'accessed_at REAL NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS idx_accessed_at ON resolve_cache (accessed_at)')
+        self.connection.commit()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits: int = 0
+        self.lookups: int = 0
+        self.pending: dict[str, str] = {}
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.lookups = 0
+
+    def get(self, image_id: str) -> str | None:
+        """
+        Return the cached src of the image, or None if it is not cached or has expired
+        :param image_id:
+        :return:
+        """
+        return self.get_many([image_id]).get(image_id)
+
+    def get_many(self, image_ids: Iterable[str]) -> dict[str, str]:
+        """
+        Look up the cached src of a batch of images with one query per chunk, and mark the hits as used in one
+        transaction
+        :param image_ids:
+        :return: {image_id: src} of the images that are cached and have not expired
+        """
+        image_ids = list(dict.fromkeys(image_id for image_id in image_ids if image_id))
+        self.lookups += len(image_ids)
+        if not image_ids:
+            return {}
+
+        self.flush()
+        now = time.time()
+        srcs = {}
+        for index in range(0, len(image_ids), self.Query_Chunk_Size):
+            chunk = image_ids[index:index + self.Query_Chunk_Size]
+            rows = self.connection.execute(
+                f'SELECT image_id, src FROM resolve_cache '
+                f'WHERE resolved_at > ? AND image_id IN ({", ".join("?" * len(chunk))})',
+                (now - self.ttl, *chunk)
+            ).fetchall()
+            srcs.update(rows)
+
+        self.hits += len(srcs)
+        if srcs:
+            with self.connection:
+                self.connection.executemany('UPDATE resolve_cache SET accessed_at = ? WHERE image_id = ?',
+                                            [(now, image_id) for image_id in srcs])
+        return srcs
+
+    def put(self, image_id: str, src: str) -> None:
+        """
+        Buffer the resolved src, it is written with the others by flush() (called when Flush_Size are buffered)
+        :param image_id:
+        :param src:
+        :return:
+        """
+        if not image_id or not src:
+            return
+
+        self.pending[image_id] = src
+        if len(self.pending) >= self.Flush_Size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the buffered src in one transaction
+        :return:
+        """
+        if not self.pending:
+            return
+
+        now = time.time()
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO resolve_cache VALUES (?, ?, ?, ?)',
+                                        [(image_id, src, now, now) for image_id, src in self.pending.items()])
+        self.pending.clear()
+
+    def evict(self) -> None:
+        """
+        Delete the expired entries, then the least recently used entries beyond max_entries
+        :return:
+        """
+        self.flush()
+        self.connection.execute('DELETE FROM resolve_cache WHERE resolved_at <= ?', (time.time() - self.ttl,))
+        self.connection.execute('DELETE FROM resolve_cache WHERE image_id IN ('
+                                'SELECT image_id FROM resolve_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                                (self.max_entries,))
+        self.connection.commit()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+            self.connection.close()
+        except sqlite3.Error as e:
+            logger.info(f'Close resolve cache exception{e}')
@@ -0,0 +1,583 @@
+import asyncio
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Iterable
+from urllib.parse import urlparse, parse_qsl
+
+from bringmeimage.BringMeImageData import ImageData
+from bringmeimage.Metrics import metrics
+from bringmeimage.RetryPolicy import (RetryPolicy, ClassifiedError, FailureReason, classify_status, parse_retry_after,
+                                      classify_exception)
+from bringmeimage.config import (Chrome_Path, Parse_Concurrency, Civitai_Image_Api_Url, Api_Timeout, Api_Concurrency,
+                                 Parse_Block_Resources, Parse_Blocked_Resource_Types, Parse_Blocked_Hosts,
+                                 Parse_Timeout, Parse_With_Api, Gallery_Page_Size, Gallery_Max_Images)
+from bringmeimage.LoggerConf import get_logger, log_context
+logger = get_logger(__name__)
+
+# Playwright and httpx are imported by the resolvers when they start, so importing this module stays cheap
+if TYPE_CHECKING:
+    import httpx
+    from playwright.async_api import Browser, BrowserContext, Page, Playwright, Request, Route
+
+
+Image_Selector = '.relative.flex.size-full.items-center.justify-center img'
+
+
+class ImageResolver(ABC):
+    """
+    Interface of the strategies that retrieve the image src of an ImageData.
+    resolve() returns the src, or None if it cannot be found. A failure whose reason is known is raised as
+    ClassifiedError, any other exception is classified by classify_exception().
+    """
+    name = 'resolver'
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def resolve(self, image_data: ImageData) -> str | None:
+        ...
+
+
+class BrowserResolver(ImageResolver):
+    """
+    Retrieve the image src from civitai.com image pages with a pool of pages that share one logged-in browser context.
+    Up to `concurrency` pages are browsed at the same time.
+    The logged-in context of a BrowserSession can be given (shared_context), then only the pages are opened and closed
+    by this resolver, and the browser is not launched for the batch. It must belong to the running event loop.
+    """
+    name = 'browser'
+
+    def __init__(self, cookies: list[dict], concurrency: int = Parse_Concurrency,
+                 block_resources: bool = Parse_Block_Resources, timeout: int = Parse_Timeout,
+                 shared_context: 'BrowserContext | None' = None) -> None:
+        self.cookies = cookies
+        self.shared_context = shared_context
+        self.concurrency = max(1, concurrency)
+        self.block_resources = block_resources
+        self.timeout = timeout
+        self.playwright: 'Playwright | None' = None
+        self.browser: 'Browser | None' = None
+        self.context: 'BrowserContext | None' = None
+        self.idle_pages: 'asyncio.Queue[Page] | None' = None
+        self.pages: 'list[Page]' = []
+
+    async def start(self) -> None:
+        """
+        Launch the browser and load the cookies of the logged-in context (unless a live shared context is given),
+        and open the pages of the pool
+        :return:
+        """
+        if (self.shared_context and self.shared_context.browser
+                and self.shared_context.browser.is_connected()):
+            self.context = self.shared_context
+        else:
+            from playwright.async_api import async_playwright
+
+            self.playwright = await async_playwright().start()
+            self.browser = await self.playwright.chromium.launch(
+                executable_path=Chrome_Path, headless=True, args=['--disable-blink-features=AutomationControlled'])
+            self.context = await self.browser.new_context()
+            await self.context.add_cookies(self.cookies)
+
+        self.idle_pages = asyncio.Queue()
+        for _ in range(self.concurrency):
+            page = await self.context.new_page()
+            self.pages.append(page)
+            # routed by page, so nothing is left on a shared context
+            if self.block_resources:
+                await page.route('**/*', self.handle_route)
+            self.idle_pages.put_nowait(page)
+
+    async def close(self) -> None:
+        try:
+            for page in self.pages:
+                await page.close()
+            if self.context and self.context is not self.shared_context:
+                await self.context.close()
+            if self.browser:
+                await self.browser.close()
+        except Exception as e:
+            logger.info(f'Close browser exception{e}')
+        finally:
+            if self.playwright:
+                await self.playwright.stop()
+
+    async def resolve(self, image_data: ImageData) -> str | None:
+        """
+        Wait for an idle page of the pool and use it to retrieve the image src
+        :param image_data: ImageData of https://civitai.com/images/(imageId)
+        :return: the image src, or None if it cannot be found
+        """
+        with metrics.timer('resolve_queue_wait_seconds', resolver=self.name):
+            page = await self.idle_pages.get()
+        try:
+            with metrics.timer('resolve_seconds', resolver=self.name):
+                return await self.parse_image_scr(page, image_data)
+        finally:
+            self.idle_pages.put_nowait(page)
+
+    @staticmethod
+    async def handle_route(route: 'Route') -> None:
+        """
+        Abort the requests that are not needed to find the image src
+        :param route:
+        :return:
+        """
+        request = route.request
+        if (request.resource_type in Parse_Blocked_Resource_Types
+                or (urlparse(request.url).hostname or '').endswith(Parse_Blocked_Hosts)):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def parse_image_scr(self, page: 'Page', image_data: ImageData) -> str | None:
+        """
+        Browse the image page and take the image src from whichever comes first:
+        the request of the image (network), or the src of the <img> (DOM).
+        :param page:
+        :param image_data:
+        :return: the image src, or None if it cannot be found
+        :raise ClassifiedError: if the page responds with an error status or the time budget is exhausted
+        """
+        image_request: asyncio.Future[str] = asyncio.get_running_loop().create_future()
+
+        def handle_request(request: 'Request') -> None:
+            if (not image_request.done() and request.resource_type == 'image'
+                    and self.is_main_image(request.url, image_data.imageId)):
+                image_request.set_result(request.url)
+
+        page.on('request', handle_request)
+        try:
+            return await asyncio.wait_for(self.browse(page, image_data.url, image_request), timeout=self.timeout / 1000)
+        except asyncio.TimeoutError:
+            raise ClassifiedError(FailureReason.TIMEOUT, message=f'Parse timeout({self.timeout} ms)')
+        finally:
+            page.remove_listener('request', handle_request)
+
+    async def browse(self, page: 'Page', img_url: str, image_request: asyncio.Future[str]) -> str | None:
+        response = await page.goto(img_url, wait_until='commit')
+        if response and not response.ok:
+            # e.g. 404 for a removed image, there is no need to wait for the <img>
+            raise ClassifiedError(classify_status(response.status),
+                                  retry_after=parse_retry_after(response.headers.get('retry-after')),
+                                  message=f'Image page status {response.status}')
+
+        # wait <img src=...>
+        image_element_src = asyncio.ensure_future(self.wait_image_element_src(page))
+        try:
+            done, _ = await asyncio.wait({image_request, image_element_src}, return_when=asyncio.FIRST_COMPLETED)
+            if image_request in done:
+                return image_request.result()
+            return image_element_src.result()
+        finally:
+            # also on the timeout of parse_image_scr: the wait must be over before the page goes back to the pool,
+            # or it would be resolved by the next image page loaded in it
+            image_element_src.cancel()
+            await asyncio.gather(image_element_src, return_exceptions=True)
+
+    async def wait_image_element_src(self, page: 'Page') -> str | None:
+        await page.wait_for_selector(selector=f'{Image_Selector}[src]', timeout=self.timeout)
+        return await page.eval_on_selector(selector=Image_Selector, expression="img => img.src")
+
+    @staticmethod
+    def is_main_image(url: str, image_id: str) -> bool:
+        """
+        The main image of the page is named by its imageId, e.g. https://image.civitai.com/.../width=1024/2805528.jpeg
+        :param url:
+        :param image_id:
+        :return:
+        """
+        if not image_id:
+            return False
+        img_name = urlparse(url).path.rsplit('/', maxsplit=1)[-1]
+        return img_name.split('.', maxsplit=1)[0] == image_id
+
+
+class ApiResolver(ImageResolver):
+    """
+    Retrieve the image src from the JSON payload of the civitai.com REST API with a plain HTTP request.
+    The saved cookies are sent along, so the images that require login can also be resolved.
+    At most `concurrency` requests are sent at a time, the rest wait for a free slot without a timeout.
+    """
+    name = 'api'
+
+    def __init__(self, cookies: list[dict], api_url: str = Civitai_Image_Api_Url, timeout: float = Api_Timeout,
+                 concurrency: int = Api_Concurrency) -> None:
+        self.cookies = cookies
+        self.api_url = api_url
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+        self.client: 'httpx.AsyncClient | None' = None
+        self.semaphore: asyncio.Semaphore | None = None
+
+    async def start(self) -> None:
+        import httpx
+
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.client = httpx.AsyncClient(cookies=self.to_httpx_cookies(self.cookies),
+                                        timeout=httpx.Timeout(self.timeout, pool=None),
+                                        limits=httpx.Limits(max_connections=self.concurrency,
+                                                            max_keepalive_connections=self.concurrency),
+                                        follow_redirects=True)
+
+    async def close(self) -> None:
+        if self.client:
+            await self.client.aclose()
+
+    async def resolve(self, image_data: ImageData) -> str | None:
+        """
+        Request the image information by imageId
+        :param image_data: ImageData of https://civitai.com/images/(imageId)
+        :return: the image src, or None if it cannot be found
+        """
+        if not image_data.imageId:
+            return None
+
+        async with self.semaphore:
+            with metrics.timer('resolve_seconds', resolver=self.name):
+                r = await self.client.get(self.api_url, params={'imageId': image_data.imageId, 'nsfw': 'X'})
+        r.raise_for_status()
+        # hint: {"items": [{"id": 2805528, "url": "https://image.civitai.com/.../2805528.jpeg", ...}], "metadata": {}}
+        for item in r.json().get('items', []):
+            if str(item.get('id')) == image_data.imageId and item.get('url'):
+                return item['url']
+
+    @staticmethod
+    def to_httpx_cookies(cookies: list[dict]) -> 'httpx.Cookies':
+        """
+        Convert the cookies of a playwright browser context into httpx.Cookies
+        :param cookies: [{'name': ..., 'value': ..., 'domain': ..., 'path': ..., ...}, ...]
+        :return:
+        """
+        import httpx
+
+        httpx_cookies = httpx.Cookies()
+        for cookie in cookies:
+            httpx_cookies.set(cookie['name'], cookie['value'],
+                              domain=cookie.get('domain', ''),
+                              path=cookie.get('path', '/'))
+        return httpx_cookies
+
+
+class GalleryExpander:
+    """
+    Expand a model, model-version or post page into the ImageData of its images by walking the image listing of the
+    civitai.com REST API page by page (cursor pagination). The listing carries the image src, so the expanded images
+    do not need to be resolved again.
+    """
+    name = 'gallery'
+
+    def __init__(self, cookies: list[dict], api_url: str = Civitai_Image_Api_Url, timeout: float = Api_Timeout,
+                 page_size: int = Gallery_Page_Size, max_images: int = Gallery_Max_Images,
+                 retry_policy: RetryPolicy | None = None) -> None:
+        self.cookies = cookies
+        self.api_url = api_url
+        self.timeout = timeout
+        self.page_size = page_size
+        self.max_images = max_images
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.client: 'httpx.AsyncClient | None' = None
+
+    async def start(self) -> None:
+        import httpx
+
+        self.client = httpx.AsyncClient(cookies=ApiResolver.to_httpx_cookies(self.cookies),
+                                        timeout=self.timeout,
+                                        follow_redirects=True)
+
+    async def close(self) -> None:
+        if self.client:
+            await self.client.aclose()
+
+    async def iter_pages(self, gallery: ImageData) -> AsyncIterator[list[ImageData]]:
+        """
+        Yield the images of the gallery one page at a time, the next page is only requested when the caller asks
+        :param gallery: ImageData whose `gallery` is the query of the listing, e.g. 'modelVersionId=130072'
+        :return:
+        """
+        params = dict(parse_qsl(gallery.gallery))
+        cursor = None
+        seen_cursors = set()
+        count = 0
+        while True:
+            payload = await self.fetch_page(params, cursor)
+            image_datas = [self.to_image_data(item) for item in payload.get('items', []) if item.get('id')]
+            if self.max_images > 0:
+                image_datas = image_datas[:self.max_images - count]
+            count += len(image_datas)
+            if image_datas:
+                yield image_datas
+
+            # hint: {"items": [...], "metadata": {"nextCursor": "2805528|1700000000", "nextPage": "https://..."}}
+            cursor = (payload.get('metadata') or {}).get('nextCursor')
+            if cursor is None or str(cursor) in seen_cursors or 0 < self.max_images <= count:
+                return
+            seen_cursors.add(str(cursor))
+
+    async def fetch_page(self, params: dict[str, str], cursor: str | None) -> dict:
+        """
+        Request a page of the listing, a retryable failure is retried at the same cursor
+        :param params: the query of the gallery
+        :param cursor: None for the first page
+        :return: the JSON payload
+        """
+        query = {**params, 'limit': self.page_size, 'nsfw': 'X'}
+        if cursor is not None:
+            query['cursor'] = cursor
+        attempt = 0
+        while True:
+            try:
+                with metrics.timer('gallery_page_seconds'):
+                    r = await self.client.get(self.api_url, params=query)
+                r.raise_for_status()
+                return r.json()
+            except Exception as e:
+                reason, retry_after = classify_exception(e)
+                delay = self.retry_policy.get_delay(attempt, reason, retry_after)
+                if delay is None:
+                    raise
+                attempt += 1
+                logger.info(f'Gallery page exception{e}, retry {attempt} in {delay:.1f}s: Query: {query}')
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def to_image_data(item: dict) -> ImageData:
+        image_id = str(item['id'])
+        image_data = ImageData(url=f'https://civitai.com/images/{image_id}', imageId=image_id)
+        if item.get('url'):
+            image_data.src = item['url']
+            image_data.is_parsed = True
+        return image_data
+
+
+class LazyResolver:
+    """
+    Start a resolver (or the GalleryExpander) the first time it is needed.
+    If the start fails, it will not be tried again in this batch.
+    """
+    def __init__(self, factory: Callable[[], ImageResolver | GalleryExpander]) -> None:
+        self.factory = factory
+        self.name = ImageResolver.name
+        self.resolver: ImageResolver | GalleryExpander | None = None
+        self.error: Exception | None = None
+        self.lock = asyncio.Lock()
+
+    async def get(self) -> ImageResolver | GalleryExpander:
+        async with self.lock:
+            if self.error:
+                raise self.error
+            if not self.resolver:
+                resolver = self.factory()
+                self.name = resolver.name
+                try:
+                    await resolver.start()
+                except Exception as e:
+                    self.error = e
+                    raise
+                self.resolver = resolver
+        return self.resolver
+
+    async def close(self) -> None:
+        if self.resolver:
+            await self.resolver.close()
+
+
+def get_default_resolver_factories(cookies: list[dict], concurrency: int = Parse_Concurrency,
+                                   with_api: bool = Parse_With_Api, browser_context: 'BrowserContext | None' = None
+                                   ) -> list[Callable[[], ImageResolver]]:
+    """
+    The REST API first (if with_api), then the browser
+    :param browser_context: the logged-in context reused by the browser resolver (see BrowserResolver)
+    :return:
+    """
+    resolver_factories = [lambda: BrowserResolver(cookies=cookies, concurrency=concurrency,
+                                                  shared_context=browser_context)]
+    if with_api:
+        resolver_factories.insert(0, lambda: ApiResolver(cookies=cookies))
+    return resolver_factories
+
+
+class BatchResolver:
+    """
+    Retrieve the src of all images in one batch. The images are resolved concurrently on the running event loop,
+    and every result is reported by the callbacks as soon as it is known.
+    The resolvers are tried in order (by default, the REST API and then the browser), each one is only started
+    when an image gets to it. Retryable failures (e.g. 429, 5xx, timeout) are retried after a backoff,
+    according to the RetryPolicy.
+    A gallery (model, model-version or post page) is expanded page by page: the new images of every page are reported
+    by on_expanded and then resolved (or reported as completed right away if the listing has their src) while the
+    next page is being fetched. The gallery itself is reported by on_completed/on_failed once it is fully expanded.
+    """
+    # the server asks to slow down, falling back to the next resolver would not help
+    Back_Off_Reasons = {FailureReason.RATE_LIMITED, FailureReason.SERVER_ERROR}
+
+    def __init__(self, cookies: list[dict], on_completed: Callable[[ImageData], None],
+                 on_failed: Callable[[ImageData], None], concurrency: int = Parse_Concurrency,
+                 with_api: bool = Parse_With_Api,
+                 resolver_factories: list[Callable[[], ImageResolver]] | None = None,
+                 retry_policy: RetryPolicy | None = None,
+                 on_expanded: Callable[[ImageData, list[ImageData]], None] | None = None,
+                 gallery_expander_factory: Callable[[], GalleryExpander] | None = None,
+                 skip_image: Callable[[ImageData], bool] | None = None,
+                 browser_context: 'BrowserContext | None' = None) -> None:
+        """
+        :param on_expanded: called with (gallery, new images of a page)
+        :param skip_image: the expanded images for which it returns True are dropped (e.g. already downloaded)
+        :param browser_context: the logged-in context of a BrowserSession, reused by the default browser resolver
+        """
+        self.on_completed = on_completed
+        self.on_failed = on_failed
+        self.on_expanded = on_expanded
+        self.skip_image = skip_image
+        if resolver_factories is None:
+            resolver_factories = get_default_resolver_factories(cookies, concurrency, with_api, browser_context)
+        self.resolver_factories = resolver_factories
+        self.retry_policy = retry_policy or RetryPolicy()
+        if gallery_expander_factory is None:
+            gallery_expander_factory = lambda: GalleryExpander(cookies=cookies, retry_policy=self.retry_policy)
+        self.gallery_expander_factory = gallery_expander_factory
+        self.reported: set[str] = set()
+        self.seen_urls: set[str] = set()
+        self.image_datas: list[ImageData] = []
+        self.tasks: set[asyncio.Task] = set()
+        self.lazy_resolvers: list[LazyResolver] = []
+        self.lazy_gallery_expander: LazyResolver | None = None
+
+    async def resolve_all(self, image_datas: list[ImageData], listed_urls: Iterable[str] = ()) -> None:
+        """
+        :param image_datas: the images to resolve and the galleries to expand
+        :param listed_urls: the other URLs already in the list (e.g. the parsed ones), the expanded images with
+                            these URLs are not reported as new
+        """
+        self.lazy_resolvers = [LazyResolver(factory) for factory in self.resolver_factories]
+        self.lazy_gallery_expander = LazyResolver(self.gallery_expander_factory)
+        self.image_datas = list(image_datas)
+        self.seen_urls = {image_data.url for image_data in image_datas}
+        self.seen_urls.update(listed_urls)
+        try:
+            for image_data in image_datas:
+                self.start_task(self.expand_one(image_data) if image_data.gallery else self.resolve_one(image_data))
+            # the expansion of a gallery keeps adding tasks
+            while self.tasks:
+                done, _ = await asyncio.wait(self.tasks, return_when=asyncio.FIRST_EXCEPTION)
+                self.tasks -= done
+                for task in done:
+                    task.result()
+        except Exception as e:
+            logger.info(f'Batch resolver exception{e}')
+            for task in self.tasks:
+                task.cancel()
+            # every image that has not been reported is regarded as failed
+            for image_data in self.image_datas:
+                if image_data.url not in self.reported:
+                    image_data.fail_reason = classify_exception(e)[0].value
+                    self.on_failed(image_data)
+        finally:
+            for lazy_resolver in [*self.lazy_resolvers, self.lazy_gallery_expander]:
+                await lazy_resolver.close()
+
+    def start_task(self, coroutine) -> None:
+        self.tasks.add(asyncio.ensure_future(coroutine))
+
+    async def expand_one(self, gallery: ImageData) -> None:
+        with log_context(url=gallery.url):
+            await self.expand_gallery(gallery)
+
+    async def expand_gallery(self, gallery: ImageData) -> None:
+        count = 0
+        try:
+            gallery_expander = await self.lazy_gallery_expander.get()
+            async for page in gallery_expander.iter_pages(gallery):
+                new_image_datas = []
+                for image_data in page:
+                    if image_data.url in self.seen_urls:
+                        continue
+                    self.seen_urls.add(image_data.url)
+                    if not (self.skip_image and self.skip_image(image_data)):
+                        new_image_datas.append(image_data)
+                if not new_image_datas:
+                    continue
+
+                count += len(new_image_datas)
+                self.image_datas.extend(new_image_datas)
+                if self.on_expanded:
+                    self.on_expanded(gallery, new_image_datas)
+                for image_data in new_image_datas:
+                    if image_data.is_parsed:
+                        self.reported.add(image_data.url)
+                        self.on_completed(image_data)
+                    else:
+                        self.start_task(self.resolve_one(image_data))
+        except Exception as e:
+            logger.info(f'Expand exception{e}: Gallery url: {gallery.url}')
+            gallery.fail_reason = classify_exception(e)[0].value
+            self.reported.add(gallery.url)
+            self.on_failed(gallery)
+            return
+
+        logger.info(f'Expand {count} new images: Gallery url: {gallery.url}')
+        self.reported.add(gallery.url)
+        gallery.fail_reason = ''
+        self.on_completed(gallery)
+
+    async def resolve_one(self, image_data: ImageData) -> None:
+        with log_context(url=image_data.url):
+            await self.resolve_image(image_data)
+
+    async def resolve_image(self, image_data: ImageData) -> None:
+        img_src = None
+        attempt = 0
+        while True:
+            try:
+                img_src = await self.resolve(image_data, attempt)
+                break
+            except Exception as e:
+                reason, retry_after = classify_exception(e)
+                image_data.fail_reason = reason.value
+                delay = self.retry_policy.get_delay(attempt, reason, retry_after)
+                if delay is None:
+                    logger.info(f'Parse exception{e}: Image url: {image_data.url}')
+                    break
+                attempt += 1
+                logger.info(f'Parse exception{e}, retry {attempt} in {delay:.1f}s: Image url: {image_data.url}')
+                await asyncio.sleep(delay)
+
+        self.reported.add(image_data.url)
+        metrics.increment('resolves_total', result='completed' if img_src else 'failed')
+        if img_src:
+            image_data.src = img_src
+            image_data.is_parsed = True
+            image_data.fail_reason = ''
+            self.on_completed(image_data)
+        else:
+            self.on_failed(image_data)
+
+    async def resolve(self, image_data: ImageData, attempt: int = 0) -> str:
+        """
+        Try the resolvers in order, the failure of a resolver falls back to the next one.
+        A 429 or 5xx is not a reason to fall back: it is raised to be retried after a backoff, until the retries
+        are used up.
+        :param image_data:
+        :param attempt: number of retries that have been made
+        :return: the image src
+        :raise: the failure of the last resolver, or the 429 or 5xx of a resolver
+        """
+        for lazy_resolver in self.lazy_resolvers[:-1]:
+            try:
+                resolver = await lazy_resolver.get()
+                if img_src := await resolver.resolve(image_data):
+                    return img_src
+            except Exception as e:
+                reason, retry_after = classify_exception(e)
+                if (reason in self.Back_Off_Reasons
+                        and self.retry_policy.get_delay(attempt, reason, retry_after) is not None):
+                    raise
+                logger.info(f'Parse by {lazy_resolver.name} exception{e}: Image url: {image_data.url}')
+
+        resolver = await self.lazy_resolvers[-1].get()
+        if img_src := await resolver.resolve(image_data):
+            return img_src
+        raise ClassifiedError(FailureReason.PARSE_MISS)
@@ -0,0 +1,103 @@
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from enum import StrEnum
+
+from bringmeimage.config import Retry_Max_Retries, Retry_Base_Delay, Retry_Max_Delay
+
+
+class FailureReason(StrEnum):
+    TIMEOUT = 'Timeout'
+    NETWORK = 'Network error'
+    RATE_LIMITED = 'Rate limited (429)'
+    SERVER_ERROR = 'Server error (5xx)'
+    CLIENT_ERROR = 'Client error (4xx)'
+    PARSE_MISS = 'Image src not found'
+    OTHER = 'Other error'
+
+
+Retryable_Reasons = {FailureReason.TIMEOUT, FailureReason.NETWORK, FailureReason.RATE_LIMITED,
+                     FailureReason.SERVER_ERROR}
+
+
+class ClassifiedError(Exception):
+    """
+    Raised when the reason of a failure is already known, e.g. the image page responds with an error status
+    """
+    def __init__(self, reason: FailureReason, retry_after: float | None = None, message: str = '') -> None:
+        super().__init__(message or reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def classify_status(status_code: int) -> FailureReason:
+    if status_code == 429:
+        return FailureReason.RATE_LIMITED
+    if status_code >= 500:
+        return FailureReason.SERVER_ERROR
+    return FailureReason.CLIENT_ERROR
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Parse the value of a Retry-After header, which is either seconds or an HTTP date
+    :param value:
+    :return: seconds to wait, or None if there is no (valid) value
+    """
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def classify_exception(e: Exception) -> tuple[FailureReason, float | None]:
+    """
+    Find out the reason of a failure
+    :param e:
+    :return: (reason, seconds of Retry-After or None)
+    """
+    if isinstance(e, ClassifiedError):
+        return e.reason, e.retry_after
+    # imported here, not at the top, to keep them out of the startup
+    import httpx
+    from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+    if isinstance(e, httpx.HTTPStatusError):
+        return classify_status(e.response.status_code), parse_retry_after(e.response.headers.get('Retry-After'))
+    if isinstance(e, (TimeoutError, httpx.TimeoutException, PlaywrightTimeoutError)):
+        return FailureReason.TIMEOUT, None
+    if isinstance(e, (ConnectionError, httpx.TransportError)):
+        return FailureReason.NETWORK, None
+    return FailureReason.OTHER, None
+
+
+class RetryPolicy:
+    """
+    Decide whether and when a failure is retried (exponential backoff with jitter)
+    """
+    def __init__(self, max_retries: int = Retry_Max_Retries, base_delay: float = Retry_Base_Delay,
+                 max_delay: float = Retry_Max_Delay) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt: int, reason: FailureReason, retry_after: float | None = None) -> float | None:
+        """
+        :param attempt: number of retries that have been made
+        :param reason:
+        :param retry_after: seconds of the Retry-After header (if any)
+        :return: seconds to wait before retrying, or None if it should not be retried
+        """
+        if reason not in Retryable_Reasons or attempt >= self.max_retries:
+            return None
+
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = random.uniform(delay / 2, delay)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
@@ -1,10 +1,11 @@
 # QDialog window for copying URLs that match the parsing rules.
+# Every URL in the copied text is clipped, so a copied page section with many links can be clipped at once.
 # Supported formats:
 #     for civitai.com:
 #         "https://civitai.com/images/(\d+)"
 #     for general picture file:
 #         ".+\.(png|jpeg|jpg)$"
-import re
+from pathlib import Path
 
 from PySide6.QtCore import Signal, Qt, QTimer
 from PySide6.QtGui import QFont
@@ -12,6 +13,9 @@ from PySide6.QtWidgets import (QApplication, QDialog, QVBoxLayout, QPushButton,
                                QMessageBox, QLabel)
 
 from bringmeimage.BringMeImageData import ImageData
+from bringmeimage.ClipRecord import append_record
+from bringmeimage.UrlParser import parse_url, find_url_candidates
+from bringmeimage.config import Clip_Poll_Interval
 from bringmeimage.LoggerConf import get_logger
 logger = get_logger(__name__)
 
@@ -22,10 +26,12 @@ class StartClipWindow(QDialog):
     """
     Start_Clip_Close_Window_Signal = Signal(dict)
 
-    def __init__(self, for_civitai: bool, urls: dict, parent=None):
+    def __init__(self, for_civitai: bool, urls: dict, record_file: Path | None = None, parent=None):
         super().__init__(parent)
         self.for_civitai = for_civitai
         self.urls = urls
+        # every new URL is appended to the record file (if any) as soon as it is clipped
+        self.record_file = record_file
         self.initUI()
 
         # Dialog always stay on
@@ -34,13 +40,14 @@ class StartClipWindow(QDialog):
         self.setWindowFlag(Qt.WindowStaysOnTopHint)
         self.show()
 
-        self.clipboard_text_list = []
+        # every processed clipboard text, so a text is only parsed once
+        self.clipboard_texts: set[str] = set()
+        self.last_clipboard_text = ''
         self.isStarted = False
 
-        self.for_civitai_pattern = re.compile(r"https://civitai.com/images/(?P<imageId>\d+)")
-        self.normal_pattern = re.compile(r"http.+\.(png|jpeg|jpg)$")
-
         self.clipboard = QApplication.clipboard()
+        # The clipboard is read whenever it changes. The timer is only a fallback for the platforms that do not
+        # notify the changes made by other applications while this one is not active.
         self.timer_for_update_clipboard = QTimer()
         self.timer_for_update_clipboard.timeout.connect(self.update_clipboard)
         self.start_clip_button.clicked.connect(self.start_or_stop_clip)
@@ -107,20 +114,24 @@ class StartClipWindow(QDialog):
 
     def start_or_stop_clip(self) -> None:
         """
-        Set up the clip button. Once activated, read the contents of the clipboard at intervals of 1000ms.
+        Set up the clip button. Once activated, read the contents of the clipboard every time it changes.
         :return: None
         """
         if self.isStarted:
             self.isStarted = False
             self.start_clip_button.setText('Start')
+            self.clipboard.dataChanged.disconnect(self.update_clipboard)
             self.timer_for_update_clipboard.stop()
             self.finish_clip_button.setEnabled(True)
         else:
             self.clipboard.clear()
+            self.last_clipboard_text = ''
             self.isStarted = True
             self.start_clip_button.setText('Stop')
             self.finish_clip_button.setEnabled(False)
-            self.timer_for_update_clipboard.start(1000)
+            self.clipboard.dataChanged.connect(self.update_clipboard)
+            if Clip_Poll_Interval > 0:
+                self.timer_for_update_clipboard.start(Clip_Poll_Interval)
 
     def finish_clip(self) -> None:
         """
@@ -131,22 +142,35 @@ class StartClipWindow(QDialog):
 
     def update_clipboard(self) -> None:
         """
-        Read the contents of the clipboard and parse them.
-        The content will be recorded in self.clipboard_text_list to avoid duplicate processing.
+        Read the contents of the clipboard and parse every URL in them.
+        The content will be recorded in self.clipboard_texts to avoid duplicate processing.
         :return:
         """
         mime_data = self.clipboard.mimeData()
-        if mime_data.hasText():
-            url = mime_data.text()
-            if url in self.clipboard_text_list:
-                logger.info(f'URL already processed: {url}')
-            else:
-                self.clipboard_text_list.append(url)
-                if url_data := self.initial_parse(url):
-                    self.urls.update({url: url_data})
-                    self.count_label.setText(f'Clip: {len(self.urls)}')
-
-            self.clipboard.clear()
+        if not mime_data or not mime_data.hasText():
+            return
+        text = mime_data.text()
+        if text == self.last_clipboard_text:
+            # notified (or polled) again without a new copy
+            return
+        self.last_clipboard_text = text
+        if text in self.clipboard_texts:
+            logger.info(f'URL already processed: {text[:200]}')
+            return
+        self.clipboard_texts.add(text)
+
+        new_url_datas = []
+        url_candidates = list(find_url_candidates(text))
+        if not url_candidates:
+            logger.info(f'URL cannot parse: {text[:200]}')
+        for url in url_candidates:
+            if url_data := self.initial_parse(url):
+                self.urls[url] = url_data
+                new_url_datas.append(url_data)
+        if new_url_datas:
+            self.count_label.setText(f'Clip: {len(self.urls)}')
+            if self.record_file:
+                append_record(self.record_file, new_url_datas)
 
     def initial_parse(self, url: str) -> ImageData | None:
         """
@@ -154,16 +178,7 @@ class StartClipWindow(QDialog):
         :param url: the URL obtained from the clipboard
         :return:
         """
-        img_data = None
-        if self.for_civitai:
-            if match := self.for_civitai_pattern.match(url):
-                img_data = ImageData(url=url, imageId=match.group('imageId'))
-            elif self.normal_pattern.match(url):
-                img_data = ImageData(url=url, src=url, is_parsed=True)
-        else:
-            if self.normal_pattern.match(url):
-                img_data = ImageData(url=url, src=url, is_parsed=True)
-
+        img_data = parse_url(url, self.for_civitai)
         if img_data:
             if url not in self.urls:
                 return img_data
@@ -0,0 +1,115 @@
+# Parsing rules of the clipped URLs
+#     for civitai.com:
+#         "https://civitai.com/images/(\d+)"
+#         "https://civitai.com/models/(\d+)...[?modelVersionId=(\d+)]" and "https://civitai.com/posts/(\d+)",
+#         which are expanded into the images of the model (version) or post
+#     for general picture file:
+#         ".+\.(png|jpeg|jpg)$"
+import html
+import re
+from pathlib import Path
+from typing import Iterator
+from urllib.parse import urlparse, parse_qs
+
+from bringmeimage.BringMeImageData import ImageData
+
+
+For_Civitai_Pattern = re.compile(r"https://civitai.com/images/(?P<imageId>\d+)")
+Model_Pattern = re.compile(r"https://civitai.com/models/(?P<modelId>\d+)")
+Post_Pattern = re.compile(r"https://civitai.com/posts/(?P<postId>\d+)")
+Normal_Pattern = re.compile(r"http.+\.(png|jpeg|jpg)$")
+# Anything that looks like a URL in a block of text (e.g. a copied page section or HTML)
+Url_Candidate_Pattern = re.compile(r"""https?://[^\s"'<>]+""")
+Url_Trailing_Punctuation = '.,;:!?)]}'
+Url_Delimiters = ' \t\r\n"\'<>'
+# A file is scanned in chunks of this many characters, at most Max_Url_Length of them are carried over to the next
+File_Chunk_Size = 1024 * 1024
+Max_Url_Length = 8192
+
+
+def parse_url(url: str, for_civitai: bool) -> ImageData | None:
+    """
+    If url is legal, return a ImageData object
+    :param url:
+    :param for_civitai: also accept the image, model and post pages of civitai.com
+    :return: None if the url does not match the parsing rules
+    """
+    if for_civitai:
+        if match := For_Civitai_Pattern.match(url):
+            return ImageData(url=url, imageId=match.group('imageId'))
+        if gallery := get_gallery_query(url):
+            return ImageData(url=url, gallery=gallery)
+    if Normal_Pattern.match(url):
+        return ImageData(url=url, src=url, is_parsed=True)
+
+
+def get_gallery_query(url: str) -> str:
+    """
+    Find the image listing of a model, model-version or post page
+    :param url: e.g. https://civitai.com/models/4201/realistic-vision?modelVersionId=130072
+    :return: the query of the listing API (e.g. 'modelVersionId=130072'), '' if it is not such a page
+    """
+    if match := Post_Pattern.match(url):
+        return f'postId={match.group("postId")}'
+    if match := Model_Pattern.match(url):
+        model_version_ids = parse_qs(urlparse(url).query).get('modelVersionId')
+        if model_version_ids and model_version_ids[0].isdigit():
+            return f'modelVersionId={model_version_ids[0]}'
+        return f'modelId={match.group("modelId")}'
+    return ''
+
+
+def find_url_candidates(text: str) -> Iterator[str]:
+    """
+    Find everything that looks like a URL in the text, without the punctuation that follows it in a sentence
+    :param text:
+    :return:
+    """
+    for match in Url_Candidate_Pattern.finditer(text):
+        url = match.group().rstrip(Url_Trailing_Punctuation)
+        if '&' in url:
+            # e.g. href="...?a=1&amp;b=2"
+            url = html.unescape(url)
+        yield url
+
+
+def extract_urls(text: str, for_civitai: bool) -> Iterator[ImageData]:
+    """
+    Extract every URL of the text that matches the parsing rules (duplicates included)
+    :param text:
+    :param for_civitai:
+    :return:
+    """
+    for url in find_url_candidates(text):
+        if url_data := parse_url(url, for_civitai):
+            yield url_data
+
+
+def iter_urls_in_file(file: Path, for_civitai: bool, chunk_size: int = File_Chunk_Size) -> Iterator[ImageData]:
+    """
+    Scan a text, HTML or bookmarks-export file of any size in chunks, and extract every URL that matches the
+    parsing rules. The duplicates in the file are skipped.
+    :param file:
+    :param for_civitai:
+    :param chunk_size: characters read at a time
+    :return:
+    """
+    seen_urls: set[str] = set()
+    tail = ''
+    with file.open(encoding='utf-8', errors='replace', newline='') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            text = tail + chunk
+            if chunk:
+                # a URL at the end of the chunk may continue in the next one, keep it for the next round
+                cut = max(text.rfind(delimiter) for delimiter in Url_Delimiters) + 1
+                # a run without a delimiter is scanned too, only a URL-length tail of it is kept
+                cut = max(cut, len(text) - Max_Url_Length)
+                text, tail = text[:cut], text[cut:]
+            for url in find_url_candidates(text):
+                if url not in seen_urls:
+                    seen_urls.add(url)
+                    if url_data := parse_url(url, for_civitai):
+                        yield url_data
+            if not chunk:
+                return
@@ -1,3 +1,5 @@
+from pathlib import Path
+
 """
 Since Civitai.com requires login to view sensitive images,
 the following two variables are used to determine whether the automatic login is successful.
@@ -7,7 +9,151 @@ If the model is removed, please manually update it to another sensitive model.
 Login_Check_Url = r'https://civitai.com/models/10364/innies-better-vulva'
 Login_Check_Title = r'Innies: Better vulva - v1.1 | Stable Diffusion LoRA | Civitai'
 
+"""
+When the program starts, the login with the saved cookies is checked in the background (if there are saved cookies),
+so civitai.com is ready by the time the clipping is finished. Set it to False to log in only by double-clicking the
+login label.
+"""
+Login_At_Startup = True
+
 """
 This is the default Chrome installation path for macOS. If it’s different, please modify it.
 """
 Chrome_Path = r'/Applications/Google Chrome.app/Contents/MacOS/Google Chrome'
+
+"""
+Number of civitai.com image pages that are browsed concurrently when retrieving the image src (one browser context).
+Higher values are faster, but use more memory and make it more likely to be rate-limited by the server.
+"""
+Parse_Concurrency = 4
+
+"""
+Retrieve the image src from the JSON payload of the civitai.com REST API with a plain HTTP request (carrying the saved
+cookies) instead of rendering the image page. The browser is only used for the images that the API fails to resolve.
+Set Parse_With_Api to False to always use the browser.
+At most Api_Concurrency API requests are in flight at a time, the other images wait for their turn (the wait does not
+count toward Api_Timeout). A 429 or 5xx of the API is retried after a backoff (honoring Retry-After), and the image
+only falls back to the browser once the retries are used up.
+"""
+Parse_With_Api = True
+Civitai_Image_Api_Url = r'https://civitai.com/api/v1/images'
+Api_Timeout = 10
+Api_Concurrency = 16
+
+"""
+Model, model-version and post pages are expanded into their images by walking the image listing of the REST API
+(Civitai_Image_Api_Url), Gallery_Page_Size images per page. The images of a page are resolved and downloaded while
+the next page is being fetched. At most Gallery_Max_Images images are taken from one page URL (0 for no limit).
+"""
+Gallery_Page_Size = 100
+Gallery_Max_Images = 10000
+
+"""
+When browsing an image page, the requests of the blocked resource types and hosts are aborted to save bandwidth and time
+(the image request is still used to find the image src). An image page that cannot be resolved within Parse_Timeout
+milliseconds, or that responds with an error status (e.g. 404 for a removed image), is regarded as failed.
+"""
+Parse_Block_Resources = True
+Parse_Blocked_Resource_Types = ('image', 'media', 'font', 'stylesheet')
+Parse_Blocked_Hosts = ('google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'googlesyndication.com')
+Parse_Timeout = 15000
+
+"""
+The resolved image src are cached on disk (keyed by imageId), so the images that have been seen before are not browsed
+again. An entry expires after Resolve_Cache_TTL seconds, and the least recently used entries are evicted when there are
+more than Resolve_Cache_Max_Entries.
+"""
+Resolve_Cache_TTL = 30 * 24 * 60 * 60
+Resolve_Cache_Max_Entries = 200000
+
+"""
+Downloaded images are streamed to a "*.part" file in chunks of Download_Chunk_Size bytes, and renamed to the final name
+only when the download is complete.
+"""
+Download_Chunk_Size = 64 * 1024
+
+"""
+Connection pool of the HTTP client that is shared by all download threads (also adjustable in Option > Connection
+Settings). HTTP/2 needs the optional "h2" package (pip3 install h2), and it is ignored if the package is not installed.
+Before a batch starts, up to Http_Prewarm_Connections connections are opened to each image host (Http_Prewarm_Origins
+and the hosts of the image src in the list), so that the downloads do not pay for the TLS handshake.
+"""
+Download_Threads = 16
+Http_Max_Connections = 100
+Http_Max_Keepalive_Connections = 32
+Http_Keepalive_Expiry = 30.0
+Http_Http2 = False
+Http_Prewarm_Connections = 8
+Http_Prewarm_Origins = ('https://image.civitai.com',)
+
+"""
+A failed resolving or downloading is retried up to Retry_Max_Retries times if the failure is retryable (timeout,
+network error, 429 Too Many Requests or 5xx), after an exponential backoff with jitter: about Retry_Base_Delay * 2^n
+seconds (at most Retry_Max_Delay). If the server responds with a Retry-After header, it is honored.
+"""
+Retry_Max_Retries = 3
+Retry_Base_Delay = 2.0
+Retry_Max_Delay = 60.0
+
+"""
+Content-addressed deduplication: the SHA-256 of every downloaded image is kept in an index file in the storage folder,
+and an image whose content is already in the folder is not stored again. If Download_Dedup_Hardlink, a hard link to
+the existing file is made under the new name instead.
+"""
+Download_Dedup = False
+Download_Dedup_Hardlink = False
+
+"""
+Every downloaded image is recorded (by imageId and src) in the manifest of the storage folder. With
+Download_Skip_Existing, the images that are still in the folder are removed from the list before a batch starts.
+"""
+Download_Skip_Existing = True
+
+"""
+The progress bars are refreshed at this rate (times per second) from counters shared by all threads,
+however many images finish in between
+"""
+Progress_Refresh_Rate = 10
+
+"""
+While clipping, the clipboard is read whenever it changes. It is also polled at this interval (ms, 0 to disable) for
+the platforms that do not notify the changes made by other applications
+"""
+Clip_Poll_Interval = 250
+
+"""
+Locations of the files kept by the program
+"""
+Main_Path: Path = Path(__file__).parent
+Cookie_File: Path = Main_Path / 'cookie' / 'cookies.json'
+Resolve_Cache_File: Path = Main_Path / 'cache' / 'resolve_cache.sqlite3'
+Download_Dir: Path = Main_Path.parent / 'DownloadTemp'
+
+"""
+The log of the program goes to stderr and, as JSON lines with the batch and URL of each record, to Log_File (None to
+disable), which is rotated at Log_File_Max_Bytes (Log_File_Backups older files are kept). The log is written by
+a background thread, so logging does not slow down the download threads.
+"""
+Log_File: Path | None = Main_Path / 'log' / 'bringmeimage.jsonl'
+Log_File_Max_Bytes = 10 * 1024 * 1024
+Log_File_Backups = 5
+
+"""
+The operation log of the main window keeps the last Operation_Log_Max_Lines lines.
+With Operation_Log_File (e.g. Main_Path / 'log' / 'operation.log'), every line is also written to a rotating file
+of Operation_Log_File_Max_Bytes, and Operation_Log_File_Backups older files are kept.
+"""
+Operation_Log_Max_Lines = 5000
+Operation_Log_File: Path | None = None
+Operation_Log_File_Max_Bytes = 5 * 1024 * 1024
+Operation_Log_File_Backups = 3
+
+"""
+Per-stage metrics (resolve latency, download queue wait, TTFB, transfer and file write time, bytes) are kept for every
+batch, and written as a JSON summary into Metrics_Dir when the batch finishes (the newest Metrics_Keep_Batches files
+are kept, None to disable). With Metrics_Prometheus_File (e.g. Main_Path / 'metrics' / 'bringmeimage.prom'), the
+metrics of the last batch are also written in the Prometheus text format.
+"""
+Metrics_Dir: Path | None = Main_Path / 'metrics'
+Metrics_Keep_Batches = 50
+Metrics_Prometheus_File: Path | None = None